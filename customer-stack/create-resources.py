@@ -1,12 +1,19 @@
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
 import json
 import boto3
 import os
 import logging
+import queue
+import re
+import threading
+import time
 from botocore.exceptions import ClientError
 import requests
 
-import snowflake.connector
-
 SUCCESS = 'SUCCESS'
 FAILED = 'FAILED'
 EMPTY_RESPONSE_DATA = {}
@@ -15,9 +22,90 @@ EXTERNAL_ID = "external_id"
 SERVICE = "service"
 USER_ARN = "user_arn"
 
+STATEMENT_NAME = "name"
+STATEMENT_SQL = "sql"
+STATEMENT_DEPENDS_ON = "depends_on"
+STATEMENT_DDL_HASH = "ddl_hash"
+
+DDL_HASH_COMMENT_PREFIX = "Amazon SageMaker Autopilot integration ddl_hash="
+DDL_HASH_PATTERN = re.compile(re.escape(DDL_HASH_COMMENT_PREFIX) + "([0-9a-f]{64})")
+# Start of the body of a function definition, the comment goes right before it
+FUNCTION_BODY_PATTERN = re.compile(r"\bas\s+(?=\$\$|')", re.IGNORECASE)
+
+PHASE_NAME = "phase"
+PHASE_DETAIL = "detail"
+PHASE_DURATION_MS = "duration_ms"
+PHASE_QUERY_ID = "query_id"
+
+GET_SECRET_PHASE = "get_secret"
+CONNECT_PHASE = "connect"
+USE_DATABASE_SCHEMA_PHASE = "use_database_schema"
+DDL_PHASE = "ddl"
+DESCRIBE_INTEGRATION_PHASE = "describe_integration"
+UPDATE_ROLE_POLICY_PHASE = "update_assume_role_policy"
+REDEPLOY_API_PHASE = "redeploy_api"
+DEPLOY_TARGET_PHASE = "deploy_target"
+CLOUDFORMATION_RESPONSE_PHASE = "cloudformation_response"
+TOTAL_PHASE = "total"
+
+METRICS_NAMESPACE = "SageMakerSnowflakeIntegration"
+
+TASK_FUNCTION = "function"
+TASK_DEPENDS_ON = "depends_on"
+
+GET_SECRET_TASK = "get_secret"
+IMPORT_SNOWFLAKE_CONNECTOR_TASK = "import_snowflake_connector"
+SNOWFLAKE_CONNECTION_TASK = "snowflake_connection"
+EXISTING_DDL_HASHES_TASK = "existing_ddl_hashes"
+STORAGE_INTEGRATION_INFO_TASK = "storage_integration_info"
+API_INTEGRATION_INFO_TASK = "api_integration_info"
+STORAGE_ROLE_POLICY_TASK = "storage_role_policy"
+API_ROLE_POLICY_TASK = "api_role_policy"
+DEPLOY_TARGETS_TASK = "deploy_targets"
+REDEPLOY_API_TASK = "redeploy_api"
+
+DEFAULT_DDL_MAX_CONCURRENCY = 8
+DEFAULT_SECRET_CACHE_TTL_SECONDS = 300
+# Errors of the Snowflake login when the credentials of the secret were rotated or revoked: incorrect username or
+# password, expired authentication token, invalid key-pair JWT, invalid or expired OAuth access token
+SNOWFLAKE_AUTHENTICATION_ERRNOS = frozenset([390100, 390114, 390144, 390303, 390318])
+# The connector renews the session token with the master token, which is valid for 4 hours
+DEFAULT_SNOWFLAKE_SESSION_TTL_SECONDS = 3600
+# Sessions opened to deploy the functions into the additional database and schema pairs, one target at a time each
+DEFAULT_TARGET_SESSION_POOL_SIZE = 4
+# Length of the error of a failed target returned to CloudFormation, whose response Data is limited to 4 KB
+TARGET_ERROR_MAX_LENGTH = 200
+DEFAULT_PREDICT_OUTCOME_MAX_BATCH_ROWS = 100
+# Compression of the request bodies sent by Snowflake to API Gateway for the predict functions: AUTO, GZIP, DEFLATE
+# or NONE. API Gateway decompresses them before the integration when its content encoding is enabled
+DEFAULT_PREDICT_OUTCOME_COMPRESSION = "AUTO"
+# Names described in one call by the describe functions of the PROXY backend
+DESCRIBE_MAX_BATCH_ROWS = 100
+
+# Tag set by AWS_AUTOPILOT_CREATE_MODEL and AWS_AUTOPILOT_CREATE_ENDPOINT on the AutoML jobs and endpoints they
+# create, with the name of the stack as value, so that the status refresh only keeps the resources of its own stack
+STACK_TAG_KEY = "SnowflakeIntegrationStackName"
+
+# Inference response keys of the models created by AWS_AUTOPILOT_CREATE_PROBABILITY_MODEL, as read by
+# AWS_AUTOPILOT_PREDICT_OUTCOME_WITH_PROBABILITIES
+PROBABILITY_INFERENCE_OUTPUT = "predicted_label,probability,probabilities,labels"
+
+# Prefix of the S3 bucket under which the batch predictions read their input and write their output
+BATCH_TRANSFORM_S3_PREFIX = "batch-transform/"
+
+PREDICT_OUTCOME_ENDPOINT_BACKEND = "ENDPOINT"
+PREDICT_OUTCOME_PROXY_BACKEND = "PROXY"
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Kept across warm invocations of the Lambda
+aws_clients = {}
+secret_cache = {}
+snowflake_connection_cache = {}
+cache_statistics = collections.Counter()
+cache_lock = threading.Lock()
+
 def lambda_handler(event, context):
 
     # Get variables from os
@@ -37,10 +125,21 @@ def lambda_handler(event, context):
     database_name = os.environ['DatabaseName']
     schema_name = os.environ['SchemaName']
     apigw_type = os.environ['ApiGatewayType']
+    api_gateway_id = os.environ['ApiGatewayId']
+    api_gateway_stage_name = os.environ['ApiGatewayStageName']
+    ddl_max_concurrency = int(os.environ.get('DdlMaxConcurrency', DEFAULT_DDL_MAX_CONCURRENCY))
+    predict_outcome_max_batch_rows = int(os.environ.get('PredictOutcomeMaxBatchRows',
+                                                        DEFAULT_PREDICT_OUTCOME_MAX_BATCH_ROWS))
+    predict_outcome_backend = os.environ.get('PredictOutcomeBackend', PREDICT_OUTCOME_ENDPOINT_BACKEND)
+    predict_outcome_compression = os.environ.get('PredictOutcomeCompression', DEFAULT_PREDICT_OUTCOME_COMPRESSION)
+    additional_targets = os.environ.get('AdditionalTargets', '')
+    target_session_pool_size = int(os.environ.get('TargetSessionPoolSize', DEFAULT_TARGET_SESSION_POOL_SIZE))
 
     logger.info("api_gateway_url: " + api_gateway_url)
     logger.info("api_gateway_role_arn: " + api_gateway_role_arn)
     logger.info("api_gateway_role_name: " + api_gateway_role_name)
+    logger.info("api_gateway_id: " + api_gateway_id)
+    logger.info("api_gateway_stage_name: " + api_gateway_stage_name)
     logger.info("auto_ml_role_arn: " + auto_ml_role_arn)
     logger.info("auto_ml_role_name: " + auto_ml_role_name)
     logger.info("region_name: " + region_name)
@@ -54,84 +153,192 @@ def lambda_handler(event, context):
     logger.info("database_name: " + database_name)
     logger.info("schema_name: " + schema_name)
     logger.info("Snowflake resource suffix: " + os.environ['SnowflakeResourceSuffix'])
+    logger.info("ddl_max_concurrency: " + str(ddl_max_concurrency))
+    logger.info("predict_outcome_max_batch_rows: " + str(predict_outcome_max_batch_rows))
+    logger.info("predict_outcome_backend: " + predict_outcome_backend)
+    logger.info("predict_outcome_compression: " + predict_outcome_compression)
+    logger.info("additional_targets: " + additional_targets)
+    logger.info("target_session_pool_size: " + str(target_session_pool_size))
+
+    handler_start = time.perf_counter()
+    phase_timings = []
 
     # Delete
     if event['RequestType'] == 'Delete':
         logger.info("No action for Delete. Exiting.")
-        sendResponse(event, context, SUCCESS, EMPTY_RESPONSE_DATA)
+        send_response_with_metrics(event, context, SUCCESS, EMPTY_RESPONSE_DATA, phase_timings, stack_name,
+                                   handler_start)
         return
 
-    # Get the information connection from Secrets Manager
-    try:
-        get_secret_value_response = get_secret_information(region_name, secret_name)
-    except:
-        sendResponse(event, context, FAILED, EMPTY_RESPONSE_DATA)
-        return
+    storage_integration_name = "AWS_AUTOPILOT_STORAGE_INTEGRATION" + "_" + stack_name
+    api_integration_name = "AWS_AUTOPILOT_API_INTEGRATION" + "_" + stack_name
 
-    # Decrypted secret using the associated KMS CMK
-    # Ensure the Secret is in String mode
-    if 'SecretString' not in get_secret_value_response:
-        logger.error("The Secret is not in String mode")
-        sendResponse(event, context, FAILED, EMPTY_RESPONSE_DATA)
-        return
+    # Plan the Snowflake Integrations and external functions
+    statement_plan = []
+    create_storage_integration(statement_plan, storage_integration_name, auto_ml_role_arn, s3_bucket_name)
+    create_api_integration(statement_plan, api_integration_name, api_gateway_role_arn, api_gateway_url, apigw_type)
+    create_external_functions(statement_plan, api_integration_name, auto_ml_role_arn, api_gateway_url,
+                              s3_bucket_name, secret_name, storage_integration_name, snowflake_role_name,
+                              kms_key_arn, vpc_security_group_ids, vpc_subnet_ids, predict_outcome_max_batch_rows,
+                              predict_outcome_backend, predict_outcome_compression)
 
-    # Create Snowflake resource
+    # The additional targets share the integrations and the trust policies, only their functions are planned
     try:
-        snowflake_connection = connect_to_snowflake(get_secret_value_response, snowflake_role_name)
-        snowflake_cursor = snowflake_connection.cursor()
-
-        snowflake_cursor.execute(("use database %s;") % (database_name))
-
-        snowflake_cursor.execute(("use schema %s;") % (schema_name))
-
-        storage_integration_name = "AWS_AUTOPILOT_STORAGE_INTEGRATION" + "_" + stack_name
-        api_integration_name = "AWS_AUTOPILOT_API_INTEGRATION" + "_" + stack_name
-
-        # Create Snowflake Integrations
-        create_storage_integration(snowflake_cursor, storage_integration_name, auto_ml_role_arn, s3_bucket_name)
-        create_api_integration(snowflake_cursor, api_integration_name, api_gateway_role_arn, api_gateway_url, apigw_type)
-        create_external_functions(snowflake_cursor, api_integration_name, auto_ml_role_arn, api_gateway_url,
+        targets = parse_targets(additional_targets, database_name, schema_name)
+    except ValueError as e:
+        logger.exception('Problem reading the additional targets')
+        send_response_with_metrics(event, context, FAILED, {'Failed': str(e)}, phase_timings, stack_name,
+                                   handler_start)
+        return
+    target_statement_plans = collections.OrderedDict()
+    for target_database_name, target_schema_name in targets:
+        target_statement_plan = []
+        create_external_functions(target_statement_plan, api_integration_name, auto_ml_role_arn, api_gateway_url,
                                   s3_bucket_name, secret_name, storage_integration_name, snowflake_role_name,
-                                  kms_key_arn, vpc_security_group_ids, vpc_subnet_ids)
+                                  kms_key_arn, vpc_security_group_ids, vpc_subnet_ids, predict_outcome_max_batch_rows,
+                                  predict_outcome_backend, predict_outcome_compression,
+                                  database_name=target_database_name, schema_name=target_schema_name)
+        target_statement_plans[target_database_name + "." + target_schema_name] = target_statement_plan
+
+    # Every step runs as soon as the steps it depends on are done: the statements only wait for their own
+    # dependencies, and each integration is described and its IAM role updated as soon as the integration exists
+    tasks = collections.OrderedDict()
+    tasks[GET_SECRET_TASK] = {
+        TASK_FUNCTION: lambda results: run_timed_phase(phase_timings, GET_SECRET_PHASE, None, get_secret_string,
+                                                       region_name, secret_name),
+        TASK_DEPENDS_ON: []
+    }
+    # The Snowflake connector takes a while to import, it is imported while the secret is fetched
+    tasks[IMPORT_SNOWFLAKE_CONNECTOR_TASK] = {
+        TASK_FUNCTION: lambda results: import_snowflake_connector(),
+        TASK_DEPENDS_ON: []
+    }
+    tasks[SNOWFLAKE_CONNECTION_TASK] = {
+        TASK_FUNCTION: lambda results: open_snowflake_session(results[GET_SECRET_TASK], snowflake_role_name,
+                                                              database_name, schema_name, phase_timings),
+        TASK_DEPENDS_ON: [GET_SECRET_TASK, IMPORT_SNOWFLAKE_CONNECTOR_TASK]
+    }
+    # On Update only re-create the objects whose definition changed since they were last created
+    tasks[EXISTING_DDL_HASHES_TASK] = {
+        TASK_FUNCTION: lambda results: get_existing_ddl_hashes(results[SNOWFLAKE_CONNECTION_TASK], database_name,
+                                                               schema_name) if event['RequestType'] == 'Update' else set(),
+        TASK_DEPENDS_ON: [SNOWFLAKE_CONNECTION_TASK]
+    }
+    add_statement_tasks(tasks, statement_plan, [SNOWFLAKE_CONNECTION_TASK, EXISTING_DDL_HASHES_TASK], phase_timings)
+    tasks[STORAGE_INTEGRATION_INFO_TASK] = {
+        TASK_FUNCTION: lambda results: run_timed_phase(phase_timings, DESCRIBE_INTEGRATION_PHASE, storage_integration_name,
+                                                       get_storage_integration_info_for_policy,
+                                                       results[SNOWFLAKE_CONNECTION_TASK], storage_integration_name),
+        TASK_DEPENDS_ON: [storage_integration_name]
+    }
+    tasks[API_INTEGRATION_INFO_TASK] = {
+        TASK_FUNCTION: lambda results: run_timed_phase(phase_timings, DESCRIBE_INTEGRATION_PHASE, api_integration_name,
+                                                       get_api_integration_info_for_policy,
+                                                       results[SNOWFLAKE_CONNECTION_TASK], api_integration_name),
+        TASK_DEPENDS_ON: [api_integration_name]
+    }
+    # Update IAM roles to add Snowflake information
+    tasks[STORAGE_ROLE_POLICY_TASK] = {
+        TASK_FUNCTION: lambda results: run_timed_phase(phase_timings, UPDATE_ROLE_POLICY_PHASE, auto_ml_role_name,
+                                                       update_assume_role_policy,
+                                                       create_policy_string(results[STORAGE_INTEGRATION_INFO_TASK]),
+                                                       auto_ml_role_name),
+        TASK_DEPENDS_ON: [STORAGE_INTEGRATION_INFO_TASK]
+    }
+    tasks[API_ROLE_POLICY_TASK] = {
+        TASK_FUNCTION: lambda results: run_timed_phase(phase_timings, UPDATE_ROLE_POLICY_PHASE, api_gateway_role_name,
+                                                       update_assume_role_policy,
+                                                       create_policy_string(results[API_INTEGRATION_INFO_TASK]),
+                                                       api_gateway_role_name),
+        TASK_DEPENDS_ON: [API_INTEGRATION_INFO_TASK]
+    }
+    # CloudFormation only deploys the API when the deployment is created, so on Update the methods changed by the
+    # parameters or by a new version of the template are deployed to the stage here
+    if event['RequestType'] == 'Update':
+        tasks[REDEPLOY_API_TASK] = {
+            TASK_FUNCTION: lambda results: run_timed_phase(phase_timings, REDEPLOY_API_PHASE, api_gateway_stage_name,
+                                                           redeploy_api_gateway, api_gateway_id,
+                                                           api_gateway_stage_name),
+            TASK_DEPENDS_ON: []
+        }
+    if target_statement_plans:
+        tasks[DEPLOY_TARGETS_TASK] = {
+            TASK_FUNCTION: lambda results: deploy_targets(results[GET_SECRET_TASK], snowflake_role_name,
+                                                          target_statement_plans,
+                                                          [storage_integration_name, api_integration_name],
+                                                          event['RequestType'] == 'Update', target_session_pool_size,
+                                                          ddl_max_concurrency, phase_timings),
+            TASK_DEPENDS_ON: [GET_SECRET_TASK, IMPORT_SNOWFLAKE_CONNECTOR_TASK, storage_integration_name,
+                              api_integration_name]
+        }
 
-        # Describe Snowflake integrations
-        storage_integration_info = get_storage_integration_info_for_policy(snowflake_cursor, storage_integration_name)
-        api_integration_info = get_api_integration_info_for_policy(snowflake_cursor, api_integration_name)
-    except Exception as e:
-        logger.exception('Problem running SQL statements: ' + str(e))
-        responseData = {'Failed': 'Unable to execute SQL statements in Snowflake'}
-        sendResponse(event, context, FAILED, responseData)
+    results = {}
+    try:
+        run_task_graph(tasks, ddl_max_concurrency, results)
+    except TaskFailedError as e:
+        # The session may be what failed, it is not reused by the next invocations
+        if SNOWFLAKE_CONNECTION_TASK in results:
+            evict_snowflake_connection(results[SNOWFLAKE_CONNECTION_TASK])
+        # The secret may have been rotated since it was cached, the next invocation fetches it again
+        if e.task_name in (SNOWFLAKE_CONNECTION_TASK, EXISTING_DDL_HASHES_TASK) and \
+                is_snowflake_authentication_error(e.cause):
+            evict_secret(secret_name)
+
+        if e.task_name == GET_SECRET_TASK:
+            responseData = EMPTY_RESPONSE_DATA
+        elif e.task_name in (STORAGE_ROLE_POLICY_TASK, API_ROLE_POLICY_TASK):
+            logger.exception('Problem updating assume role policy: ' + str(e.cause))
+            responseData = {'Failed': 'There was a problem updating the assume role policies'}
+        elif e.task_name == REDEPLOY_API_TASK:
+            logger.exception('Problem redeploying the API: ' + str(e.cause))
+            responseData = {'Failed': 'There was a problem deploying the API Gateway stage ' + api_gateway_stage_name}
+        else:
+            logger.exception('Problem running SQL statements: ' + str(e.cause))
+            responseData = {'Failed': 'Unable to execute SQL statements in Snowflake'}
+        send_response_with_metrics(event, context, FAILED, responseData, phase_timings, stack_name, handler_start)
         return
     finally:
-        if 'snowflake_cursor' in vars():
-            snowflake_cursor.close()
-        if 'snowflake_connection' in vars():
-            snowflake_connection.close()
-
-    # Update IAM role to add Snowflake information
-    logger.info("Updating IAM Role")
-    storage_integration_policy_str = create_policy_string(storage_integration_info)
-    api_integration_policy_str = create_policy_string(api_integration_info)
+        logger.info("Cache statistics: %s", dict(cache_statistics))
 
-    try:
-        update_assume_role_policy(storage_integration_policy_str, auto_ml_role_name)
-        update_assume_role_policy(api_integration_policy_str, api_gateway_role_name)
-    except Exception as e:
-        logger.exception('Problem updating assume role policy: ' + str(e))
-        responseData = {'Failed': 'There was a problem updating the assume role policies'}
-        sendResponse(event, context, FAILED, responseData)
-        return
+    if target_statement_plans:
+        target_results = results[DEPLOY_TARGETS_TASK]
+        failed_targets = [target for target, target_result in target_results.items() if target_result != SUCCESS]
+        if failed_targets:
+            responseData = {'Failed': 'Unable to create the Snowflake resources in ' + ", ".join(failed_targets),
+                            'TargetResults': json.dumps(target_results)}
+            send_response_with_metrics(event, context, FAILED, responseData, phase_timings, stack_name, handler_start)
+            return
 
     responseData = {'Success': 'Snowflake resources created.'}
-    sendResponse(event, context, SUCCESS, responseData)
+    if target_statement_plans:
+        responseData['TargetResults'] = json.dumps(results[DEPLOY_TARGETS_TASK])
+    send_response_with_metrics(event, context, SUCCESS, responseData, phase_timings, stack_name, handler_start)
     logger.info("Success")
 
+def get_aws_client(service_name):
+    with cache_lock:
+        if service_name in aws_clients:
+            cache_statistics['aws_client_hits'] += 1
+        else:
+            cache_statistics['aws_client_misses'] += 1
+            aws_clients[service_name] = boto3.client(service_name)
+        return aws_clients[service_name]
+
 def get_secret_information(region_name, secret_name):
+    secret_cache_ttl_seconds = int(os.environ.get('SecretCacheTtlSeconds', DEFAULT_SECRET_CACHE_TTL_SECONDS))
+
+    with cache_lock:
+        cached_secret = secret_cache.get(secret_name)
+        if cached_secret and cached_secret[0] > time.time():
+            cache_statistics['secret_hits'] += 1
+            return cached_secret[1]
+        cache_statistics['secret_misses'] += 1
+
     logger.info("Getting secret information")
     try:
-        secretsmanager = boto3.client('secretsmanager')
+        secretsmanager = get_aws_client('secretsmanager')
 
-        return secretsmanager.get_secret_value(
+        get_secret_value_response = secretsmanager.get_secret_value(
             SecretId=secret_name
         )
     except ClientError as e:
@@ -141,25 +348,250 @@ def get_secret_information(region_name, secret_name):
             logger.exception(e)
         raise e
 
+    with cache_lock:
+        secret_cache[secret_name] = (time.time() + secret_cache_ttl_seconds, get_secret_value_response)
+    return get_secret_value_response
+
+def evict_secret(secret_name):
+    with cache_lock:
+        if secret_cache.pop(secret_name, None) is not None:
+            cache_statistics['secret_evictions'] += 1
+
+def is_snowflake_authentication_error(error):
+    return getattr(error, 'errno', None) in SNOWFLAKE_AUTHENTICATION_ERRNOS
+
+def get_secret_string(region_name, secret_name):
+    get_secret_value_response = get_secret_information(region_name, secret_name)
+
+    # Decrypted secret using the associated KMS CMK
+    # Ensure the Secret is in String mode
+    if 'SecretString' not in get_secret_value_response:
+        logger.error("The Secret is not in String mode")
+        raise ValueError("The Secret is not in String mode")
+
+    return get_secret_value_response
+
+def open_snowflake_session(get_secret_value_response, snowflake_role_name, database_name, schema_name,
+                           phase_timings=None):
+    with timed_phase(phase_timings, CONNECT_PHASE):
+        snowflake_connection = get_snowflake_connection(get_secret_value_response, snowflake_role_name)
+
+    with timed_phase(phase_timings, USE_DATABASE_SCHEMA_PHASE), snowflake_connection.cursor() as snowflake_cursor:
+        snowflake_cursor.execute(("use database %s;") % (database_name))
+
+        snowflake_cursor.execute(("use schema %s;") % (schema_name))
+
+    return snowflake_connection
+
+# Reuses the session of a previous invocation when it was opened with the same credentials, is within its validity
+# window and is still alive
+def get_snowflake_connection(get_secret_value_response, snowflake_role_name):
+    snowflake_session_ttl_seconds = int(os.environ.get('SnowflakeSessionTtlSeconds',
+                                                       DEFAULT_SNOWFLAKE_SESSION_TTL_SECONDS))
+    connection_key = hashlib.sha256(
+        (get_secret_value_response['SecretString'] + snowflake_role_name).encode("utf-8")).hexdigest()
+
+    with cache_lock:
+        cached_connection = snowflake_connection_cache.pop(connection_key, None)
+        stale_connections = [connection for _, connection in snowflake_connection_cache.values()]
+        snowflake_connection_cache.clear()
+
+    for stale_connection in stale_connections:
+        close_snowflake_connection(stale_connection)
+
+    if cached_connection is not None:
+        expires_at, snowflake_connection = cached_connection
+        if expires_at <= time.time():
+            # Logged in again before the master token expires rather than failing a statement halfway
+            with cache_lock:
+                cache_statistics['snowflake_connection_expirations'] += 1
+            close_snowflake_connection(snowflake_connection)
+        elif is_snowflake_connection_alive(snowflake_connection):
+            logger.info("Reusing Snowflake session")
+            with cache_lock:
+                cache_statistics['snowflake_connection_hits'] += 1
+                snowflake_connection_cache[connection_key] = cached_connection
+            return snowflake_connection
+        else:
+            with cache_lock:
+                cache_statistics['snowflake_connection_evictions'] += 1
+            close_snowflake_connection(snowflake_connection)
+
+    with cache_lock:
+        cache_statistics['snowflake_connection_misses'] += 1
+    snowflake_connection = connect_to_snowflake(get_secret_value_response, snowflake_role_name)
+    with cache_lock:
+        snowflake_connection_cache[connection_key] = (time.time() + snowflake_session_ttl_seconds, snowflake_connection)
+    return snowflake_connection
+
+def is_snowflake_connection_alive(snowflake_connection):
+    if snowflake_connection.is_closed():
+        return False
+
+    # Fails when the session expired or its token was revoked
+    try:
+        with snowflake_connection.cursor() as snowflake_cursor:
+            snowflake_cursor.execute("select 1")
+        return True
+    except Exception as e:
+        logger.warning("Cached Snowflake session is no longer usable: " + str(e))
+        return False
+
+def evict_snowflake_connection(snowflake_connection):
+    with cache_lock:
+        for connection_key, (_, cached_connection) in list(snowflake_connection_cache.items()):
+            if cached_connection is snowflake_connection:
+                del snowflake_connection_cache[connection_key]
+                cache_statistics['snowflake_connection_evictions'] += 1
+
+    close_snowflake_connection(snowflake_connection)
+
+def close_snowflake_connection(snowflake_connection):
+    try:
+        snowflake_connection.close()
+    except Exception as e:
+        logger.warning("Problem closing Snowflake session: " + str(e))
+
+# Imported on first use only, so that Delete requests and cold starts do not pay for it upfront
+def import_snowflake_connector():
+    import snowflake.connector
+    return snowflake.connector
+
 def connect_to_snowflake(get_secret_value_response, snowflake_role_name):
     secret_string = get_secret_value_response['SecretString']
 
     secret = json.loads(secret_string)
     snowflake_account = secret['accountid']
-    snowflake_password = secret['password']
-    snowflake_userName = secret['username']
+    authentication_parameters = get_snowflake_authentication_parameters(secret)
 
     # Connect to Snowflake
-    logger.info("Connecting to Snowflake")
-    snowflake_connection = snowflake.connector.connect(
-        user=snowflake_userName,
-        password=snowflake_password,
+    logger.info("Connecting to Snowflake [authenticator=%s]", authentication_parameters.get('authenticator', 'snowflake'))
+    snowflake_connection = import_snowflake_connector().connect(
         account=snowflake_account,
-        role=snowflake_role_name
+        role=snowflake_role_name,
+        **authentication_parameters
     )
 
     return snowflake_connection
 
+# A private key in the secret logs in with key-pair authentication and an OAuth token with that token, which avoids
+# the MFA and password policies of password logins. The username and password are used otherwise.
+def get_snowflake_authentication_parameters(secret):
+    if secret.get('privatekey'):
+        return {
+            'authenticator': 'SNOWFLAKE_JWT',
+            'user': secret['username'],
+            'private_key': load_private_key(secret['privatekey'], secret.get('privatekeypassphrase'))
+        }
+
+    if secret.get('token'):
+        authentication_parameters = {
+            'authenticator': 'oauth',
+            'token': secret['token']
+        }
+        if secret.get('username'):
+            authentication_parameters['user'] = secret['username']
+        return authentication_parameters
+
+    return {
+        'user': secret['username'],
+        'password': secret['password']
+    }
+
+# The connector takes the key as DER bytes, the secret holds it in PEM, optionally encrypted with a passphrase
+def load_private_key(private_key_pem, passphrase=None):
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+
+    private_key = serialization.load_pem_private_key(
+        private_key_pem.encode("utf-8"),
+        password=passphrase.encode("utf-8") if passphrase else None,
+        backend=default_backend()
+    )
+
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+# Times the phase and appends it to phase_timings, phases run on concurrent tasks are appended as they complete.
+# The phase dict is yielded so that the query id of a statement can be added to it.
+@contextlib.contextmanager
+def timed_phase(phase_timings, phase_name, detail=None):
+    phase = {PHASE_NAME: phase_name}
+    if detail is not None:
+        phase[PHASE_DETAIL] = detail
+    start = time.perf_counter()
+    try:
+        yield phase
+    finally:
+        phase[PHASE_DURATION_MS] = round((time.perf_counter() - start) * 1000, 1)
+        if phase_timings is not None:
+            phase_timings.append(phase)
+
+def run_timed_phase(phase_timings, phase_name, detail, function, *args):
+    with timed_phase(phase_timings, phase_name, detail):
+        return function(*args)
+
+# Summary of the phases returned to CloudFormation, the Data of a custom resource response is limited to 4 KB so the
+# statements are only counted and the slowest one named
+def summarize_phase_timings(phase_timings, total_ms):
+    phases_ms = collections.OrderedDict()
+    slowest_ddl = None
+    ddl_statements = 0
+    for phase in phase_timings:
+        phases_ms[phase[PHASE_NAME]] = round(phases_ms.get(phase[PHASE_NAME], 0) + phase[PHASE_DURATION_MS], 1)
+        if phase[PHASE_NAME] == DDL_PHASE:
+            ddl_statements += 1
+            if slowest_ddl is None or phase[PHASE_DURATION_MS] > slowest_ddl[PHASE_DURATION_MS]:
+                slowest_ddl = phase
+
+    summary = {"total_ms": total_ms, "phases_ms": phases_ms, "ddl_statements": ddl_statements}
+    if slowest_ddl is not None:
+        summary["slowest_ddl"] = {"statement": slowest_ddl[PHASE_DETAIL], PHASE_DURATION_MS: slowest_ddl[PHASE_DURATION_MS],
+                                  PHASE_QUERY_ID: slowest_ddl.get(PHASE_QUERY_ID)}
+    return summary
+
+# Writes one CloudWatch embedded metric format document per phase to stdout, where Lambda sends it to CloudWatch Logs.
+# The statement and its query id are properties rather than dimensions, so that the metric cardinality stays low.
+def emit_phase_metrics(phase_timings, stack_name):
+    timestamp = int(time.time() * 1000)
+    for phase in phase_timings:
+        metric = {
+            "_aws": {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["StackName", "Phase"]],
+                    "Metrics": [{"Name": "Duration", "Unit": "Milliseconds"}]
+                }]
+            },
+            "StackName": stack_name,
+            "Phase": phase[PHASE_NAME],
+            "Duration": phase[PHASE_DURATION_MS]
+        }
+        if PHASE_DETAIL in phase:
+            metric["Detail"] = phase[PHASE_DETAIL]
+        if phase.get(PHASE_QUERY_ID):
+            metric["QueryId"] = phase[PHASE_QUERY_ID]
+        print(json.dumps(metric))
+
+def send_response_with_metrics(event, context, responseStatus, responseData, phase_timings, stack_name, handler_start):
+    # The phases run concurrently, the total is the elapsed time of the invocation rather than the sum of the phases
+    total_ms = round((time.perf_counter() - handler_start) * 1000, 1)
+    timing_summary = summarize_phase_timings(phase_timings, total_ms)
+    logger.info("Phase timings: %s", json.dumps(timing_summary))
+    responseData = dict(responseData, TimingSummary=json.dumps(timing_summary))
+
+    try:
+        with timed_phase(phase_timings, CLOUDFORMATION_RESPONSE_PHASE):
+            sendResponse(event, context, responseStatus, responseData)
+    finally:
+        phase_timings.append({PHASE_NAME: TOTAL_PHASE,
+                              PHASE_DURATION_MS: round((time.perf_counter() - handler_start) * 1000, 1)})
+        emit_phase_metrics(phase_timings, stack_name)
+
 def sendResponse(event, context, responseStatus, responseData):
     responseBody = {'Status': responseStatus,
                     'Reason': 'See the details in CloudWatch Log Stream: ' + context.log_stream_name,
@@ -173,7 +605,210 @@ def sendResponse(event, context, responseStatus, responseData):
         raise Exception('Received a non-200 HTTP response while sending response to CloudFormation.')
     return
 
-def create_storage_integration(snowflake_cursor, storage_integration_name, auto_ml_role_arn, s3_bucket_name):
+def add_statement(statement_plan, statement_name, statement_str, depends_on=()):
+    if any(statement[STATEMENT_NAME] == statement_name for statement in statement_plan):
+        raise ValueError("Duplicate statement in plan: " + statement_name)
+
+    # Tag the created object with the hash of its definition so that unchanged objects can be skipped on Update
+    ddl_hash = hashlib.sha256(statement_str.encode("utf-8")).hexdigest()
+
+    statement_plan.append({
+        STATEMENT_NAME: statement_name,
+        STATEMENT_SQL: add_ddl_hash_comment(statement_str, ddl_hash),
+        STATEMENT_DEPENDS_ON: list(depends_on),
+        STATEMENT_DDL_HASH: ddl_hash
+    })
+
+def add_ddl_hash_comment(statement_str, ddl_hash):
+    comment_str = " comment = '%s%s' " % (DDL_HASH_COMMENT_PREFIX, ddl_hash)
+
+    # Functions take the comment before their body, integrations at the end of the statement
+    function_body = FUNCTION_BODY_PATTERN.search(statement_str)
+    if function_body:
+        return statement_str[:function_body.start()] + comment_str.lstrip() + statement_str[function_body.start():]
+
+    return statement_str.rstrip().rstrip(";") + comment_str
+
+def get_existing_ddl_hashes(snowflake_connection, database_name, schema_name):
+    logger.info("Reading the definition hashes of the existing Snowflake resources")
+    existing_ddl_hashes = set()
+
+    with snowflake_connection.cursor() as snowflake_cursor:
+        snowflake_cursor.execute("show integrations like 'AWS_AUTOPILOT%'")
+        existing_ddl_hashes.update(get_ddl_hashes_from_column(snowflake_cursor, "comment"))
+
+        snowflake_cursor.execute(("show user functions like 'AWS_AUTOPILOT%%' in schema %s.%s") % (database_name, schema_name))
+        existing_ddl_hashes.update(get_ddl_hashes_from_column(snowflake_cursor, "description"))
+
+        snowflake_cursor.execute(("show procedures like 'AWS_AUTOPILOT%%' in schema %s.%s") % (database_name, schema_name))
+        existing_ddl_hashes.update(get_ddl_hashes_from_column(snowflake_cursor, "description"))
+
+        snowflake_cursor.execute(("show stages like 'AWS_AUTOPILOT%%' in schema %s.%s") % (database_name, schema_name))
+        existing_ddl_hashes.update(get_ddl_hashes_from_column(snowflake_cursor, "comment"))
+
+    return existing_ddl_hashes
+
+def get_ddl_hashes_from_column(snowflake_cursor, column_name):
+    column_names = [column[0].lower() for column in snowflake_cursor.description]
+    column_index = column_names.index(column_name)
+
+    ddl_hashes = set()
+    for row in snowflake_cursor.fetchall():
+        match = DDL_HASH_PATTERN.search(row[column_index] or '')
+        if match:
+            ddl_hashes.add(match.group(1))
+    return ddl_hashes
+
+def add_statement_tasks(tasks, statement_plan, depends_on=(), phase_timings=None):
+    for statement in statement_plan:
+        tasks[statement[STATEMENT_NAME]] = {
+            TASK_FUNCTION: functools.partial(execute_statement, statement, phase_timings=phase_timings),
+            TASK_DEPENDS_ON: list(depends_on) + statement[STATEMENT_DEPENDS_ON]
+        }
+
+# completed_statement_names are the statements of another plan, already executed, that the statements depend on
+def execute_statement_plan(snowflake_connection, statement_plan, max_concurrency, existing_ddl_hashes=frozenset(),
+                           completed_statement_names=()):
+    logger.info("Executing statement plan [statements=%s, max_concurrency=%s]", len(statement_plan), max_concurrency)
+
+    tasks = collections.OrderedDict()
+    tasks[SNOWFLAKE_CONNECTION_TASK] = {TASK_FUNCTION: lambda results: snowflake_connection, TASK_DEPENDS_ON: []}
+    tasks[EXISTING_DDL_HASHES_TASK] = {TASK_FUNCTION: lambda results: existing_ddl_hashes, TASK_DEPENDS_ON: []}
+    for statement_name in completed_statement_names:
+        tasks[statement_name] = {TASK_FUNCTION: lambda results: None, TASK_DEPENDS_ON: []}
+    add_statement_tasks(tasks, statement_plan, [SNOWFLAKE_CONNECTION_TASK, EXISTING_DDL_HASHES_TASK])
+
+    return run_task_graph(tasks, max_concurrency)
+
+def execute_statement(statement, results, phase_timings=None):
+    if statement[STATEMENT_DDL_HASH] in results[EXISTING_DDL_HASHES_TASK]:
+        logger.info("Skipping unchanged statement: " + statement[STATEMENT_NAME])
+        return None
+
+    logger.info("Executing statement: " + statement[STATEMENT_NAME])
+
+    # Each statement gets its own cursor so that statements can be in flight on the same session concurrently
+    with timed_phase(phase_timings, DDL_PHASE, statement[STATEMENT_NAME]) as phase, \
+            results[SNOWFLAKE_CONNECTION_TASK].cursor() as snowflake_cursor:
+        snowflake_cursor.execute(statement[STATEMENT_SQL])
+        phase[PHASE_QUERY_ID] = snowflake_cursor.sfqid
+        return snowflake_cursor.sfqid
+
+class TaskFailedError(Exception):
+    def __init__(self, task_name, cause):
+        super().__init__("Task %s failed: %s" % (task_name, cause))
+        self.task_name = task_name
+        self.cause = cause
+
+# Runs every task as soon as all the tasks it depends on have completed, using up to max_workers threads.
+# Each task function is called with the results of the tasks completed so far, and the results are collected in
+# the given dict, which keeps the results of the completed tasks when a task fails with a TaskFailedError.
+# With max_workers=1 the tasks run one at a time in the order they were added.
+def run_task_graph(tasks, max_workers, results=None):
+    for task_name, task in tasks.items():
+        for dependency in task[TASK_DEPENDS_ON]:
+            if dependency not in tasks:
+                raise ValueError("Task %s depends on unknown task %s" % (task_name, dependency))
+
+    if results is None:
+        results = {}
+    pending = collections.OrderedDict(tasks)
+    running = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for task_name, task in list(pending.items()):
+                if len(running) >= max_workers:
+                    break
+                if all(dependency in results for dependency in task[TASK_DEPENDS_ON]):
+                    del pending[task_name]
+                    running[executor.submit(task[TASK_FUNCTION], dict(results))] = task_name
+
+            if not running:
+                raise ValueError("Dependency cycle between tasks: " + ", ".join(pending))
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                task_name = running.pop(future)
+                # Tasks already running are waited for when leaving the executor, no new task is started
+                try:
+                    results[task_name] = future.result()
+                except Exception as e:
+                    raise TaskFailedError(task_name, e) from e
+
+    return results
+
+# "DATABASE.SCHEMA" pairs separated by commas, the database and schema of the stack are left out as they are always
+# deployed
+def parse_targets(targets_str, database_name, schema_name):
+    targets = []
+    seen_targets = set([(database_name.upper(), schema_name.upper())])
+    for target_str in targets_str.replace(" ", "").split(","):
+        if not target_str:
+            continue
+        target = tuple(target_str.split("."))
+        if len(target) != 2 or not all(target):
+            raise ValueError("Additional target is not DATABASE.SCHEMA: " + target_str)
+        if (target[0].upper(), target[1].upper()) not in seen_targets:
+            seen_targets.add((target[0].upper(), target[1].upper()))
+            targets.append(target)
+    return targets
+
+# Deploys the functions of every target concurrently over a pool of sessions, each session deploying one target at a
+# time. The sessions are opened as needed, up to the pool size, and closed at the end. A target that fails does not
+# stop the others, the result of every target is returned: SUCCESS or its error
+def deploy_targets(get_secret_value_response, snowflake_role_name, target_statement_plans, integration_names,
+                   is_update, session_pool_size, max_concurrency, phase_timings=None):
+    logger.info("Deploying to %d additional targets [session_pool_size=%s]", len(target_statement_plans),
+                session_pool_size)
+    session_pool = queue.Queue()
+    opened_sessions = []
+    sessions_lock = threading.Lock()
+
+    def deploy(target):
+        database_name, schema_name = target.split(".")
+        try:
+            try:
+                snowflake_connection = session_pool.get_nowait()
+            except queue.Empty:
+                with timed_phase(phase_timings, CONNECT_PHASE, target):
+                    snowflake_connection = connect_to_snowflake(get_secret_value_response, snowflake_role_name)
+                with sessions_lock:
+                    opened_sessions.append(snowflake_connection)
+
+            with timed_phase(phase_timings, DEPLOY_TARGET_PHASE, target):
+                deploy_target(snowflake_connection, database_name, schema_name, target_statement_plans[target],
+                              integration_names, is_update, max_concurrency)
+        except Exception as e:
+            logger.exception("Problem deploying to " + target)
+            # The session may be what failed, it is not given to another target
+            cause = e.cause if isinstance(e, TaskFailedError) else e
+            return str(cause)[:TARGET_ERROR_MAX_LENGTH]
+        session_pool.put(snowflake_connection)
+        logger.info("Deployed to " + target)
+        return SUCCESS
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=session_pool_size) as executor:
+            return collections.OrderedDict(zip(target_statement_plans, executor.map(deploy, target_statement_plans)))
+    finally:
+        for snowflake_connection in opened_sessions:
+            close_snowflake_connection(snowflake_connection)
+
+def deploy_target(snowflake_connection, database_name, schema_name, statement_plan, integration_names, is_update,
+                  max_concurrency):
+    with snowflake_connection.cursor() as snowflake_cursor:
+        snowflake_cursor.execute(("use database %s;") % (database_name))
+
+        snowflake_cursor.execute(("use schema %s;") % (schema_name))
+
+    # On Update only re-create the objects whose definition changed since they were last created in the target
+    existing_ddl_hashes = get_existing_ddl_hashes(snowflake_connection, database_name, schema_name) if is_update \
+        else frozenset()
+    execute_statement_plan(snowflake_connection, statement_plan, max_concurrency, existing_ddl_hashes,
+                           integration_names)
+
+def create_storage_integration(statement_plan, storage_integration_name, auto_ml_role_arn, s3_bucket_name):
     logger.info("Creating Storage Integration [storage_integration_name=%s, auto_ml_role_arn=%s, s3_bucket_name=%s]",
                 storage_integration_name, auto_ml_role_arn, s3_bucket_name)
 
@@ -184,9 +819,9 @@ def create_storage_integration(snowflake_cursor, storage_integration_name, auto_
     storage_aws_role_arn = '%s' \
     storage_allowed_locations = ('s3://%s')") % (storage_integration_name, auto_ml_role_arn, s3_bucket_name)
 
-    snowflake_cursor.execute(storage_integration_str)
+    add_statement(statement_plan, storage_integration_name, storage_integration_str)
 
-def create_api_integration(snowflake_cursor, api_integration_name, api_gateway_role_arn, api_gateway_url, apigw_type):
+def create_api_integration(statement_plan, api_integration_name, api_gateway_role_arn, api_gateway_url, apigw_type):
     logger.info("Creating API Integration [api_integration_name=%s, api_gateway_role_arn=%s, api_gateway_url=%s]",
                 api_integration_name, api_gateway_role_arn, api_gateway_url)
 
@@ -201,29 +836,51 @@ def create_api_integration(snowflake_cursor, api_integration_name, api_gateway_r
     enabled = true \
     ") % (api_integration_name, apigw_provider, api_gateway_role_arn, api_gateway_url)
 
-    snowflake_cursor.execute(api_integration_str)
+    add_statement(statement_plan, api_integration_name, api_integration_str)
 
 
-def create_external_functions(snowflake_cursor, api_integration_name, auto_ml_role_arn, api_gateway_url, s3_bucket_name,
+def create_external_functions(statement_plan, api_integration_name, auto_ml_role_arn, api_gateway_url, s3_bucket_name,
                               secret_arn, storage_integration_name, snowflake_role_name,
-                              kms_key_arn, vpc_security_group_ids, vpc_subnet_ids):
-    create_describemodel_ef(snowflake_cursor, api_integration_name, api_gateway_url)
-    create_createendpoint_ef(snowflake_cursor, api_integration_name, api_gateway_url)
-    create_createendpointconfig_ef(snowflake_cursor, api_integration_name, api_gateway_url)
-    create_describeendpoint_ef(snowflake_cursor, api_integration_name, api_gateway_url)
-    create_deleteendpoint_ef(snowflake_cursor, api_integration_name, api_gateway_url)
-    create_predictoutcome_ef(snowflake_cursor, api_integration_name, api_gateway_url)
-    create_createmodel_ef(snowflake_cursor, api_integration_name, api_gateway_url, secret_arn, s3_bucket_name,
+                              kms_key_arn, vpc_security_group_ids, vpc_subnet_ids,
+                              predict_outcome_max_batch_rows=DEFAULT_PREDICT_OUTCOME_MAX_BATCH_ROWS,
+                              predict_outcome_backend=PREDICT_OUTCOME_ENDPOINT_BACKEND,
+                              predict_outcome_compression=DEFAULT_PREDICT_OUTCOME_COMPRESSION,
+                              database_name=None, schema_name=None):
+    # The functions reference their translators by their full name, in the database and schema they are created in
+    target = {'database_name': database_name, 'schema_name': schema_name}
+    create_describemodel_ef(statement_plan, api_integration_name, api_gateway_url, predict_outcome_backend, **target)
+    create_createendpoint_ef(statement_plan, api_integration_name, api_gateway_url, **target)
+    create_createendpointconfig_ef(statement_plan, api_integration_name, api_gateway_url, **target)
+    create_describeendpoint_ef(statement_plan, api_integration_name, api_gateway_url, predict_outcome_backend, **target)
+    create_deleteendpoint_ef(statement_plan, api_integration_name, api_gateway_url, **target)
+    create_predictoutcome_ef(statement_plan, api_integration_name, api_gateway_url, predict_outcome_max_batch_rows,
+                             predict_outcome_backend, predict_outcome_compression, **target)
+    create_predictoutcomewithprobabilities_ef(statement_plan, api_integration_name, api_gateway_url,
+                                              predict_outcome_max_batch_rows, predict_outcome_compression, **target)
+    create_probabilitymodel_ef(statement_plan, api_integration_name, api_gateway_url, auto_ml_role_arn,
+                               vpc_security_group_ids, vpc_subnet_ids, predict_outcome_backend, **target)
+    create_createmodel_ef(statement_plan, api_integration_name, api_gateway_url, secret_arn, s3_bucket_name,
                           storage_integration_name, auto_ml_role_arn, snowflake_role_name,
-                          kms_key_arn, vpc_security_group_ids, vpc_subnet_ids)
-    create_deleteendpointconfig_ef(snowflake_cursor, api_integration_name, api_gateway_url)
-    create_describeendpointconfig_ef(snowflake_cursor, api_integration_name, api_gateway_url)
-
-
-def create_describemodel_ef(snowflake_cursor, api_integration_name, api_gateway_url):
-    logger.info("Creating External function: AWS_AUTOPILOT_DESCRIBE_MODEL [api_integration_name=%s, api_gateway_url=%s]", api_integration_name, api_gateway_url)
-
-    describemodel_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
+                          kms_key_arn, vpc_security_group_ids, vpc_subnet_ids, **target)
+    create_deleteendpointconfig_ef(statement_plan, api_integration_name, api_gateway_url, **target)
+    create_describeendpointconfig_ef(statement_plan, api_integration_name, api_gateway_url, predict_outcome_backend,
+                                     **target)
+    create_endpointautoscaling_ef(statement_plan, api_integration_name, api_gateway_url, **target)
+    create_createtransformjob_ef(statement_plan, api_integration_name, api_gateway_url, s3_bucket_name, kms_key_arn,
+                                 **target)
+    create_describetransformjob_ef(statement_plan, api_integration_name, api_gateway_url, **target)
+    create_batch_prediction_procedures(statement_plan, storage_integration_name, s3_bucket_name, **target)
+
+
+def create_describemodel_ef(statement_plan, api_integration_name, api_gateway_url,
+                            backend=PREDICT_OUTCOME_ENDPOINT_BACKEND, database_name=None, schema_name=None):
+    logger.info("Creating External function: AWS_AUTOPILOT_DESCRIBE_MODEL [api_integration_name=%s, api_gateway_url=%s, backend=%s]", api_integration_name, api_gateway_url, backend)
+
+    if backend == PREDICT_OUTCOME_PROXY_BACKEND:
+        describemodel_request_translator_str = get_describe_batch_request_translator_str(
+            add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL_REQUEST_TRANSLATOR"), "-job")
+    else:
+        describemodel_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
         $$
         let item = EVENT.body.data[0][1];
@@ -233,45 +890,94 @@ def create_describemodel_ef(snowflake_cursor, api_integration_name, api_gateway_
         return {\"body\": JSON.stringify(payload)};
         $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL_REQUEST_TRANSLATOR"))
 
-    snowflake_cursor.execute(describemodel_request_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_MODEL_REQUEST_TRANSLATOR", describemodel_request_translator_str)
 
-    describemodel_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
-        returns OBJECT LANGUAGE JAVASCRIPT AS
-        $$
-        let responseBody = EVENT.body;
-        let response ={};
-        response[\"JobStatus\"] = responseBody.AutoMLJobStatus;
-        response[\"JobStatusDetails\"] = responseBody.AutoMLJobSecondaryStatus;
-        if (responseBody.AutoMLJobStatus === \"Completed\")
-        {
-            if (responseBody.BestCandidate) {
-                response[\"ObjectiveMetric\"] = responseBody.BestCandidate.FinalAutoMLJobObjectiveMetric.MetricName;
-                response[\"BestObjectiveMetric\"] = responseBody.BestCandidate.FinalAutoMLJobObjectiveMetric.Value;
+    describemodel_to_result_str = """function toResult(responseBody) {
+            let response ={};
+            response[\"JobStatus\"] = responseBody.AutoMLJobStatus;
+            response[\"JobStatusDetails\"] = responseBody.AutoMLJobSecondaryStatus;
+            if (responseBody.AutoMLJobStatus === \"Completed\")
+            {
+                if (responseBody.BestCandidate) {
+                    response[\"ObjectiveMetric\"] = responseBody.BestCandidate.FinalAutoMLJobObjectiveMetric.MetricName;
+                    response[\"BestObjectiveMetric\"] = responseBody.BestCandidate.FinalAutoMLJobObjectiveMetric.Value;
+                }
+            } else if (responseBody.AutoMLJobStatus === \"Failed\")
+            {
+                response[\"FailureReason\"] = responseBody.FailureReason;
             }
-        } else if (responseBody.AutoMLJobStatus === \"Failed\")
-        {
-            response[\"FailureReason\"] = responseBody.FailureReason;
-        }
 
-        response[\"PartialFailureReasons\"] = responseBody.PartialFailureReasons;
+            response[\"PartialFailureReasons\"] = responseBody.PartialFailureReasons;
+            return response;
+        }"""
 
-        return {\"body\":{   \"data\" : [[0,response]]  }};
-        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL_RESPONSE_TRANSLATOR"))
+    describemodel_response_translator_str = get_describe_response_translator_str(
+        add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL_RESPONSE_TRANSLATOR"), describemodel_to_result_str,
+        backend)
 
-    snowflake_cursor.execute(describemodel_response_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_MODEL_RESPONSE_TRANSLATOR", describemodel_response_translator_str)
 
     create_describemodel_ef_str = ("""create or replace external function %s(modelname varchar)
         returns variant
         api_integration = \"%s\"
         request_translator =%s
         response_translator=%s
-        max_batch_rows=1
-        as '%s/describemodel';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL_REQUEST_TRANSLATOR"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL_RESPONSE_TRANSLATOR"), api_gateway_url)
+        max_batch_rows=%d
+        as '%s/describemodel';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL_RESPONSE_TRANSLATOR", database_name, schema_name), get_describe_max_batch_rows(backend), api_gateway_url)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_MODEL", create_describemodel_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_DESCRIBE_MODEL_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_DESCRIBE_MODEL_RESPONSE_TRANSLATOR"])
+
+
+# With the PROXY backend, the describe functions send the distinct names of a whole batch in one call. rowIndex gives
+# the distinct name of every row of the batch, the proxy returns it with the results of the distinct names so that the
+# response translator can expand them
+def get_describe_batch_request_translator_str(translator_name, name_suffix=""):
+    return ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+        let names = [];
+        let nameIndexes = new Map();
+        let rowIndex = [];
+        for (let i = 0; i < EVENT.body.data.length; i++) {
+            let name = EVENT.body.data[i][1] === null ? null : EVENT.body.data[i][1] + \"%s\";
+            let nameIndex = nameIndexes.get(name);
+            if (nameIndex === undefined) {
+                nameIndex = names.length;
+                nameIndexes.set(name, nameIndex);
+                names.push(name);
+            }
+            rowIndex.push(nameIndex);
+        }
+        return {\"body\": JSON.stringify({\"names\": names, \"rowIndex\": rowIndex})};
+        $$""") % (translator_name, name_suffix)
+
+
+# to_result_str defines toResult, which turns a describe response into the value returned to Snowflake. The rows whose
+# name could not be described by the PROXY backend get its Error instead
+def get_describe_response_translator_str(translator_name, to_result_str, backend):
+    if backend == PREDICT_OUTCOME_PROXY_BACKEND:
+        return_str = """let results = EVENT.body.results.map(result => result.Error !== undefined ? result : toResult(result));
+        return {\"body\": {\"data\": EVENT.body.rowIndex.map((distinctIndex, i) => [i, results[distinctIndex]])}};"""
+    else:
+        return_str = """return {\"body\": {   \"data\" : [[0, toResult(EVENT.body)]]  }};"""
+
+    return ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+        %s
+        %s
+        $$;""") % (translator_name, to_result_str, return_str)
+
 
-    snowflake_cursor.execute(create_describemodel_ef_str)
+def get_describe_max_batch_rows(backend):
+    if backend == PREDICT_OUTCOME_PROXY_BACKEND:
+        return DESCRIBE_MAX_BATCH_ROWS
+    return 1
 
 
-def create_createendpoint_ef(snowflake_cursor, api_integration_name, api_gateway_url):
+def create_createendpoint_ef(statement_plan, api_integration_name, api_gateway_url,
+                             database_name=None, schema_name=None):
     logger.info("Creating External function: AWS_AUTOPILOT_CREATE_ENDPOINT [api_integration_name=%s, api_gateway_url=%s]", api_integration_name, api_gateway_url)
 
     createendpoint_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
@@ -290,12 +996,13 @@ def create_createendpoint_ef(snowflake_cursor, api_integration_name, api_gateway
                 \"EndpointConfigName\" : endpointConfigName,
                 \"DeletionCondition\": {
                 \"MaxRuntimeInSeconds\": endpointTTL
-                }
+                },
+                \"Tags\": [{\"Key\": \"%s\", \"Value\": \"%s\"}]
               };
         return {\"body\": payload};
-        $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_REQUEST_TRANSLATOR"))
+        $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_REQUEST_TRANSLATOR"), STACK_TAG_KEY, os.environ['StackName'])
 
-    snowflake_cursor.execute(createendpoint_request_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_ENDPOINT_REQUEST_TRANSLATOR", createendpoint_request_translator_str)
 
     createendpoint_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
@@ -303,7 +1010,7 @@ def create_createendpoint_ef(snowflake_cursor, api_integration_name, api_gateway
             return {\"body\": {   \"data\" : [[0, EVENT.body]]  }}
         $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_RESPONSE_TRANSLATOR"))
 
-    snowflake_cursor.execute(createendpoint_response_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_ENDPOINT_RESPONSE_TRANSLATOR", createendpoint_response_translator_str)
 
     create_createendpoint_ef_str = ("""create or replace external function %s(endpointName varchar, endpointConfigName varchar, endpointTTL integer)
     returns variant
@@ -311,35 +1018,43 @@ def create_createendpoint_ef(snowflake_cursor, api_integration_name, api_gateway
     request_translator = %s
     response_translator=%s
     max_batch_rows=1
-    as '%s/createendpoint';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_REQUEST_TRANSLATOR"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_RESPONSE_TRANSLATOR"), api_gateway_url)
+    as '%s/createendpoint';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
 
-    snowflake_cursor.execute(create_createendpoint_ef_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_ENDPOINT", create_createendpoint_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_CREATE_ENDPOINT_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_CREATE_ENDPOINT_RESPONSE_TRANSLATOR"])
 
 
-def create_createendpointconfig_ef(snowflake_cursor, api_integration_name, api_gateway_url):
+def create_createendpointconfig_ef(statement_plan, api_integration_name, api_gateway_url,
+                                   database_name=None, schema_name=None):
     logger.info("Creating External function: AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG [api_integration_name=%s, api_gateway_url=%s]", api_integration_name, api_gateway_url)
 
+    # Shared by both overloads: the instance type is a string, the memory size of a serverless variant a number
     createendpointconfig_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
         $$
         let endpointConfigName = EVENT.body.data[0][1];
         let modelName = EVENT.body.data[0][2];
-        let instanceType = EVENT.body.data[0][3];
-        let instanceCount = EVENT.body.data[0][4];
-        let payload = {
-        \"EndpointConfigName\": endpointConfigName,
-        \"ProductionVariants\" : [
-        {
-            \"InstanceType\": instanceType,
+        let productionVariant = {
             \"ModelName\": modelName + \"-job-best-model\",
-            \"InitialInstanceCount\": instanceCount,
             \"VariantName\" : \"AllTrafficVariant\"
-        }]
+        };
+        if (typeof EVENT.body.data[0][3] === \"number\") {
+            productionVariant[\"ServerlessConfig\"] = {
+                \"MemorySizeInMB\": EVENT.body.data[0][3],
+                \"MaxConcurrency\": EVENT.body.data[0][4]
+            };
+        } else {
+            productionVariant[\"InstanceType\"] = EVENT.body.data[0][3];
+            productionVariant[\"InitialInstanceCount\"] = EVENT.body.data[0][4];
+        }
+        let payload = {
+        \"EndpointConfigName\": endpointConfigName,
+        \"ProductionVariants\" : [productionVariant]
         };
         return {\"body\": payload};
         $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR"))
 
-    snowflake_cursor.execute(createendpointconfig_request_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", createendpointconfig_request_translator_str)
 
     createendpointconfig_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
@@ -347,7 +1062,7 @@ def create_createendpointconfig_ef(snowflake_cursor, api_integration_name, api_g
             return {\"body\": {   \"data\" : [[0, EVENT.body]]  }};
         $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"))
 
-    snowflake_cursor.execute(createendpointconfig_response_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR", createendpointconfig_response_translator_str)
 
     create_createendpointconfig_ef_str = ("""create or replace external function %s(endpointConfigName varchar, modelName varchar, instanceType varchar, instanceCount int)
     returns variant
@@ -355,14 +1070,31 @@ def create_createendpointconfig_ef(snowflake_cursor, api_integration_name, api_g
     request_translator = %s
     response_translator=%s
     max_batch_rows=1
-    as '%s/createendpointconfig';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"), api_gateway_url)
+    as '%s/createendpointconfig';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG", create_createendpointconfig_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"])
+
+    create_createendpointconfig_ef_str2 = ("""create or replace external function %s(endpointConfigName varchar, modelName varchar, memorySizeInMB int, maxConcurrency int)
+    returns variant
+    api_integration = \"%s\"
+    request_translator = %s
+    response_translator=%s
+    max_batch_rows=1
+    as '%s/createendpointconfig';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
 
-    snowflake_cursor.execute(create_createendpointconfig_ef_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_SERVERLESS", create_createendpointconfig_ef_str2,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"])
 
-def create_describeendpointconfig_ef(snowflake_cursor, api_integration_name, api_gateway_url):
-    logger.info("Creating External function: AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG [api_integration_name=%s, api_gateway_url=%s]", api_integration_name, api_gateway_url)
+def create_describeendpointconfig_ef(statement_plan, api_integration_name, api_gateway_url,
+                                     backend=PREDICT_OUTCOME_ENDPOINT_BACKEND, database_name=None, schema_name=None):
+    logger.info("Creating External function: AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG [api_integration_name=%s, api_gateway_url=%s, backend=%s]", api_integration_name, api_gateway_url, backend)
 
-    describeendpointconfig_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
+    if backend == PREDICT_OUTCOME_PROXY_BACKEND:
+        describeendpointconfig_request_translator_str = get_describe_batch_request_translator_str(
+            add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR"))
+    else:
+        describeendpointconfig_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
         $$
         let endpointConfigName = EVENT.body.data[0][1];
@@ -372,27 +1104,35 @@ def create_describeendpointconfig_ef(snowflake_cursor, api_integration_name, api
         return {\"body\": payload};
         $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR"))
 
-    snowflake_cursor.execute(describeendpointconfig_request_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", describeendpointconfig_request_translator_str)
 
-    describeendpointconfig_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
-        returns OBJECT LANGUAGE JAVASCRIPT AS
-        $$
-            return {\"body\": {   \"data\" : [[0, EVENT.body]]  }};
-        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"))
+    describeendpointconfig_to_result_str = """function toResult(response) {
+            if (response.ProductionVariants !== undefined && response.ProductionVariants.length > 0) {
+                let serverless = response.ProductionVariants.some(variant => variant.ServerlessConfig !== undefined);
+                response[\"InferenceMode\"] = serverless ? \"Serverless\" : \"Instance\";
+            }
+            return response;
+        }"""
+
+    describeendpointconfig_response_translator_str = get_describe_response_translator_str(
+        add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"),
+        describeendpointconfig_to_result_str, backend)
 
-    snowflake_cursor.execute(describeendpointconfig_response_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR", describeendpointconfig_response_translator_str)
 
     create_describeendpointconfig_ef_str = ("""create or replace external function %s(endpointConfigName varchar)
     returns variant
     api_integration = \"%s\"
     request_translator = %s
     response_translator=%s
-    max_batch_rows=1
-    as '%s/describeendpointconfig';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"), api_gateway_url)
+    max_batch_rows=%d
+    as '%s/describeendpointconfig';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR", database_name, schema_name), get_describe_max_batch_rows(backend), api_gateway_url)
 
-    snowflake_cursor.execute(create_describeendpointconfig_ef_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG", create_describeendpointconfig_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"])
 
-def create_deleteendpointconfig_ef(snowflake_cursor, api_integration_name, api_gateway_url):
+def create_deleteendpointconfig_ef(statement_plan, api_integration_name, api_gateway_url,
+                                   database_name=None, schema_name=None):
     logger.info("Creating External function: AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG [api_integration_name=%s, api_gateway_url=%s]", api_integration_name, api_gateway_url)
 
     deleteendpointconfig_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
@@ -405,7 +1145,7 @@ def create_deleteendpointconfig_ef(snowflake_cursor, api_integration_name, api_g
         return {\"body\": payload};
         $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR"))
 
-    snowflake_cursor.execute(deleteendpointconfig_request_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", deleteendpointconfig_request_translator_str)
 
     deleteendpointconfig_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
@@ -413,7 +1153,7 @@ def create_deleteendpointconfig_ef(snowflake_cursor, api_integration_name, api_g
             return {\"body\": {   \"data\" : [[0, EVENT.body]]  }};
         $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"))
 
-    snowflake_cursor.execute(deleteendpointconfig_response_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR", deleteendpointconfig_response_translator_str)
 
     create_deleteendpointconfig_ef_str = ("""create or replace external function %s(endpointConfigName varchar)
     returns variant
@@ -421,14 +1161,20 @@ def create_deleteendpointconfig_ef(snowflake_cursor, api_integration_name, api_g
     request_translator = %s
     response_translator=%s
     max_batch_rows=1
-    as '%s/deleteendpointconfig';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"), api_gateway_url)
+    as '%s/deleteendpointconfig';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
 
-    snowflake_cursor.execute(create_deleteendpointconfig_ef_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG", create_deleteendpointconfig_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_DELETE_ENDPOINT_CONFIG_RESPONSE_TRANSLATOR"])
 
-def create_describeendpoint_ef(snowflake_cursor, api_integration_name, api_gateway_url):
-    logger.info("Creating External function: AWS_AUTOPILOT_DESCRIBE_ENDPOINT [api_integration_name=%s, api_gateway_url=%s]", api_integration_name, api_gateway_url)
+def create_describeendpoint_ef(statement_plan, api_integration_name, api_gateway_url,
+                               backend=PREDICT_OUTCOME_ENDPOINT_BACKEND, database_name=None, schema_name=None):
+    logger.info("Creating External function: AWS_AUTOPILOT_DESCRIBE_ENDPOINT [api_integration_name=%s, api_gateway_url=%s, backend=%s]", api_integration_name, api_gateway_url, backend)
 
-    describeendpoint_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
+    if backend == PREDICT_OUTCOME_PROXY_BACKEND:
+        describeendpoint_request_translator_str = get_describe_batch_request_translator_str(
+            add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_REQUEST_TRANSLATOR"))
+    else:
+        describeendpoint_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
         $$
             let endpointName = EVENT.body.data[0][1];
@@ -438,28 +1184,37 @@ def create_describeendpoint_ef(snowflake_cursor, api_integration_name, api_gatew
         return {\"body\": JSON.stringify(payload)};
         $$""")  % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_REQUEST_TRANSLATOR"))
 
-    snowflake_cursor.execute(describeendpoint_request_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_REQUEST_TRANSLATOR", describeendpoint_request_translator_str)
 
-    describeendpoint_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
-        returns OBJECT LANGUAGE JAVASCRIPT AS
-        $$
-            return {\"body\": {   \"data\" : [[0, EVENT.body]]  }}
-        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_RESPONSE_TRANSLATOR"))
+    describeendpoint_to_result_str = """function toResult(response) {
+            if (response.ProductionVariants !== undefined && response.ProductionVariants.length > 0) {
+                let serverless = response.ProductionVariants.some(variant =>
+                    variant.CurrentServerlessConfig !== undefined || variant.DesiredServerlessConfig !== undefined);
+                response[\"InferenceMode\"] = serverless ? \"Serverless\" : \"Instance\";
+            }
+            return response;
+        }"""
 
-    snowflake_cursor.execute(describeendpoint_response_translator_str)
+    describeendpoint_response_translator_str = get_describe_response_translator_str(
+        add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_RESPONSE_TRANSLATOR"),
+        describeendpoint_to_result_str, backend)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_RESPONSE_TRANSLATOR", describeendpoint_response_translator_str)
 
     create_describeendpoint_ef_str = ("""create or replace external function %s(endpointName varchar)
     returns variant
     api_integration = \"%s\"
     request_translator = %s
     response_translator=%s
-    max_batch_rows=1
-    as '%s/describeendpoint';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_REQUEST_TRANSLATOR"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_RESPONSE_TRANSLATOR"), api_gateway_url)
+    max_batch_rows=%d
+    as '%s/describeendpoint';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT_RESPONSE_TRANSLATOR", database_name, schema_name), get_describe_max_batch_rows(backend), api_gateway_url)
 
-    snowflake_cursor.execute(create_describeendpoint_ef_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_ENDPOINT", create_describeendpoint_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_RESPONSE_TRANSLATOR"])
 
 
-def create_deleteendpoint_ef(snowflake_cursor, api_integration_name, api_gateway_url):
+def create_deleteendpoint_ef(statement_plan, api_integration_name, api_gateway_url,
+                             database_name=None, schema_name=None):
     logger.info("Creating External function: AWS_AUTOPILOT_DELETE_ENDPOINT [api_integration_name=%s, api_gateway_url=%s]", api_integration_name, api_gateway_url)
 
     deleteendpoint_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
@@ -472,7 +1227,7 @@ def create_deleteendpoint_ef(snowflake_cursor, api_integration_name, api_gateway
         return {\"body\": JSON.stringify(payload)};
         $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_REQUEST_TRANSLATOR"))
 
-    snowflake_cursor.execute(deleteendpoint_request_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DELETE_ENDPOINT_REQUEST_TRANSLATOR", deleteendpoint_request_translator_str)
 
     deleteendpoint_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
@@ -480,7 +1235,7 @@ def create_deleteendpoint_ef(snowflake_cursor, api_integration_name, api_gateway
             return {\"body\": {   \"data\" : [[0, EVENT.body]]  }}
         $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_RESPONSE_TRANSLATOR"))
 
-    snowflake_cursor.execute(deleteendpoint_response_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DELETE_ENDPOINT_RESPONSE_TRANSLATOR", deleteendpoint_response_translator_str)
 
     create_deleteendpoint_ef_str = ("""create or replace external function %s(endpointName varchar)
     returns variant
@@ -488,34 +1243,86 @@ def create_deleteendpoint_ef(snowflake_cursor, api_integration_name, api_gateway
     request_translator = %s
     response_translator=%s
     max_batch_rows=1
-    as '%s/deleteendpoint';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_REQUEST_TRANSLATOR"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_RESPONSE_TRANSLATOR"), api_gateway_url)
+    as '%s/deleteendpoint';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DELETE_ENDPOINT_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
 
-    snowflake_cursor.execute(create_deleteendpoint_ef_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_DELETE_ENDPOINT", create_deleteendpoint_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_DELETE_ENDPOINT_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_DELETE_ENDPOINT_RESPONSE_TRANSLATOR"])
 
 
-def create_predictoutcome_ef(snowflake_cursor, api_integration_name, api_gateway_url):
-    logger.info("Creating External function: AWS_AUTOPILOT_PREDICT_OUTCOME [api_integration_name=%s, api_gateway_url=%s]", api_integration_name, api_gateway_url)
+def create_predictoutcome_ef(statement_plan, api_integration_name, api_gateway_url,
+                             max_batch_rows=DEFAULT_PREDICT_OUTCOME_MAX_BATCH_ROWS,
+                             backend=PREDICT_OUTCOME_ENDPOINT_BACKEND,
+                             compression=DEFAULT_PREDICT_OUTCOME_COMPRESSION, database_name=None, schema_name=None):
+    logger.info("Creating External function: AWS_AUTOPILOT_PREDICT_OUTCOME [api_integration_name=%s, api_gateway_url=%s, max_batch_rows=%s, backend=%s, compression=%s]", api_integration_name, api_gateway_url, max_batch_rows, backend, compression)
 
-    predictoutcome_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
+    if backend == PREDICT_OUTCOME_PROXY_BACKEND:
+        # Identical rows are sent once. rowIndex gives the distinct row of every row of the batch, the proxy returns it
+        # with the predictions of the distinct rows so that the response translator can expand them. The rows of a
+        # batch can be scored by different endpoints, rowEndpoint gives the endpoint of every distinct row
+        predictoutcome_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+        let endpointName = \"/\"  + encodeURIComponent(EVENT.body.data[0][1]) + \"?format=envelope\";
+        let endpoints = [];
+        let endpointIndexes = new Map();
+        let distinctRows = [];
+        let rowEndpoint = [];
+        let distinctIndexes = new Map();
+        let rowIndex = [];
+        for (let i = 0; i < EVENT.body.data.length; i++) {
+            let endpointIndex = endpointIndexes.get(EVENT.body.data[i][1]);
+            if (endpointIndex === undefined) {
+                endpointIndex = endpoints.length;
+                endpointIndexes.set(EVENT.body.data[i][1], endpointIndex);
+                endpoints.push(EVENT.body.data[i][1]);
+            }
+            let row = EVENT.body.data[i][2].join(',');
+            let distinctKey = endpointIndex + \":\" + row;
+            let distinctIndex = distinctIndexes.get(distinctKey);
+            if (distinctIndex === undefined) {
+                distinctIndex = distinctRows.length;
+                distinctIndexes.set(distinctKey, distinctIndex);
+                distinctRows.push(row);
+                rowEndpoint.push(endpointIndex);
+            }
+            rowIndex.push(distinctIndex);
+        }
+        let payload = {
+            \"endpoints\": endpoints,
+            \"rows\": distinctRows.join('\\n'),
+            \"rowEndpoint\": rowEndpoint,
+            \"rowIndex\": rowIndex
+        };
+        return {\"body\": JSON.stringify(payload), \"urlSuffix\" : endpointName};
+        $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR"))
+    else:
+        # The whole batch goes to one endpoint, a batch mixing endpoints fails instead of being scored by the wrong model
+        predictoutcome_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
         $$
         let endpointName = \"/\"  + encodeURIComponent(EVENT.body.data[0][1]);
         var payload = [];
         for(i = 0; i < EVENT.body.data.length; i++) {
             var row = EVENT.body.data[i];
+            if (row[1] !== EVENT.body.data[0][1]) {
+                throw new Error(\"Rows scored by different endpoints in one batch need predictOutcomeBackend=PROXY\");
+            }
             payload[i] = row[2];
         }
         payloadBody = payload.map(e => e.join(',')).join('\\n');
         return {\"body\": payloadBody, \"urlSuffix\" : endpointName};
         $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR"))
 
-    snowflake_cursor.execute(predictoutcome_request_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR", predictoutcome_request_translator_str)
 
     predictoutcome_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
         $$
         let array_of_rows_to_return = [];
         let rows = EVENT.body.predictions;
+        if (EVENT.body.rowIndex !== undefined) {
+            rows = EVENT.body.rowIndex.map(distinctIndex => EVENT.body.predictions[distinctIndex]);
+        }
         for (let i = 0; i < rows.length; i++) {
         let row_to_return = [i, rows[i]];
         array_of_rows_to_return.push(row_to_return);
@@ -523,22 +1330,199 @@ def create_predictoutcome_ef(snowflake_cursor, api_integration_name, api_gateway
         return {\"body\": {\"data\": array_of_rows_to_return}};
         $$;""")  % (add_snowflake_resource_suffix("AWS_AUTOPILOT_PREDICT_OUTCOME_RESPONSE_TRANSLATOR"))
 
-    snowflake_cursor.execute(predictoutcome_response_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_PREDICT_OUTCOME_RESPONSE_TRANSLATOR", predictoutcome_response_translator_str)
+
+    create_predictoutcome_ef_str = get_predictoutcome_ef_str(add_snowflake_resource_suffix("AWS_AUTOPILOT_PREDICT_OUTCOME"),
+                                                             api_integration_name, api_gateway_url, max_batch_rows,
+                                                             compression=compression, database_name=database_name,
+                                                             schema_name=schema_name)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_PREDICT_OUTCOME", create_predictoutcome_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_PREDICT_OUTCOME_RESPONSE_TRANSLATOR"])
 
-    create_predictoutcome_ef_str = ("""create or replace external function %s(endpointName varchar, columns array)
+
+# Also used by tools/predict-batch-size.py to create predict functions with the batch size of a given model
+def get_predictoutcome_ef_str(function_name, api_integration_name, api_gateway_url, max_batch_rows,
+                              response_translator_name="AWS_AUTOPILOT_PREDICT_OUTCOME_RESPONSE_TRANSLATOR",
+                              compression=DEFAULT_PREDICT_OUTCOME_COMPRESSION, database_name=None, schema_name=None):
+    return ("""create or replace external function %s(endpointName varchar, columns array)
     returns variant
     api_integration = \"%s\"
     request_translator = %s
     response_translator=%s
-    max_batch_rows=100
-    as '%s/predictoutcome';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_PREDICT_OUTCOME"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_PREDICT_OUTCOME_RESPONSE_TRANSLATOR"), api_gateway_url)
+    max_batch_rows=%d
+    compression='%s'
+    as '%s/predictoutcome';""") % (function_name, api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix(response_translator_name, database_name, schema_name), max_batch_rows, compression, api_gateway_url)
+
+
+def create_predictoutcomewithprobabilities_ef(statement_plan, api_integration_name, api_gateway_url,
+                                              max_batch_rows=DEFAULT_PREDICT_OUTCOME_MAX_BATCH_ROWS,
+                                              compression=DEFAULT_PREDICT_OUTCOME_COMPRESSION, database_name=None,
+                                              schema_name=None):
+    logger.info("Creating External function: AWS_AUTOPILOT_PREDICT_OUTCOME_WITH_PROBABILITIES [api_integration_name=%s, api_gateway_url=%s, max_batch_rows=%s, compression=%s]", api_integration_name, api_gateway_url, max_batch_rows, compression)
+
+    # The request is the same as AWS_AUTOPILOT_PREDICT_OUTCOME, only the response is read differently. The inference
+    # response keys are chosen by the SAGEMAKER_INFERENCE_OUTPUT environment variable of the model, the keys that
+    # are not returned by the endpoint are left out. The probabilities are keyed by label when labels are returned.
+    # The models deployed by AWS_AUTOPILOT_CREATE_MODEL only return the label, the query fails instead of returning it
+    # alone.
+    predictoutcomewithprobabilities_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+        let array_of_rows_to_return = [];
+        let rows = EVENT.body.predictions;
+        if (EVENT.body.rowIndex !== undefined) {
+            rows = EVENT.body.rowIndex.map(distinctIndex => EVENT.body.predictions[distinctIndex]);
+        }
+        for (let i = 0; i < rows.length; i++) {
+        let prediction = (rows[i] !== null && typeof rows[i] === \"object\") ? rows[i] : {\"predicted_label\": rows[i]};
+        let row_to_return = {\"predicted_label\": prediction.predicted_label};
+        if (prediction.probability !== undefined) {
+            row_to_return[\"probability\"] = prediction.probability;
+        }
+        if (prediction.probabilities !== undefined && prediction.labels !== undefined) {
+            let probabilities = {};
+            for (let j = 0; j < prediction.labels.length; j++) {
+                probabilities[prediction.labels[j]] = prediction.probabilities[j];
+            }
+            row_to_return[\"probabilities\"] = probabilities;
+        } else if (prediction.probabilities !== undefined) {
+            row_to_return[\"probabilities\"] = prediction.probabilities;
+        } else if (prediction.probability === undefined) {
+            throw new Error(\"The endpoint returned no probabilities, deploy the model created by %s instead\");
+        }
+        array_of_rows_to_return.push([i, row_to_return]);
+        }
+        return {\"body\": {\"data\": array_of_rows_to_return}};
+        $$;""")  % (add_snowflake_resource_suffix("AWS_AUTOPILOT_PREDICT_OUTCOME_WITH_PROBABILITIES_RESPONSE_TRANSLATOR"), add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_PROBABILITY_MODEL"))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_PREDICT_OUTCOME_WITH_PROBABILITIES_RESPONSE_TRANSLATOR", predictoutcomewithprobabilities_response_translator_str)
+
+    create_predictoutcomewithprobabilities_ef_str = get_predictoutcome_ef_str(
+        add_snowflake_resource_suffix("AWS_AUTOPILOT_PREDICT_OUTCOME_WITH_PROBABILITIES"), api_integration_name,
+        api_gateway_url, max_batch_rows, "AWS_AUTOPILOT_PREDICT_OUTCOME_WITH_PROBABILITIES_RESPONSE_TRANSLATOR",
+        compression, database_name, schema_name)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_PREDICT_OUTCOME_WITH_PROBABILITIES", create_predictoutcomewithprobabilities_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_PREDICT_OUTCOME_WITH_PROBABILITIES_RESPONSE_TRANSLATOR"])
+
+
+def create_probabilitymodel_ef(statement_plan, api_integration_name, api_gateway_url, auto_ml_role_arn,
+                               vpc_security_group_ids, vpc_subnet_ids, backend=PREDICT_OUTCOME_ENDPOINT_BACKEND,
+                               database_name=None, schema_name=None):
+    logger.info("Creating External functions: AWS_AUTOPILOT_DESCRIBE_BEST_CANDIDATE, AWS_AUTOPILOT_CREATE_INFERENCE_MODEL [api_integration_name=%s, api_gateway_url=%s, backend=%s]", api_integration_name, api_gateway_url, backend)
+
+    vpc_security_group_ids_with_quotes = add_quotes_to_comma_delimited_list_items(vpc_security_group_ids)
+    vpc_subnet_ids_with_quotes = add_quotes_to_comma_delimited_list_items(vpc_subnet_ids)
+
+    # Same request as AWS_AUTOPILOT_DESCRIBE_MODEL, only the inference containers of the best candidate are returned
+    describebestcandidate_to_result_str = """function toResult(responseBody) {
+            let response = {\"JobStatus\": responseBody.AutoMLJobStatus};
+            if (responseBody.BestCandidate) {
+                response[\"CandidateName\"] = responseBody.BestCandidate.CandidateName;
+                response[\"InferenceContainers\"] = responseBody.BestCandidate.InferenceContainers;
+            }
+            return response;
+        }"""
+
+    describebestcandidate_response_translator_str = get_describe_response_translator_str(
+        add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_BEST_CANDIDATE_RESPONSE_TRANSLATOR"),
+        describebestcandidate_to_result_str, backend)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_BEST_CANDIDATE_RESPONSE_TRANSLATOR", describebestcandidate_response_translator_str)
+
+    create_describebestcandidate_ef_str = ("""create or replace external function %s(modelname varchar)
+        returns variant
+        api_integration = \"%s\"
+        request_translator =%s
+        response_translator=%s
+        max_batch_rows=%d
+        as '%s/describemodel';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_BEST_CANDIDATE"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_MODEL_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_BEST_CANDIDATE_RESPONSE_TRANSLATOR", database_name, schema_name), get_describe_max_batch_rows(backend), api_gateway_url)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_BEST_CANDIDATE", create_describebestcandidate_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_DESCRIBE_MODEL_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_DESCRIBE_BEST_CANDIDATE_RESPONSE_TRANSLATOR"])
+
+    # Named <model>-job-best-model like the models of the Autopilot jobs, so that the endpoint config, transform job
+    # and predict functions take the new model name as they take the name of an Autopilot model. As documented for
+    # the Autopilot inference containers, the containers after the feature transform one return the keys of
+    # SAGEMAKER_INFERENCE_OUTPUT, and the inverse label transform container also reads them as its input
+    createinferencemodel_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+        let modelName = EVENT.body.data[0][1];
+        let inferenceContainers = EVENT.body.data[0][2];
+        let inferenceOutput = EVENT.body.data[0][3];
+        let vpcSecurityGroupIds = [%s];
+        let vpcSubnetIds = [%s];
+
+        let containers = inferenceContainers.map((container, i) => {
+            let environment = Object.assign({}, container.Environment);
+            if (inferenceContainers.length === 1 || i >= 1) {
+                environment[\"SAGEMAKER_INFERENCE_OUTPUT\"] = inferenceOutput;
+            }
+            if (i >= 2) {
+                environment[\"SAGEMAKER_INFERENCE_INPUT\"] = inferenceOutput;
+            }
+            return {\"Image\": container.Image, \"ModelDataUrl\": container.ModelDataUrl, \"Environment\": environment};
+        });
+        let payload = {
+            \"ModelName\": modelName + \"-job-best-model\",
+            \"Containers\": containers,
+            \"ExecutionRoleArn\": \"%s\",
+            \"Tags\": [{\"Key\": \"%s\", \"Value\": \"%s\"}]
+        };
+        if (vpcSecurityGroupIds.length > 0 && vpcSubnetIds.length > 0) {
+            payload[\"VpcConfig\"] = {\"SecurityGroupIds\": vpcSecurityGroupIds, \"Subnets\": vpcSubnetIds};
+        }
+        return {\"body\": payload};
+        $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_INFERENCE_MODEL_REQUEST_TRANSLATOR"), vpc_security_group_ids_with_quotes, vpc_subnet_ids_with_quotes, auto_ml_role_arn, STACK_TAG_KEY, os.environ['StackName'])
 
-    snowflake_cursor.execute(create_predictoutcome_ef_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_INFERENCE_MODEL_REQUEST_TRANSLATOR", createinferencemodel_request_translator_str)
+
+    createinferencemodel_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+            return {\"body\": {   \"data\" : [[0, EVENT.body]]  }};
+        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_INFERENCE_MODEL_RESPONSE_TRANSLATOR"))
 
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_INFERENCE_MODEL_RESPONSE_TRANSLATOR", createinferencemodel_response_translator_str)
 
-def create_createmodel_ef(snowflake_cursor, api_integration_name, api_gateway_url, secret_arn, s3_bucket_name,
+    create_createinferencemodel_ef_str = ("""create or replace external function %s(modelName varchar, inferenceContainers array, inferenceOutput varchar)
+    returns variant
+    api_integration = \"%s\"
+    request_translator = %s
+    response_translator=%s
+    max_batch_rows=1
+    as '%s/createinferencemodel';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_INFERENCE_MODEL"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_INFERENCE_MODEL_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_INFERENCE_MODEL_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_INFERENCE_MODEL", create_createinferencemodel_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_CREATE_INFERENCE_MODEL_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_CREATE_INFERENCE_MODEL_RESPONSE_TRANSLATOR"])
+
+    create_probability_model_str = ("""create or replace procedure %s(MODELNAME varchar, PROBABILITYMODELNAME varchar)
+        returns variant LANGUAGE JAVASCRIPT EXECUTE AS CALLER AS
+        $$
+        let describeResult = snowflake.execute({sqlText: \"select %s(?)\", binds: [MODELNAME]});
+        describeResult.next();
+        let candidate = describeResult.getColumnValue(1);
+        if (candidate.Error !== undefined) {
+            throw new Error(\"Cannot describe model \" + MODELNAME + \": \" + candidate.Error.Message);
+        }
+        if (candidate.JobStatus !== \"Completed\" || candidate.InferenceContainers === undefined) {
+            throw new Error(\"Model \" + MODELNAME + \" has no best candidate to deploy, its job is \" + candidate.JobStatus);
+        }
+        let createResult = snowflake.execute({sqlText: \"select %s(?, parse_json(?), ?)\",
+            binds: [PROBABILITYMODELNAME, JSON.stringify(candidate.InferenceContainers), \"%s\"]});
+        createResult.next();
+        return createResult.getColumnValue(1);
+        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_PROBABILITY_MODEL"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_BEST_CANDIDATE", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_INFERENCE_MODEL", database_name, schema_name), PROBABILITY_INFERENCE_OUTPUT)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_PROBABILITY_MODEL", create_probability_model_str,
+                  depends_on=["AWS_AUTOPILOT_DESCRIBE_BEST_CANDIDATE", "AWS_AUTOPILOT_CREATE_INFERENCE_MODEL"])
+
+
+def create_createmodel_ef(statement_plan, api_integration_name, api_gateway_url, secret_arn, s3_bucket_name,
                           storage_integration_name, auto_ml_role_arn, snowflake_role_name,
-                          kms_key_arn, vpc_security_group_ids, vpc_subnet_ids):
+                          kms_key_arn, vpc_security_group_ids, vpc_subnet_ids, database_name=None, schema_name=None):
     logger.info(
         "Creating External function: AWS_AUTOPILOT_CREATE_MODEL [api_integration_name=%s, api_gateway_url=%s, secret_arn=%s, s3_bucket_name=%s, storage_integration_name=%s, auto_ml_role_arn=%s, snowflake_role_name=%s, kms_key_arn=%s, vpc_security_group_ids=%s, vpc_subnet_ids=%s]",
         api_integration_name, api_gateway_url, secret_arn, s3_bucket_name, storage_integration_name, auto_ml_role_arn,
@@ -560,8 +1544,10 @@ def create_createmodel_ef(snowflake_cursor, api_integration_name, api_gateway_ur
         let problemType;
         let objectiveMetric;
         let maxCandidates;
+        let instanceType = \"ml.m5.4xlarge\";
+        let instanceCount = 2;
 
-        if (EVENT.body.data[0].length == 10) {
+        if (EVENT.body.data[0].length >= 10) {
             if (EVENT.body.data[0][4] != undefined) {
                 objectiveMetric = EVENT.body.data[0][4];
             }
@@ -587,6 +1573,20 @@ def create_createmodel_ef(snowflake_cursor, api_integration_name, api_gateway_ur
             }
         }
 
+        if (EVENT.body.data[0].length == 12) {
+            if (EVENT.body.data[0][10] != undefined) {
+                instanceType = EVENT.body.data[0][10];
+            }
+
+            if (EVENT.body.data[0][11] != undefined) {
+                instanceCount = EVENT.body.data[0][11];
+            }
+        }
+
+        // Named after the sizing, ml.m5.4xlarge with 2 instances gives <model>-m5-4xl-2
+        let endpointConfigName = modelname + \"-\" + instanceType.replace(/^ml\\./, \"\").replace(\"xlarge\", \"xl\")
+            .replace(\"large\", \"l\").replace(/\\./g, \"-\") + \"-\" + instanceCount;
+
         let contextHeaders = EVENT.contextHeaders;
         let jobDatasetsPath = modelname + \"-job/datasets/\" ;
         let databaseName = contextHeaders[\"sf-context-current-database\"];
@@ -635,7 +1635,8 @@ def create_createmodel_ef(snowflake_cursor, api_integration_name, api_gateway_ur
             \"OutputDataConfig\": {
             \"S3OutputPath\": s3OutputUri
             },
-            \"RoleArn\": \"%s\"
+            \"RoleArn\": \"%s\",
+            \"Tags\": [{\"Key\": \"%s\", \"Value\": \"%s\"}]
         };
 
         if (objectiveMetric) {
@@ -673,15 +1674,15 @@ def create_createmodel_ef(snowflake_cursor, api_integration_name, api_gateway_ur
                 \"ModelDeployMode\": \"Endpoint\",
                 \"EndpointConfigDefinitions\": [
                 {
-                    \"EndpointConfigName\":  modelname + \"-m5-4xl-2\",
-                    \"InitialInstanceCount\": 2,
-                    \"InstanceType\": \"ml.m5.4xlarge\"
+                    \"EndpointConfigName\": endpointConfigName,
+                    \"InitialInstanceCount\": instanceCount,
+                    \"InstanceType\": instanceType
                 }
                 ],
                 \"EndpointDefinitions\": [
                 {
                     \"EndpointName\": modelname,
-                    \"EndpointConfigName\": modelname + \"-m5-4xl-2\",
+                    \"EndpointConfigName\": endpointConfigName,
                     \"DeletionCondition\": {
                     \"MaxRuntimeInSeconds\": modelEndpointTTL
                     }
@@ -695,9 +1696,9 @@ def create_createmodel_ef(snowflake_cursor, api_integration_name, api_gateway_ur
         }
 
         return {\"body\": JSON.stringify(payload)};
-        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR"), s3_bucket_name, kms_key_arn, vpc_security_group_ids_with_quotes, vpc_subnet_ids_with_quotes, snowflake_role_name, secret_arn, storage_integration_name, auto_ml_role_arn)
+        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR"), s3_bucket_name, kms_key_arn, vpc_security_group_ids_with_quotes, vpc_subnet_ids_with_quotes, snowflake_role_name, secret_arn, storage_integration_name, auto_ml_role_arn, STACK_TAG_KEY, os.environ['StackName'])
 
-    snowflake_cursor.execute(createmodel_request_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR", createmodel_request_translator_str)
 
     createmodel_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
         returns OBJECT LANGUAGE JAVASCRIPT AS
@@ -707,7 +1708,7 @@ def create_createmodel_ef(snowflake_cursor, api_integration_name, api_gateway_ur
         return {\"body\": {   \"data\" : [[0, message]]  }}
         $$;""") %  (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_MODEL_RESPONSE_TRANSLATOR"))
 
-    snowflake_cursor.execute(createmodel_response_translator_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_MODEL_RESPONSE_TRANSLATOR", createmodel_response_translator_str)
 
     create_createmodel_ef_str = ("""create or replace external function %s(modelname varchar, targettable varchar, targetcol varchar)
     returns variant
@@ -716,9 +1717,10 @@ def create_createmodel_ef(snowflake_cursor, api_integration_name, api_gateway_ur
     request_translator = %s
     response_translator=%s
     max_batch_rows=1
-    as '%s/createmodel';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_MODEL"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_MODEL_RESPONSE_TRANSLATOR"), api_gateway_url)
+    as '%s/createmodel';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_MODEL"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_MODEL_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
 
-    snowflake_cursor.execute(create_createmodel_ef_str)
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_MODEL", create_createmodel_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_CREATE_MODEL_RESPONSE_TRANSLATOR"])
 
     create_createmodel_ef_str2 = ("""create or replace external function %s(modelname varchar, targettable varchar,
     targetcol varchar, objectiveMetric varchar, problemType varchar, maxCandidates integer, maxRunningTime integer, deployModel boolean, modelEndpointTTL integer)
@@ -728,18 +1730,362 @@ def create_createmodel_ef(snowflake_cursor, api_integration_name, api_gateway_ur
     request_translator = %s
     response_translator=%s
     max_batch_rows=1
-    as '%s/createmodel';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_MODEL"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_MODEL_RESPONSE_TRANSLATOR"), api_gateway_url)
+    as '%s/createmodel';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_MODEL"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_MODEL_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_MODEL_WITH_OPTIONS", create_createmodel_ef_str2,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_CREATE_MODEL_RESPONSE_TRANSLATOR"])
+
+    create_createmodel_ef_str3 = ("""create or replace external function %s(modelname varchar, targettable varchar,
+    targetcol varchar, objectiveMetric varchar, problemType varchar, maxCandidates integer, maxRunningTime integer, deployModel boolean, modelEndpointTTL integer,
+    instanceType varchar, instanceCount integer)
+    returns variant
+    api_integration = \"%s\"
+    context_headers  = (CURRENT_DATABASE, CURRENT_SCHEMA, CURRENT_WAREHOUSE)
+    request_translator = %s
+    response_translator=%s
+    max_batch_rows=1
+    as '%s/createmodel';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_MODEL"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_MODEL_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_MODEL_WITH_DEPLOYMENT_SIZE", create_createmodel_ef_str3,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_CREATE_MODEL_RESPONSE_TRANSLATOR"])
+
+
+def create_endpointautoscaling_ef(statement_plan, api_integration_name, api_gateway_url,
+                                  database_name=None, schema_name=None):
+    logger.info("Creating External functions: AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET, AWS_AUTOPILOT_PUT_SCALING_POLICY [api_integration_name=%s, api_gateway_url=%s]", api_integration_name, api_gateway_url)
+
+    registerscalabletarget_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+        let endpointName = EVENT.body.data[0][1];
+        let variantName = EVENT.body.data[0][2];
+        let minCapacity = EVENT.body.data[0][3];
+        let maxCapacity = EVENT.body.data[0][4];
+        let payload = {
+            \"ServiceNamespace\": \"sagemaker\",
+            \"ResourceId\": \"endpoint/\" + endpointName + \"/variant/\" + variantName,
+            \"ScalableDimension\": \"sagemaker:variant:DesiredInstanceCount\",
+            \"MinCapacity\": minCapacity,
+            \"MaxCapacity\": maxCapacity
+        };
+        return {\"body\": JSON.stringify(payload)};
+        $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET_REQUEST_TRANSLATOR"))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET_REQUEST_TRANSLATOR", registerscalabletarget_request_translator_str)
+
+    registerscalabletarget_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+            return {\"body\": {   \"data\" : [[0, EVENT.body]]  }};
+        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET_RESPONSE_TRANSLATOR"))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET_RESPONSE_TRANSLATOR", registerscalabletarget_response_translator_str)
+
+    create_registerscalabletarget_ef_str = ("""create or replace external function %s(endpointName varchar, variantName varchar, minCapacity int, maxCapacity int)
+    returns variant
+    api_integration = \"%s\"
+    request_translator = %s
+    response_translator=%s
+    max_batch_rows=1
+    as '%s/registerscalabletarget';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET", create_registerscalabletarget_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET_RESPONSE_TRANSLATOR"])
+
+    # Target tracking on the invocations per instance, the number of instances follows the number of predict batches
+    # sent concurrently by Snowflake. Putting the policy again replaces it.
+    putscalingpolicy_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+        let endpointName = EVENT.body.data[0][1];
+        let variantName = EVENT.body.data[0][2];
+        let targetInvocationsPerInstance = EVENT.body.data[0][3];
+        let payload = {
+            \"PolicyName\": \"AWS_AUTOPILOT_INVOCATIONS_PER_INSTANCE\",
+            \"ServiceNamespace\": \"sagemaker\",
+            \"ResourceId\": \"endpoint/\" + endpointName + \"/variant/\" + variantName,
+            \"ScalableDimension\": \"sagemaker:variant:DesiredInstanceCount\",
+            \"PolicyType\": \"TargetTrackingScaling\",
+            \"TargetTrackingScalingPolicyConfiguration\": {
+                \"TargetValue\": targetInvocationsPerInstance,
+                \"PredefinedMetricSpecification\": {
+                    \"PredefinedMetricType\": \"SageMakerVariantInvocationsPerInstance\"
+                }
+            }
+        };
+        return {\"body\": JSON.stringify(payload)};
+        $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_PUT_SCALING_POLICY_REQUEST_TRANSLATOR"))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_PUT_SCALING_POLICY_REQUEST_TRANSLATOR", putscalingpolicy_request_translator_str)
+
+    putscalingpolicy_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+            return {\"body\": {   \"data\" : [[0, EVENT.body]]  }};
+        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_PUT_SCALING_POLICY_RESPONSE_TRANSLATOR"))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_PUT_SCALING_POLICY_RESPONSE_TRANSLATOR", putscalingpolicy_response_translator_str)
+
+    create_putscalingpolicy_ef_str = ("""create or replace external function %s(endpointName varchar, variantName varchar, targetInvocationsPerInstance float)
+    returns variant
+    api_integration = \"%s\"
+    request_translator = %s
+    response_translator=%s
+    max_batch_rows=1
+    as '%s/putscalingpolicy';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_PUT_SCALING_POLICY"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_PUT_SCALING_POLICY_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_PUT_SCALING_POLICY_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_PUT_SCALING_POLICY", create_putscalingpolicy_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_PUT_SCALING_POLICY_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_PUT_SCALING_POLICY_RESPONSE_TRANSLATOR"])
+
+    # The scalable target has to be registered before its policy is put, so both calls are made by a procedure, for
+    # every variant of the endpoint
+    configure_endpoint_autoscaling_str = ("""create or replace procedure %s(ENDPOINTNAME varchar, MINCAPACITY float, MAXCAPACITY float, TARGETINVOCATIONSPERINSTANCE float)
+        returns variant LANGUAGE JAVASCRIPT EXECUTE AS CALLER AS
+        $$
+        let describeResult = snowflake.execute({sqlText: \"select %s(?)\", binds: [ENDPOINTNAME]});
+        describeResult.next();
+        let endpoint = describeResult.getColumnValue(1);
+        if (!endpoint.ProductionVariants) {
+            throw new Error(\"Endpoint \" + ENDPOINTNAME + \" has no production variant: \" + JSON.stringify(endpoint));
+        }
+
+        let response = {\"EndpointName\": ENDPOINTNAME, \"Variants\": []};
+        for (let variant of endpoint.ProductionVariants) {
+            snowflake.execute({sqlText: \"select %s(?, ?, ?, ?)\",
+                binds: [ENDPOINTNAME, variant.VariantName, MINCAPACITY, MAXCAPACITY]});
+            let policyResult = snowflake.execute({sqlText: \"select %s(?, ?, ?)\",
+                binds: [ENDPOINTNAME, variant.VariantName, TARGETINVOCATIONSPERINSTANCE]});
+            policyResult.next();
+            response[\"Variants\"].push({
+                \"VariantName\": variant.VariantName,
+                \"PolicyARN\": policyResult.getColumnValue(1).PolicyARN
+            });
+        }
+        return response;
+        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CONFIGURE_ENDPOINT_AUTOSCALING"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_ENDPOINT", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_PUT_SCALING_POLICY", database_name, schema_name))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_CONFIGURE_ENDPOINT_AUTOSCALING", configure_endpoint_autoscaling_str,
+                  depends_on=["AWS_AUTOPILOT_DESCRIBE_ENDPOINT", "AWS_AUTOPILOT_REGISTER_SCALABLE_TARGET", "AWS_AUTOPILOT_PUT_SCALING_POLICY"])
+
 
-    snowflake_cursor.execute(create_createmodel_ef_str2)
+def create_createtransformjob_ef(statement_plan, api_integration_name, api_gateway_url, s3_bucket_name, kms_key_arn,
+                                 database_name=None, schema_name=None):
+    logger.info("Creating External function: AWS_AUTOPILOT_CREATE_TRANSFORM_JOB [api_integration_name=%s, api_gateway_url=%s, s3_bucket_name=%s, kms_key_arn=%s]", api_integration_name, api_gateway_url, s3_bucket_name, kms_key_arn)
+
+    # The input is unloaded by AWS_AUTOPILOT_START_BATCH_PREDICTION as gzipped CSV files under <job name>/input/. Each
+    # output line is the input row followed by its prediction, so that it can be loaded back without a join.
+    createtransformjob_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+        let jobName = EVENT.body.data[0][1];
+        let modelName = EVENT.body.data[0][2];
+        let instanceType = EVENT.body.data[0][3];
+        let instanceCount = EVENT.body.data[0][4];
+        let s3JobUri = \"s3://%s/%s\" + jobName;
+        let kmsKeyArn = \"%s\";
+        let payload = {
+            \"TransformJobName\": jobName,
+            \"ModelName\": modelName + \"-job-best-model\",
+            \"BatchStrategy\": \"MultiRecord\",
+            \"TransformInput\": {
+                \"DataSource\": {
+                    \"S3DataSource\": {
+                        \"S3DataType\": \"S3Prefix\",
+                        \"S3Uri\": s3JobUri + \"/input/\"
+                    }
+                },
+                \"ContentType\": \"text/csv\",
+                \"CompressionType\": \"Gzip\",
+                \"SplitType\": \"Line\"
+            },
+            \"TransformOutput\": {
+                \"S3OutputPath\": s3JobUri + \"/output/\",
+                \"Accept\": \"text/csv\",
+                \"AssembleWith\": \"Line\"
+            },
+            \"TransformResources\": {
+                \"InstanceType\": instanceType,
+                \"InstanceCount\": instanceCount
+            },
+            \"DataProcessing\": {
+                \"JoinSource\": \"Input\"
+            }
+        };
+        if (kmsKeyArn) {
+            payload[\"TransformOutput\"][\"KmsKeyId\"] = kmsKeyArn;
+            payload[\"TransformResources\"][\"VolumeKmsKeyId\"] = kmsKeyArn;
+        }
+        return {\"body\": JSON.stringify(payload)};
+        $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_TRANSFORM_JOB_REQUEST_TRANSLATOR"), s3_bucket_name, BATCH_TRANSFORM_S3_PREFIX, kms_key_arn)
 
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_TRANSFORM_JOB_REQUEST_TRANSLATOR", createtransformjob_request_translator_str)
 
-def get_storage_integration_info_for_policy(snowflake_cursor, storage_integration_name):
+    createtransformjob_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+            return {\"body\": {   \"data\" : [[0, EVENT.body]]  }};
+        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_TRANSFORM_JOB_RESPONSE_TRANSLATOR"))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_TRANSFORM_JOB_RESPONSE_TRANSLATOR", createtransformjob_response_translator_str)
+
+    create_createtransformjob_ef_str = ("""create or replace external function %s(jobName varchar, modelName varchar, instanceType varchar, instanceCount int)
+    returns variant
+    api_integration = \"%s\"
+    request_translator = %s
+    response_translator=%s
+    max_batch_rows=1
+    as '%s/createtransformjob';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_CREATE_TRANSFORM_JOB"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_TRANSFORM_JOB_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_TRANSFORM_JOB_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_CREATE_TRANSFORM_JOB", create_createtransformjob_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_CREATE_TRANSFORM_JOB_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_CREATE_TRANSFORM_JOB_RESPONSE_TRANSLATOR"])
+
+
+def create_describetransformjob_ef(statement_plan, api_integration_name, api_gateway_url,
+                                   database_name=None, schema_name=None):
+    logger.info("Creating External function: AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB [api_integration_name=%s, api_gateway_url=%s]", api_integration_name, api_gateway_url)
+
+    describetransformjob_request_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+            let jobName = EVENT.body.data[0][1];
+            let payload = {
+                \"TransformJobName\" : jobName
+              };
+        return {\"body\": JSON.stringify(payload)};
+        $$""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB_REQUEST_TRANSLATOR"))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB_REQUEST_TRANSLATOR", describetransformjob_request_translator_str)
+
+    describetransformjob_response_translator_str = ("""create or replace function %s(EVENT OBJECT)
+        returns OBJECT LANGUAGE JAVASCRIPT AS
+        $$
+            return {\"body\": {   \"data\" : [[0, EVENT.body]]  }}
+        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB_RESPONSE_TRANSLATOR"))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB_RESPONSE_TRANSLATOR", describetransformjob_response_translator_str)
+
+    create_describetransformjob_ef_str = ("""create or replace external function %s(jobName varchar)
+    returns variant
+    api_integration = \"%s\"
+    request_translator = %s
+    response_translator=%s
+    max_batch_rows=1
+    as '%s/describetransformjob';""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB"), api_integration_name, get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB_REQUEST_TRANSLATOR", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB_RESPONSE_TRANSLATOR", database_name, schema_name), api_gateway_url)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB", create_describetransformjob_ef_str,
+                  depends_on=[api_integration_name, "AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB_REQUEST_TRANSLATOR", "AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB_RESPONSE_TRANSLATOR"])
+
+
+# External functions cannot run SQL, so the unload of the source table and the load of the predictions are done by
+# stored procedures, through a stage on the bucket of the stack that uses the storage integration
+def create_batch_prediction_procedures(statement_plan, storage_integration_name, s3_bucket_name,
+                                       database_name=None, schema_name=None):
+    logger.info("Creating batch prediction procedures [storage_integration_name=%s, s3_bucket_name=%s]",
+                storage_integration_name, s3_bucket_name)
+
+    batch_transform_stage_str = ("""create or replace stage %s
+    url = 's3://%s/%s'
+    storage_integration = \"%s\"
+    """) % (add_snowflake_resource_suffix("AWS_AUTOPILOT_BATCH_TRANSFORM_STAGE"), s3_bucket_name, BATCH_TRANSFORM_S3_PREFIX, storage_integration_name)
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_BATCH_TRANSFORM_STAGE", batch_transform_stage_str,
+                  depends_on=[storage_integration_name])
+
+    # The columns sent to the model are named, in the order of the training dataset: either every column of the source
+    # table but the target column, which unlabelled tables do not have, or the given feature columns. NULLs are unloaded as empty fields, which Autopilot
+    # models read as missing values
+    start_batch_prediction_body_str = """
+        let columnsStatement = snowflake.createStatement({sqlText: \"select * from \" + SOURCETABLE + \" limit 0\"});
+        columnsStatement.execute();
+        let tableColumns = [];
+        for (let i = 1; i <= columnsStatement.getColumnCount(); i++) {
+            tableColumns.push(columnsStatement.getColumnName(i));
+        }
+        %s
+        let jobName = MODELNAME + \"-bt-\" + Date.now();
+        let selectList = featureColumns.map(column => '\"' + column.replace(/\"/g, '\"\"') + '\"').join(\", \");
+        snowflake.execute({sqlText: \"copy into @%s/\" + jobName + \"/input/ from (select \" + selectList + \" from \" + SOURCETABLE + \")\" +
+            \" file_format = (type = csv compression = gzip field_optionally_enclosed_by = '\\\"' null_if = ('')) header = false max_file_size = 104857600\"});
+        snowflake.execute({sqlText: \"select %s(?, ?, ?, ?)\", binds: [jobName, MODELNAME, INSTANCETYPE, INSTANCECOUNT]});
+        return jobName;
+        """
+
+    start_batch_prediction_str = ("""create or replace procedure %s(MODELNAME varchar, SOURCETABLE varchar, TARGETCOLUMN varchar, INSTANCETYPE varchar, INSTANCECOUNT float)
+        returns varchar LANGUAGE JAVASCRIPT EXECUTE AS CALLER AS
+        $$%s$$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_START_BATCH_PREDICTION"), start_batch_prediction_body_str % ("""let featureColumns = tableColumns.filter(column => column.toUpperCase() !== TARGETCOLUMN.toUpperCase());""", get_full_resource_name_with_suffix("AWS_AUTOPILOT_BATCH_TRANSFORM_STAGE", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_TRANSFORM_JOB", database_name, schema_name)))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_START_BATCH_PREDICTION", start_batch_prediction_str,
+                  depends_on=["AWS_AUTOPILOT_BATCH_TRANSFORM_STAGE", "AWS_AUTOPILOT_CREATE_TRANSFORM_JOB"])
+
+    start_batch_prediction_str2 = ("""create or replace procedure %s(MODELNAME varchar, SOURCETABLE varchar, FEATURECOLUMNS array, INSTANCETYPE varchar, INSTANCECOUNT float)
+        returns varchar LANGUAGE JAVASCRIPT EXECUTE AS CALLER AS
+        $$%s$$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_START_BATCH_PREDICTION"), start_batch_prediction_body_str % ("""let featureColumns = FEATURECOLUMNS.map(featureColumn => {
+            let column = tableColumns.find(tableColumn => tableColumn.toUpperCase() === featureColumn.toUpperCase());
+            if (column === undefined) {
+                throw new Error(\"Column \" + featureColumn + \" not found in table \" + SOURCETABLE);
+            }
+            return column;
+        });""", get_full_resource_name_with_suffix("AWS_AUTOPILOT_BATCH_TRANSFORM_STAGE", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_CREATE_TRANSFORM_JOB", database_name, schema_name)))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_START_BATCH_PREDICTION_FEATURE_COLUMNS", start_batch_prediction_str2,
+                  depends_on=["AWS_AUTOPILOT_BATCH_TRANSFORM_STAGE", "AWS_AUTOPILOT_CREATE_TRANSFORM_JOB"])
+
+    # The output files are parsed as the job wrote them, as given by the Accept, SplitType and AssembleWith of the job:
+    # CSV lines, or JSON lines loaded by column name. COPY skips the files it already loaded into the table, so calling
+    # it again after the job completed loads nothing
+    load_batch_prediction_str = ("""create or replace procedure %s(JOBNAME varchar, TARGETTABLE varchar)
+        returns variant LANGUAGE JAVASCRIPT EXECUTE AS CALLER AS
+        $$
+        let describeResult = snowflake.execute({sqlText: \"select %s(?)\", binds: [JOBNAME]});
+        describeResult.next();
+        let job = describeResult.getColumnValue(1);
+        let response = {\"JobStatus\": job.TransformJobStatus};
+        if (job.TransformJobStatus === \"Failed\") {
+            response[\"FailureReason\"] = job.FailureReason;
+        }
+        if (job.TransformJobStatus !== \"Completed\") {
+            return response;
+        }
+
+        let accept = (job.TransformOutput.Accept || \"\").split(\";\")[0].trim().toLowerCase();
+        let splitType = job.TransformInput.SplitType;
+        let assembleWith = job.TransformOutput.AssembleWith;
+        let fileFormat;
+        if (accept === \"text/csv\" && splitType === \"Line\" && assembleWith === \"Line\") {
+            fileFormat = \"file_format = (type = csv field_optionally_enclosed_by = '\\\"')\";
+        } else if ((accept === \"application/jsonlines\" || accept === \"application/json\") && assembleWith === \"Line\") {
+            fileFormat = \"file_format = (type = json) match_by_column_name = case_insensitive\";
+        } else {
+            throw new Error(\"Cannot load the output of \" + JOBNAME + \" (Accept \" + job.TransformOutput.Accept +
+                \", SplitType \" + splitType + \", AssembleWith \" + assembleWith + \"), only CSV or JSON lines are supported\");
+        }
+
+        let copyStatement = snowflake.createStatement({sqlText: \"copy into \" + TARGETTABLE + \" from @%s/\" + JOBNAME +
+            \"/output/ \" + fileFormat + \" pattern = '.*[.]out'\"});
+        let copyResult = copyStatement.execute();
+        let rowsLoaded = 0;
+        // With no file left to load, COPY returns a single status column instead of one row per loaded file
+        if (copyStatement.getColumnCount() > 1) {
+            while (copyResult.next()) {
+                rowsLoaded += copyResult.getColumnValue(\"rows_loaded\");
+            }
+        }
+        response[\"RowsLoaded\"] = rowsLoaded;
+        return response;
+        $$;""") % (add_snowflake_resource_suffix("AWS_AUTOPILOT_LOAD_BATCH_PREDICTION"), get_full_resource_name_with_suffix("AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB", database_name, schema_name), get_full_resource_name_with_suffix("AWS_AUTOPILOT_BATCH_TRANSFORM_STAGE", database_name, schema_name))
+
+    add_statement(statement_plan, "AWS_AUTOPILOT_LOAD_BATCH_PREDICTION", load_batch_prediction_str,
+                  depends_on=["AWS_AUTOPILOT_BATCH_TRANSFORM_STAGE", "AWS_AUTOPILOT_DESCRIBE_TRANSFORM_JOB"])
+
+
+def get_storage_integration_info_for_policy(snowflake_connection, storage_integration_name):
     logger.info("Describing Storage Integration")
     storage_user_arn = ''
     storage_external_id = ''
 
-    snowflake_cursor.execute(("describe integration \"%s\"") % (storage_integration_name))
-    rows = snowflake_cursor.fetchall()
+    with snowflake_connection.cursor() as snowflake_cursor:
+        snowflake_cursor.execute(("describe integration \"%s\"") % (storage_integration_name))
+        rows = snowflake_cursor.fetchall()
     for row in rows:
         value = list(row)
         if (value[0] == "STORAGE_AWS_IAM_USER_ARN"):
@@ -752,13 +2098,14 @@ def get_storage_integration_info_for_policy(snowflake_cursor, storage_integratio
         EXTERNAL_ID: storage_external_id
     }
 
-def get_api_integration_info_for_policy(snowflake_cursor, api_integration_name):
+def get_api_integration_info_for_policy(snowflake_connection, api_integration_name):
     logger.info("Describing API Integration")
     storage_user_arn = ''
     storage_external_id = ''
 
-    snowflake_cursor.execute(("describe integration \"%s\"") % (api_integration_name))
-    rows = snowflake_cursor.fetchall()
+    with snowflake_connection.cursor() as snowflake_cursor:
+        snowflake_cursor.execute(("describe integration \"%s\"") % (api_integration_name))
+        rows = snowflake_cursor.fetchall()
     for row in rows:
         value = list(row)
         if (value[0] == "API_AWS_IAM_USER_ARN"):
@@ -799,12 +2146,22 @@ def create_policy_string(integration_info):
 def update_assume_role_policy(policy_str, role_name):
     logger.info('Updating assume role policy for role: ' + role_name)
     logger.info('Policy used: ' + policy_str)
-    iam = boto3.client('iam')
+    iam = get_aws_client('iam')
     iam.update_assume_role_policy(
         PolicyDocument=policy_str,
         RoleName=role_name
     )
 
+def redeploy_api_gateway(api_gateway_id, stage_name):
+    logger.info('Deploying API %s to stage %s', api_gateway_id, stage_name)
+    apigateway = get_aws_client('apigateway')
+    deployment = apigateway.create_deployment(
+        restApiId=api_gateway_id,
+        stageName=stage_name,
+        description='Deployed on stack Update by the SnowflakeResources custom resource'
+    )
+    logger.info('Stage %s now serves deployment %s', stage_name, deployment['id'])
+
 def add_quotes_to_comma_delimited_list_items(comma_delimited_list: str):
     if comma_delimited_list:
         items = comma_delimited_list.replace(" ", "").split(",")
@@ -822,8 +2179,9 @@ def add_snowflake_resource_suffix(resource_name: str):
     return resource_name
 
 
-def get_full_resource_name_with_suffix(resource_name: str):
-    database_name = os.environ['DatabaseName']
-    schema_name = os.environ['SchemaName']
+# Defaults to the database and schema of the stack
+def get_full_resource_name_with_suffix(resource_name: str, database_name=None, schema_name=None):
+    database_name = database_name or os.environ['DatabaseName']
+    schema_name = schema_name or os.environ['SchemaName']
     resource_name_with_suffix = add_snowflake_resource_suffix(resource_name)
     return database_name + "." + schema_name + "." + resource_name_with_suffix
@@ -1,11 +1,116 @@
 #!/bin/sh
 
+# Usage: bash generate-layer.sh [--slim] [--python-version 3.7] [--architecture x86_64|arm64]
+#
+# Without options, installs snowflake-connector-python with a local python3.7 venv.
+# With --slim, the packages are cross-installed for the given Lambda runtime and architecture, tests and C/C++
+# sources are pruned, the sources are precompiled to bytecode and a report of the layer size and of the import time
+# of each top-level module is written to layer/layer-report.txt. The layer is used with the lambdaPythonRuntime,
+# lambdaArchitecture, lambdaLayerS3Bucket and lambdaLayerS3Key parameters of the stack.
+
+SLIM=false
+PYTHON_VERSION=3.7
+ARCHITECTURE=x86_64
+
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --slim) SLIM=true ;;
+        --python-version) PYTHON_VERSION="$2"; shift ;;
+        --architecture) ARCHITECTURE="$2"; shift ;;
+        *) echo "Unknown option: $1"; exit 1 ;;
+    esac
+    shift
+done
+
+case "$ARCHITECTURE" in
+    x86_64) PLATFORM=manylinux2014_x86_64 ;;
+    arm64) PLATFORM=manylinux2014_aarch64 ;;
+    *) echo "Unsupported architecture: $ARCHITECTURE"; exit 1 ;;
+esac
+
 mkdir layer
 
-mkdir -p layer/snowflake-connector-python/python/lib/python3.7/site-packages
-python3.7 -m venv layer/.temp
-source layer/.temp/bin/activate
-pip3 install snowflake-connector-python
-deactivate
-mv layer/.temp/lib/python3.7/site-packages/* layer/snowflake-connector-python/python/lib/python3.7/site-packages
-rm -rf layer/.temp
+SITE_PACKAGES=layer/snowflake-connector-python/python/lib/python$PYTHON_VERSION/site-packages
+mkdir -p $SITE_PACKAGES
+
+if [ "$SLIM" != true ]; then
+    python$PYTHON_VERSION -m venv layer/.temp
+    source layer/.temp/bin/activate
+    pip3 install snowflake-connector-python
+    deactivate
+    mv layer/.temp/lib/python$PYTHON_VERSION/site-packages/* $SITE_PACKAGES
+    rm -rf layer/.temp
+    exit 0
+fi
+
+# Cross-install binary wheels for the target runtime, works from any Linux host
+python3 -m pip install snowflake-connector-python \
+    --target $SITE_PACKAGES \
+    --platform $PLATFORM \
+    --implementation cp \
+    --python-version $PYTHON_VERSION \
+    --only-binary=:all: \
+    --no-compile \
+    || exit 1
+
+# Prune what is never imported on Lambda. boto3 and botocore are kept even though the runtime provides them, the
+# versions of the runtime do not always satisfy the pins of the connector.
+find $SITE_PACKAGES -type d \( -name tests -o -name __pycache__ \) -prune -exec rm -rf {} +
+find $SITE_PACKAGES -type f \( -name "*.c" -o -name "*.cpp" -o -name "*.h" -o -name "*.hpp" -o -name "*.pyx" \
+    -o -name "*.pxd" -o -name "*.pyi" \) -delete
+rm -rf $SITE_PACKAGES/bin
+
+# Bytecode has to be compiled by the interpreter version of the runtime. unchecked-hash pycs are used as they are,
+# without comparing them with the sources on every cold start.
+CAN_RUN_TARGET=false
+if command -v python$PYTHON_VERSION > /dev/null; then
+    HOST_ARCHITECTURE=$(uname -m)
+    if [ "$HOST_ARCHITECTURE" = "$ARCHITECTURE" ] || [ "$HOST_ARCHITECTURE-$ARCHITECTURE" = "aarch64-arm64" ]; then
+        CAN_RUN_TARGET=true
+    fi
+    python$PYTHON_VERSION -m compileall -q -j 0 --invalidation-mode unchecked-hash $SITE_PACKAGES > /dev/null
+else
+    echo "WARNING: python$PYTHON_VERSION not found, the layer is shipped without precompiled bytecode"
+fi
+
+LAYER_ZIP=$(pwd)/layer/snowflake-connector-python-$PYTHON_VERSION-$ARCHITECTURE.zip
+(cd layer/snowflake-connector-python && zip -q -r -9 $LAYER_ZIP .)
+
+REPORT=layer/layer-report.txt
+{
+    echo "Runtime: python$PYTHON_VERSION ($ARCHITECTURE)"
+    echo "Uncompressed size: $(du -sk layer/snowflake-connector-python | cut -f1) KB"
+    echo "Zip size: $(( $(wc -c < $LAYER_ZIP) / 1024 )) KB"
+    echo
+    echo "Largest top-level packages (KB):"
+    du -sk $SITE_PACKAGES/* | sort -rn | head -15 | sed "s|$SITE_PACKAGES/||"
+    echo
+} > $REPORT
+
+if [ "$CAN_RUN_TARGET" = true ]; then
+    # The first import of a cold start, with the bytecode shipped in the layer
+    PYTHONPATH=$SITE_PACKAGES python$PYTHON_VERSION -X importtime -c "import snowflake.connector" 2> layer/importtime.log
+    python3 - layer/importtime.log >> $REPORT << 'EOF'
+import collections
+import sys
+
+# Lines look like "import time: self [us] | cumulative | imported package", nested imports are indented.
+# The self time of every module is attributed to its top-level package.
+self_time_by_package = collections.Counter()
+with open(sys.argv[1]) as importtime_log:
+    for line in importtime_log:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, _, name = line[len("import time:"):].split("|")
+        self_time_by_package[name.strip().split(".")[0]] += int(self_time)
+
+print("Import time of snowflake.connector: %d ms" % (sum(self_time_by_package.values()) / 1000))
+print("Import time per top-level package (ms):")
+for package, self_time in self_time_by_package.most_common(15):
+    print("%8.1f  %s" % (self_time / 1000, package))
+EOF
+else
+    echo "Import time not measured: needs python$PYTHON_VERSION on a $ARCHITECTURE host" >> $REPORT
+fi
+
+cat $REPORT
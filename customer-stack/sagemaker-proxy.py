@@ -0,0 +1,307 @@
+import collections
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import base64
+import boto3
+import os
+import logging
+import threading
+import time
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+DEFAULT_CACHE_TTL_SECONDS = 300
+DEFAULT_CACHE_MAX_ENTRIES = 100000
+DEFAULT_ENDPOINT_CONFIG_CHECK_SECONDS = 60
+DEFAULT_CONCURRENCY = 4
+DEFAULT_SUB_BATCH_ROWS = 25
+DEFAULT_RETRY_AFTER_SECONDS = 1
+# Errors of SageMaker that go away when the call is retried later, they are returned as 429 so that Snowflake backs off
+# and retries the batch instead of failing the query
+THROTTLING_ERROR_CODES = ['ThrottlingException', 'ModelNotReadyException', 'ServiceUnavailable']
+THROTTLING_STATUS_CODES = [429, 503]
+
+# Resource of the describe functions -> (method of the SageMaker client, name of its parameter)
+DESCRIBE_OPERATIONS = {
+    '/sagemaker/describemodel': ('describe_auto_ml_job', 'AutoMLJobName'),
+    '/sagemaker/describeendpoint': ('describe_endpoint', 'EndpointName'),
+    '/sagemaker/describeendpointconfig': ('describe_endpoint_config', 'EndpointConfigName'),
+}
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Kept across warm invocations of the Lambda
+aws_clients = {}
+executors = {}
+# (endpoint name, endpoint config name, hash of the CSV row) -> (expiry time, prediction), least recently used first
+prediction_cache = collections.OrderedDict()
+# endpoint name -> (time of the last check, endpoint config name)
+endpoint_versions = {}
+cache_statistics = collections.Counter()
+cache_lock = threading.Lock()
+
+def lambda_handler(event, context):
+    cache_ttl_seconds = int(os.environ.get('PredictCacheTtlSeconds', DEFAULT_CACHE_TTL_SECONDS))
+    cache_max_entries = int(os.environ.get('PredictCacheMaxEntries', DEFAULT_CACHE_MAX_ENTRIES))
+
+    if event.get('resource') in DESCRIBE_OPERATIONS:
+        return describe_batch(event)
+
+    # The request translator sends one CSV row per line. In an envelope, the rows are the distinct rows of the batch
+    # and rowIndex gives the distinct row of every row of the batch, it is returned with the predictions. rowEndpoint
+    # gives the index in endpoints of the endpoint of every distinct row
+    try:
+        endpoint_name = event['pathParameters']['endpointName']
+        body = get_body(event)
+        query_string_parameters = event.get('queryStringParameters') or {}
+        row_index = None
+        endpoint_names = [endpoint_name]
+        row_endpoint = None
+        if query_string_parameters.get('format') == 'envelope':
+            envelope = json.loads(body)
+            body = envelope['rows']
+            row_index = envelope['rowIndex']
+            if 'endpoints' in envelope:
+                endpoint_names = envelope['endpoints']
+                row_endpoint = envelope['rowEndpoint']
+        rows = body.split('\n')
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.exception("Malformed predict request")
+        return create_response(400, {'message': 'Malformed predict request: ' + repr(e)})
+
+    with cache_lock:
+        cache_statistics['batch_rows'] += len(row_index) if row_index is not None else len(rows)
+        cache_statistics['distinct_rows'] += len(rows)
+
+    try:
+        if row_endpoint is None or len(endpoint_names) == 1:
+            predictions = get_predictions(endpoint_names[0], rows, cache_ttl_seconds, cache_max_entries)
+        else:
+            predictions = get_predictions_by_endpoint(endpoint_names, rows, row_endpoint, cache_ttl_seconds,
+                                                      cache_max_entries)
+    except ClientError as e:
+        logger.exception("Problem invoking endpoints " + ", ".join(endpoint_names))
+        return create_error_response(e)
+    # The endpoint returned a body that is not JSON, has no predictions, or not one prediction per row
+    except (ValueError, KeyError, TypeError) as e:
+        logger.exception("Unexpected response from endpoints " + ", ".join(endpoint_names))
+        return create_response(500, {'message': 'Unexpected response from the endpoint: ' + str(e)})
+    finally:
+        with cache_lock:
+            statistics = collections.Counter(cache_statistics)
+        logger.info("Cache statistics: %s, dedup ratio: %.3f", dict(statistics), get_dedup_ratio(statistics))
+
+    if row_index is not None:
+        return create_response(200, {'predictions': predictions, 'rowIndex': row_index})
+    return create_response(200, {'predictions': predictions})
+
+# Rows of the batches per row sent for prediction, 1 when no row was deduplicated
+def get_dedup_ratio(statistics):
+    if not statistics['distinct_rows']:
+        return 1.0
+    return statistics['batch_rows'] / float(statistics['distinct_rows'])
+
+def get_body(event):
+    body = event['body']
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    return body
+
+def create_response(status_code, response_body, headers=None):
+    return {
+        'statusCode': status_code,
+        'headers': dict({'Content-Type': 'application/json'}, **(headers or {})),
+        'body': json.dumps(response_body, default=to_epoch_seconds)
+    }
+
+# Throttling is returned by SageMaker as a 400 with the ThrottlingException code, it is recognised by its code
+def create_error_response(e):
+    status_code = e.response['ResponseMetadata']['HTTPStatusCode']
+    if e.response['Error']['Code'] in THROTTLING_ERROR_CODES or status_code in THROTTLING_STATUS_CODES:
+        retry_after_seconds = os.environ.get('PredictRetryAfterSeconds', str(DEFAULT_RETRY_AFTER_SECONDS))
+        return create_response(429, {'message': str(e)}, {'Retry-After': retry_after_seconds})
+    return create_response(status_code, {'message': str(e)})
+
+# Timestamps are returned as seconds since the epoch, as by the API Gateway integrations of the ENDPOINT backend
+def to_epoch_seconds(value):
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    raise TypeError("Object of type %s is not JSON serializable" % type(value).__name__)
+
+# The body lists the distinct names of the batch, they are described concurrently. rowIndex is returned with the
+# results, in the order of the names
+def describe_batch(event):
+    method_name, parameter_name = DESCRIBE_OPERATIONS[event['resource']]
+    concurrency = int(os.environ.get('PredictConcurrency', DEFAULT_CONCURRENCY))
+
+    try:
+        envelope = json.loads(get_body(event))
+        names = envelope['names']
+        row_index = envelope['rowIndex']
+    except (ValueError, KeyError, TypeError) as e:
+        logger.exception("Malformed describe request")
+        return create_response(400, {'message': 'Malformed describe request: ' + repr(e)})
+
+    executor = get_executor('describe', concurrency)
+    futures = [executor.submit(describe, method_name, parameter_name, name, concurrency) for name in names]
+    try:
+        results = [future.result() for future in futures]
+    except ClientError as e:
+        logger.exception("Problem calling " + method_name)
+        return create_error_response(e)
+
+    return create_response(200, {'results': results, 'rowIndex': row_index})
+
+# A name that cannot be described gets the error as its result, so that the other rows of the batch are still returned
+def describe(method_name, parameter_name, name, concurrency=1):
+    if name is None:
+        return {'Error': {'Code': 'ValidationException', 'Message': parameter_name + ' is NULL'}}
+
+    try:
+        response = getattr(get_aws_client('sagemaker', max(10, concurrency)), method_name)(**{parameter_name: name})
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ValidationException':
+            raise
+        return {'Error': e.response['Error']}
+
+    response.pop('ResponseMetadata', None)
+    return response
+
+# The connections of the client are kept alive and reused by the concurrent calls, up to max_pool_connections
+def get_aws_client(service_name, max_pool_connections=10):
+    with cache_lock:
+        if service_name not in aws_clients:
+            aws_clients[service_name] = boto3.client(service_name,
+                                                     config=Config(max_pool_connections=max_pool_connections))
+        return aws_clients[service_name]
+
+# Separate pools for the endpoints and for the sub-batches, the tasks of the first wait for the tasks of the second
+def get_executor(pool_name, max_workers):
+    with cache_lock:
+        if (pool_name, max_workers) not in executors:
+            executors[(pool_name, max_workers)] = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        return executors[(pool_name, max_workers)]
+
+# The rows of each endpoint are predicted in parallel, the predictions are returned in the order of the rows
+def get_predictions_by_endpoint(endpoint_names, rows, row_endpoint, cache_ttl_seconds, cache_max_entries):
+    concurrency = int(os.environ.get('PredictConcurrency', DEFAULT_CONCURRENCY))
+
+    indexes_by_endpoint = collections.defaultdict(list)
+    for index, endpoint_index in enumerate(row_endpoint):
+        indexes_by_endpoint[endpoint_index].append(index)
+    with cache_lock:
+        cache_statistics['endpoint_groups'] += len(indexes_by_endpoint)
+
+    executor = get_executor('endpoints', concurrency)
+    futures = {}
+    for endpoint_index, indexes in indexes_by_endpoint.items():
+        futures[endpoint_index] = executor.submit(get_predictions, endpoint_names[endpoint_index],
+                                                  [rows[index] for index in indexes], cache_ttl_seconds,
+                                                  cache_max_entries)
+
+    predictions = [None] * len(rows)
+    for endpoint_index, indexes in indexes_by_endpoint.items():
+        for index, prediction in zip(indexes, futures[endpoint_index].result()):
+            predictions[index] = prediction
+    return predictions
+
+# Only the rows that are not cached are sent to the endpoint, the predictions are returned in the order of the rows
+def get_predictions(endpoint_name, rows, cache_ttl_seconds, cache_max_entries):
+    if cache_ttl_seconds <= 0:
+        return invoke_endpoint_in_sub_batches(endpoint_name, rows)
+
+    endpoint_version = get_endpoint_version(endpoint_name)
+    cache_keys = [(endpoint_name, endpoint_version, hashlib.sha256(row.encode('utf-8')).hexdigest()) for row in rows]
+    predictions = [None] * len(rows)
+    missing_indexes = []
+
+    now = time.time()
+    with cache_lock:
+        for index, cache_key in enumerate(cache_keys):
+            cached_prediction = prediction_cache.get(cache_key)
+            if cached_prediction and cached_prediction[0] > now:
+                prediction_cache.move_to_end(cache_key)
+                predictions[index] = cached_prediction[1]
+            else:
+                missing_indexes.append(index)
+        cache_statistics['prediction_hits'] += len(rows) - len(missing_indexes)
+        cache_statistics['prediction_misses'] += len(missing_indexes)
+
+    if not missing_indexes:
+        return predictions
+
+    missing_predictions = invoke_endpoint_in_sub_batches(endpoint_name, [rows[index] for index in missing_indexes])
+
+    expires_at = time.time() + cache_ttl_seconds
+    with cache_lock:
+        for index, prediction in zip(missing_indexes, missing_predictions):
+            predictions[index] = prediction
+            prediction_cache[cache_keys[index]] = (expires_at, prediction)
+            prediction_cache.move_to_end(cache_keys[index])
+        while len(prediction_cache) > cache_max_entries:
+            prediction_cache.popitem(last=False)
+            cache_statistics['prediction_evictions'] += 1
+
+    return predictions
+
+# The endpoint config name changes whenever the endpoint is updated with another model or variant
+def get_endpoint_version(endpoint_name):
+    endpoint_config_check_seconds = int(os.environ.get('EndpointConfigCheckSeconds',
+                                                       DEFAULT_ENDPOINT_CONFIG_CHECK_SECONDS))
+
+    with cache_lock:
+        endpoint_version = endpoint_versions.get(endpoint_name)
+    if endpoint_version and endpoint_version[0] + endpoint_config_check_seconds > time.time():
+        return endpoint_version[1]
+
+    describe_endpoint_response = get_aws_client('sagemaker').describe_endpoint(EndpointName=endpoint_name)
+    endpoint_config_name = describe_endpoint_response['EndpointConfigName']
+
+    with cache_lock:
+        endpoint_versions[endpoint_name] = (time.time(), endpoint_config_name)
+        if endpoint_version and endpoint_version[1] != endpoint_config_name:
+            invalidate_endpoint(endpoint_name)
+    return endpoint_config_name
+
+# Called with cache_lock held
+def invalidate_endpoint(endpoint_name):
+    logger.info("Endpoint config of " + endpoint_name + " changed, dropping its cached predictions")
+    for cache_key in [cache_key for cache_key in prediction_cache if cache_key[0] == endpoint_name]:
+        del prediction_cache[cache_key]
+        cache_statistics['prediction_invalidations'] += 1
+
+# Splits the rows in sub-batches sent concurrently, so that the instances of the endpoint share the batch
+def invoke_endpoint_in_sub_batches(endpoint_name, rows):
+    concurrency = int(os.environ.get('PredictConcurrency', DEFAULT_CONCURRENCY))
+    sub_batch_rows = int(os.environ.get('PredictSubBatchRows', DEFAULT_SUB_BATCH_ROWS))
+
+    sub_batches = [rows[start:start + sub_batch_rows] for start in range(0, len(rows), sub_batch_rows)]
+    if concurrency <= 1 or len(sub_batches) <= 1:
+        return invoke_endpoint(endpoint_name, rows, concurrency)
+
+    executor = get_executor('sub_batches', concurrency)
+    futures = [executor.submit(invoke_endpoint, endpoint_name, sub_batch, concurrency) for sub_batch in sub_batches]
+    with cache_lock:
+        cache_statistics['sub_batches'] += len(sub_batches)
+
+    # Results are reassembled in the order of the sub-batches, the first failure fails the whole batch
+    predictions = []
+    for future in futures:
+        predictions.extend(future.result())
+    return predictions
+
+def invoke_endpoint(endpoint_name, rows, concurrency=1):
+    response = get_aws_client('sagemaker-runtime', max(10, concurrency)).invoke_endpoint(
+        EndpointName=endpoint_name,
+        ContentType='text/csv',
+        Accept='application/json',
+        Body='\n'.join(rows)
+    )
+    predictions = json.loads(response['Body'].read())['predictions']
+
+    if len(predictions) != len(rows):
+        raise ValueError("Endpoint %s returned %d predictions for %d rows" % (endpoint_name, len(predictions), len(rows)))
+    return predictions
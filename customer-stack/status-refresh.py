@@ -0,0 +1,236 @@
+import concurrent.futures
+import hashlib
+import importlib
+import json
+import logging
+import os
+from botocore.exceptions import ClientError
+
+# Shipped in the same package as create-resources.py, whose secret cache and Snowflake sessions are reused
+create_resources = importlib.import_module('create-resources')
+
+STATUS_TABLE_NAME = "AWS_AUTOPILOT_STATUS"
+MODEL_RESOURCE_TYPE = "MODEL"
+ENDPOINT_RESOURCE_TYPE = "ENDPOINT"
+DELETED_STATUS = "Deleted"
+DELETED_STATE_HASH = "deleted"
+# Suffix of the AutoML jobs started by AWS_AUTOPILOT_CREATE_MODEL, the model name is the job name without it
+AUTO_ML_JOB_NAME_SUFFIX = "-job"
+# Columns of the status table, in the order of the values of a row
+STATUS_COLUMNS = ["RESOURCE_TYPE", "NAME", "STATUS", "STATUS_DETAILS", "FAILURE_REASON", "LAST_MODIFIED_TIME",
+                  "STATE", "STATE_HASH"]
+DEFAULT_STATUS_MERGE_BATCH_ROWS = 500
+DEFAULT_STATUS_DESCRIBE_CONCURRENCY = 4
+
+# Whether a resource carries the tag of the stack, by ARN and creation time as the names of the endpoints can be reused.
+# Kept across warm invocations so that the tags of a resource are only listed once
+stack_tagged_resources = {}
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+def lambda_handler(event, context):
+    region_name = os.environ['Region']
+    secret_name = os.environ['SecretArn']
+    snowflake_role_name = os.environ['SnowflakeRole']
+    database_name = os.environ['DatabaseName']
+    schema_name = os.environ['SchemaName']
+    stack_name = os.environ['StackName']
+    status_table_name = create_resources.get_full_resource_name_with_suffix(STATUS_TABLE_NAME)
+
+    get_secret_value_response = create_resources.get_secret_string(region_name, secret_name)
+    try:
+        snowflake_connection = create_resources.open_snowflake_session(get_secret_value_response,
+                                                                       snowflake_role_name, database_name, schema_name)
+    except Exception as e:
+        # The secret may have been rotated since it was cached, the next invocation fetches it again
+        if create_resources.is_snowflake_authentication_error(e):
+            create_resources.evict_secret(secret_name)
+        raise
+    try:
+        refresh_statistics = refresh_status_table(snowflake_connection, create_resources.get_aws_client('sagemaker'),
+                                                  status_table_name, stack_name)
+    except Exception:
+        # The session may be what failed, it is not reused by the next invocations
+        create_resources.evict_snowflake_connection(snowflake_connection)
+        raise
+
+    logger.info("Status table %s refreshed: %s", status_table_name, refresh_statistics)
+    return refresh_statistics
+
+# Lists the AutoML jobs and endpoints of the stack and only describes and writes the ones whose summary changed since
+# the last refresh. The ones that are no longer listed are marked as deleted
+def refresh_status_table(snowflake_connection, sagemaker, status_table_name, stack_name):
+    merge_batch_rows = int(os.environ.get('StatusMergeBatchRows', DEFAULT_STATUS_MERGE_BATCH_ROWS))
+    describe_concurrency = int(os.environ.get('StatusDescribeConcurrency', DEFAULT_STATUS_DESCRIBE_CONCURRENCY))
+
+    with snowflake_connection.cursor() as snowflake_cursor:
+        snowflake_cursor.execute(get_create_status_table_str(status_table_name))
+        snowflake_cursor.execute("select RESOURCE_TYPE, NAME, STATE_HASH from %s" % status_table_name)
+        stored_state_hashes = {(row[0], row[1]): row[2] for row in snowflake_cursor.fetchall()}
+
+    listed_summaries = list_models(sagemaker) + list_endpoints(sagemaker)
+    summaries = get_stack_summaries(sagemaker, listed_summaries, stored_state_hashes, stack_name, describe_concurrency)
+    changed_summaries = [(resource_type, name, summary) for resource_type, name, summary in summaries
+                         if stored_state_hashes.get((resource_type, name)) != get_state_hash(summary)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=describe_concurrency) as executor:
+        status_rows = [status_row for status_row in executor.map(lambda changed: get_status_row(sagemaker, *changed),
+                                                                 changed_summaries)
+                       if status_row is not None]
+
+    listed_resources = set((resource_type, name) for resource_type, name, _ in summaries)
+    deleted_rows = [[resource_type, name, DELETED_STATUS, None, None, None, None, DELETED_STATE_HASH]
+                    for (resource_type, name), state_hash in stored_state_hashes.items()
+                    if (resource_type, name) not in listed_resources and state_hash != DELETED_STATE_HASH]
+
+    changed_rows = status_rows + deleted_rows
+    with snowflake_connection.cursor() as snowflake_cursor:
+        for start in range(0, len(changed_rows), merge_batch_rows):
+            merge_status_rows(snowflake_cursor, status_table_name, changed_rows[start:start + merge_batch_rows])
+
+    return {
+        'listed': len(summaries),
+        'other_stacks': len(listed_summaries) - len(summaries),
+        'changed': len(status_rows),
+        'deleted': len(deleted_rows),
+        'unchanged': len(summaries) - len(changed_summaries)
+    }
+
+def get_create_status_table_str(status_table_name):
+    return ("""create table if not exists %s (
+        RESOURCE_TYPE varchar not null,
+        NAME varchar not null,
+        STATUS varchar,
+        STATUS_DETAILS varchar,
+        FAILURE_REASON varchar,
+        LAST_MODIFIED_TIME timestamp_ltz,
+        STATE variant,
+        STATE_HASH varchar,
+        REFRESHED_AT timestamp_ltz,
+        primary key (RESOURCE_TYPE, NAME)
+    ) comment = 'State of the AutoML jobs and endpoints, refreshed by the status refresh Lambda function';""") % (status_table_name)
+
+def merge_status_rows(snowflake_cursor, status_table_name, status_rows):
+    values_str = ", ".join(["(" + ", ".join(["%s"] * len(STATUS_COLUMNS)) + ")"] * len(status_rows))
+    merge_str = ("""merge into %s as target using (
+        select column1 as RESOURCE_TYPE, column2 as NAME, column3 as STATUS, column4 as STATUS_DETAILS,
+            column5 as FAILURE_REASON, to_timestamp_ltz(column6) as LAST_MODIFIED_TIME, parse_json(column7) as STATE,
+            column8 as STATE_HASH
+        from values %s) as source
+    on target.RESOURCE_TYPE = source.RESOURCE_TYPE and target.NAME = source.NAME
+    when matched then update set STATUS = source.STATUS, STATUS_DETAILS = source.STATUS_DETAILS,
+        FAILURE_REASON = source.FAILURE_REASON, LAST_MODIFIED_TIME = source.LAST_MODIFIED_TIME, STATE = source.STATE,
+        STATE_HASH = source.STATE_HASH, REFRESHED_AT = current_timestamp()
+    when not matched then insert (RESOURCE_TYPE, NAME, STATUS, STATUS_DETAILS, FAILURE_REASON, LAST_MODIFIED_TIME,
+        STATE, STATE_HASH, REFRESHED_AT)
+    values (source.RESOURCE_TYPE, source.NAME, source.STATUS, source.STATUS_DETAILS, source.FAILURE_REASON,
+        source.LAST_MODIFIED_TIME, source.STATE, source.STATE_HASH, current_timestamp());""") % (status_table_name, values_str)
+
+    snowflake_cursor.execute(merge_str, [value for status_row in status_rows for value in status_row])
+
+def list_models(sagemaker):
+    summaries = []
+    for summary in list_all(sagemaker.list_auto_ml_jobs, 'AutoMLJobSummaries'):
+        if summary['AutoMLJobName'].endswith(AUTO_ML_JOB_NAME_SUFFIX):
+            model_name = summary['AutoMLJobName'][:-len(AUTO_ML_JOB_NAME_SUFFIX)]
+            summaries.append((MODEL_RESOURCE_TYPE, model_name, summary))
+    return summaries
+
+def list_endpoints(sagemaker):
+    return [(ENDPOINT_RESOURCE_TYPE, summary['EndpointName'], summary)
+            for summary in list_all(sagemaker.list_endpoints, 'Endpoints')]
+
+# The jobs and endpoints of the other stacks and tools of the account are left out. A resource is of the stack when it
+# is in the status table, when it carries the stack tag set by AWS_AUTOPILOT_CREATE_MODEL and
+# AWS_AUTOPILOT_CREATE_ENDPOINT, or for an endpoint, when it is named after a model of the stack as the endpoints
+# deployed by AWS_AUTOPILOT_CREATE_MODEL. The tags are only listed for the resources not seen before
+def get_stack_summaries(sagemaker, summaries, stored_state_hashes, stack_name, describe_concurrency):
+    stored_resources = set(resource for resource, state_hash in stored_state_hashes.items()
+                           if state_hash != DELETED_STATE_HASH)
+    unknown_summaries = [summary for resource_type, name, summary in summaries
+                         if (resource_type, name) not in stored_resources
+                         and get_tag_cache_key(summary) not in stack_tagged_resources]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=describe_concurrency) as executor:
+        tagged_list = list(executor.map(lambda summary: has_stack_tag(sagemaker, summary, stack_name),
+                                        unknown_summaries))
+    for summary, tagged in zip(unknown_summaries, tagged_list):
+        # None when the resource was deleted since it was listed, it is neither written nor cached
+        if tagged is not None:
+            stack_tagged_resources[get_tag_cache_key(summary)] = tagged
+
+    def is_stack_resource(resource_type, name, summary):
+        return ((resource_type, name) in stored_resources
+                or stack_tagged_resources.get(get_tag_cache_key(summary), False))
+
+    stack_model_names = set(name for resource_type, name, summary in summaries
+                            if resource_type == MODEL_RESOURCE_TYPE and is_stack_resource(resource_type, name, summary))
+    return [(resource_type, name, summary) for resource_type, name, summary in summaries
+            if is_stack_resource(resource_type, name, summary)
+            or (resource_type == ENDPOINT_RESOURCE_TYPE and name in stack_model_names)]
+
+def get_resource_arn(summary):
+    return summary['AutoMLJobArn'] if 'AutoMLJobArn' in summary else summary['EndpointArn']
+
+def get_tag_cache_key(summary):
+    return (get_resource_arn(summary), str(summary['CreationTime']))
+
+def has_stack_tag(sagemaker, summary, stack_name):
+    resource_arn = get_resource_arn(summary)
+    try:
+        tags = list_all(lambda **parameters: sagemaker.list_tags(ResourceArn=resource_arn, **parameters), 'Tags')
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ValidationException':
+            raise
+        return None
+    return any(tag['Key'] == create_resources.STACK_TAG_KEY and tag['Value'] == stack_name for tag in tags)
+
+def list_all(list_function, summaries_key):
+    summaries = []
+    parameters = {'MaxResults': 100}
+    while True:
+        response = list_function(**parameters)
+        summaries.extend(response[summaries_key])
+        if not response.get('NextToken'):
+            return summaries
+        parameters['NextToken'] = response['NextToken']
+
+# The summaries hold the status and last modified time, a resource is described again only when its summary changes
+def get_state_hash(summary):
+    return hashlib.sha256(json.dumps(summary, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+# STATE holds what the matching describe function returns. None when the resource was deleted since it was listed
+def get_status_row(sagemaker, resource_type, name, summary):
+    try:
+        if resource_type == MODEL_RESOURCE_TYPE:
+            state = get_model_state(sagemaker, summary)
+            status, status_details = summary['AutoMLJobStatus'], summary.get('AutoMLJobSecondaryStatus')
+        else:
+            state = sagemaker.describe_endpoint(EndpointName=name)
+            state.pop('ResponseMetadata', None)
+            status, status_details = summary['EndpointStatus'], None
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ValidationException':
+            raise
+        logger.info("%s %s was deleted while refreshing: %s", resource_type, name, str(e))
+        return None
+
+    return [resource_type, name, status, status_details, state.get('FailureReason'),
+            summary['LastModifiedTime'].isoformat(), json.dumps(state, default=str), get_state_hash(summary)]
+
+# Same fields as AWS_AUTOPILOT_DESCRIBE_MODEL, the job is only described for the objective metric of its best candidate
+def get_model_state(sagemaker, summary):
+    state = {
+        'JobStatus': summary['AutoMLJobStatus'],
+        'JobStatusDetails': summary.get('AutoMLJobSecondaryStatus'),
+        'PartialFailureReasons': summary.get('PartialFailureReasons')
+    }
+    if summary['AutoMLJobStatus'] == 'Completed':
+        best_candidate = sagemaker.describe_auto_ml_job(AutoMLJobName=summary['AutoMLJobName']).get('BestCandidate')
+        if best_candidate:
+            state['ObjectiveMetric'] = best_candidate['FinalAutoMLJobObjectiveMetric']['MetricName']
+            state['BestObjectiveMetric'] = best_candidate['FinalAutoMLJobObjectiveMetric']['Value']
+    elif summary['AutoMLJobStatus'] == 'Failed':
+        state['FailureReason'] = summary.get('FailureReason')
+    return state
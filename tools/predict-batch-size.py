@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# Recommends the max_batch_rows of AWS_AUTOPILOT_PREDICT_OUTCOME for a training table: samples the table, measures
+# the width of its rows in the JSON request sent by Snowflake to API Gateway and in the body sent on by the request
+# translator (comma separated values, one row per line, wrapped in the JSON envelope of the proxy with the PROXY
+# backend), and returns the largest batch for which both stay under their payload limits.
+#
+# The recommendation can be applied to the stack with --update-stack, or to a predict function dedicated to one model
+# with --create-function, which creates AWS_AUTOPILOT_PREDICT_OUTCOME_<MODEL> with its own max_batch_rows.
+#
+# Usage: python3 tools/predict-batch-size.py --secret-arn ARN --database DB --schema SCHEMA --table TABLE
+#            --target-column COLUMN [--backend ENDPOINT|PROXY] [--stack-name STACK] [--update-stack]
+#            [--create-function MODEL]
+import argparse
+import importlib.util
+import json
+import os
+import re
+
+import boto3
+
+CREATE_RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "customer-stack",
+                                     "create-resources.py")
+
+# Invocation payload limit of SageMaker real-time endpoints, and of the Lambda function of the PROXY backend
+DEFAULT_PAYLOAD_LIMIT_BYTES = 6 * 1024 * 1024
+# Payload limit of API Gateway, for the request sent by Snowflake
+DEFAULT_API_GATEWAY_PAYLOAD_LIMIT_BYTES = 10 * 1024 * 1024
+# Longest SageMaker endpoint name, sent with every row of the request
+DEFAULT_ENDPOINT_NAME_LENGTH = 63
+# Leaves room for rows wider than the widest sampled one
+DEFAULT_HEADROOM = 0.8
+DEFAULT_SAMPLE_ROWS = 10000
+
+
+def load_create_resources(database_name, schema_name, resource_suffix):
+    os.environ["DatabaseName"] = database_name
+    os.environ["SchemaName"] = schema_name
+    os.environ["SnowflakeResourceSuffix"] = resource_suffix
+
+    spec = importlib.util.spec_from_file_location("create_resources", CREATE_RESOURCES_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_feature_columns(snowflake_connection, table_name, target_column):
+    with snowflake_connection.cursor() as snowflake_cursor:
+        snowflake_cursor.execute("describe table %s" % table_name)
+        rows = snowflake_cursor.fetchall()
+    columns = [row[0] for row in rows if row[0].upper() != target_column.upper()]
+    if len(columns) == len(rows):
+        raise ValueError("Column %s not found in table %s" % (target_column, table_name))
+    return columns
+
+
+# Widths of the columns of a row, in bytes:
+# - json: the array of values in the request of Snowflake, {"data": [[index, endpoint, [values]], ...]}
+# - csv: the row as joined by the request translator, values joined by commas
+# - envelope: the csv row as a JSON string in the envelope of the PROXY backend, with its escapes
+def get_row_widths(snowflake_connection, table_name, columns, sample_rows):
+    quoted_columns = ", ".join(["\"%s\"" % column for column in columns])
+    csv_str = " || ',' || ".join(["coalesce(to_varchar(\"%s\"), '')" % column for column in columns])
+
+    with snowflake_connection.cursor() as snowflake_cursor:
+        snowflake_cursor.execute(("select max(json_width), avg(json_width), max(csv_width), avg(csv_width), "
+                                  "max(envelope_width), avg(envelope_width), count(*) from "
+                                  "(select length(to_json(array_construct(%s))) as json_width, length(csv) as csv_width,"
+                                  " length(to_json(to_variant(csv))) - 2 as envelope_width from "
+                                  "(select %s as csv, %s from %s sample (%d rows)))")
+                                 % (quoted_columns, csv_str, quoted_columns, table_name, sample_rows))
+        row = snowflake_cursor.fetchone()
+
+    if not row[-1]:
+        raise ValueError("Table %s is empty" % table_name)
+    return {
+        "json": (int(row[0]), float(row[1])),
+        "csv": (int(row[2]), float(row[3])),
+        "envelope": (int(row[4]), float(row[5])),
+    }, row[-1]
+
+
+def get_request_bytes(batch_rows, row_widths, endpoint_name_length):
+    # [index,"endpoint",[values]] and the comma between rows
+    row_bytes = row_widths["json"][0] + len(str(batch_rows - 1)) + endpoint_name_length + 7
+    return len(json.dumps({"data": []})) + batch_rows * row_bytes
+
+
+def get_endpoint_body_bytes(batch_rows, row_widths):
+    # Rows joined by new lines
+    return batch_rows * (row_widths["csv"][0] + 1)
+
+
+def get_envelope_bytes(batch_rows, row_widths, endpoint_name_length):
+    # Every row distinct: the rows string with its escaped new lines, and the rowEndpoint and rowIndex entries
+    envelope = {"endpoints": ["x" * endpoint_name_length], "rows": "", "rowEndpoint": [], "rowIndex": []}
+    row_bytes = row_widths["envelope"][0] + 2 + len("0,") + len(str(batch_rows - 1)) + 1
+    return len(json.dumps(envelope)) + batch_rows * row_bytes
+
+
+# Largest batch whose payload, growing with its rows, stays under the limit
+def get_max_batch_rows(payload_bytes, limit_bytes):
+    low, high = 1, 1
+    while payload_bytes(high) <= limit_bytes:
+        low, high = high, high * 2
+    while high - low > 1:
+        middle = (low + high) // 2
+        if payload_bytes(middle) <= limit_bytes:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+# Batch size allowed by each payload of the backend, the recommendation is the smallest
+def recommend_max_batch_rows(row_widths, backend, endpoint_name_length, payload_limit_bytes,
+                             api_gateway_payload_limit_bytes, headroom):
+    payloads = [("Snowflake request to API Gateway", api_gateway_payload_limit_bytes,
+                 lambda batch_rows: get_request_bytes(batch_rows, row_widths, endpoint_name_length))]
+    if backend == "PROXY":
+        payloads.append(("proxy envelope to Lambda", payload_limit_bytes,
+                         lambda batch_rows: get_envelope_bytes(batch_rows, row_widths, endpoint_name_length)))
+    else:
+        payloads.append(("translator body to SageMaker", payload_limit_bytes,
+                         lambda batch_rows: get_endpoint_body_bytes(batch_rows, row_widths)))
+
+    return [(name, limit_bytes, get_max_batch_rows(payload_bytes, int(limit_bytes * headroom)), payload_bytes)
+            for name, limit_bytes, payload_bytes in payloads]
+
+
+def get_api_gateway_url(snowflake_connection, api_integration_name):
+    with snowflake_connection.cursor() as snowflake_cursor:
+        snowflake_cursor.execute(("describe integration \"%s\"") % (api_integration_name))
+        rows = snowflake_cursor.fetchall()
+    for row in rows:
+        value = list(row)
+        if value[0] == "API_ALLOWED_PREFIXES":
+            return value[2].split(",")[0].strip()
+    raise ValueError("No allowed prefix found on integration " + api_integration_name)
+
+
+def create_model_predict_function(create_resources, snowflake_connection, stack_name, model_name, max_batch_rows):
+    api_integration_name = "AWS_AUTOPILOT_API_INTEGRATION" + "_" + stack_name
+    api_gateway_url = get_api_gateway_url(snowflake_connection, api_integration_name)
+    function_name = create_resources.add_snowflake_resource_suffix(
+        "AWS_AUTOPILOT_PREDICT_OUTCOME_" + re.sub("[^A-Z0-9_]", "_", model_name.upper()))
+
+    with snowflake_connection.cursor() as snowflake_cursor:
+        snowflake_cursor.execute(create_resources.get_predictoutcome_ef_str(function_name, api_integration_name,
+                                                                            api_gateway_url, max_batch_rows))
+    return function_name
+
+
+def update_stack_max_batch_rows(stack_name, max_batch_rows):
+    cloudformation = boto3.client("cloudformation")
+    stack = cloudformation.describe_stacks(StackName=stack_name)["Stacks"][0]
+    parameters = []
+    for parameter in stack["Parameters"]:
+        if parameter["ParameterKey"] == "predictOutcomeMaxBatchRows":
+            continue
+        parameters.append({"ParameterKey": parameter["ParameterKey"], "UsePreviousValue": True})
+    parameters.append({"ParameterKey": "predictOutcomeMaxBatchRows", "ParameterValue": str(max_batch_rows)})
+
+    cloudformation.update_stack(StackName=stack_name, UsePreviousTemplate=True, Parameters=parameters,
+                                Capabilities=["CAPABILITY_NAMED_IAM"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend the predict batch size of a training table")
+    parser.add_argument("--secret-arn", required=True, help="ARN of the secret with the Snowflake login information")
+    parser.add_argument("--role", default="ACCOUNTADMIN", help="Snowflake role")
+    parser.add_argument("--database", required=True, help="Snowflake database of the stack")
+    parser.add_argument("--schema", required=True, help="Snowflake schema of the stack")
+    parser.add_argument("--suffix", default="", help="Snowflake resource suffix of the stack")
+    parser.add_argument("--table", required=True, help="Training table, the predictions are made on the same columns")
+    parser.add_argument("--target-column", required=True, help="Column predicted by the model, not sent for predictions")
+    parser.add_argument("--sample-rows", type=int, default=DEFAULT_SAMPLE_ROWS, help="Number of rows sampled")
+    parser.add_argument("--backend", choices=["ENDPOINT", "PROXY"], default="ENDPOINT",
+                        help="predictOutcomeBackend of the stack")
+    parser.add_argument("--payload-limit", type=int, default=DEFAULT_PAYLOAD_LIMIT_BYTES,
+                        help="Invocation payload limit of the endpoint, or of the proxy with PROXY, in bytes")
+    parser.add_argument("--api-gateway-payload-limit", type=int, default=DEFAULT_API_GATEWAY_PAYLOAD_LIMIT_BYTES,
+                        help="Payload limit of API Gateway, in bytes")
+    parser.add_argument("--endpoint-name-length", type=int, default=DEFAULT_ENDPOINT_NAME_LENGTH,
+                        help="Length of the endpoint names passed to the predict function")
+    parser.add_argument("--headroom", type=float, default=DEFAULT_HEADROOM,
+                        help="Fraction of the payload limits used by the widest sampled rows")
+    parser.add_argument("--stack-name", help="Name of the CloudFormation stack")
+    parser.add_argument("--update-stack", action="store_true",
+                        help="Set the predictOutcomeMaxBatchRows parameter of the stack to the recommendation")
+    parser.add_argument("--create-function", metavar="MODEL",
+                        help="Create AWS_AUTOPILOT_PREDICT_OUTCOME_<MODEL> with the recommended batch size")
+    parser.add_argument("--max-batch-rows", type=int, help="Batch size to apply instead of the recommendation")
+    args = parser.parse_args()
+
+    if (args.update_stack or args.create_function) and not args.stack_name:
+        parser.error("--stack-name is required with --update-stack and --create-function")
+
+    create_resources = load_create_resources(args.database, args.schema, args.suffix)
+    get_secret_value_response = create_resources.get_secret_string(None, args.secret_arn)
+    snowflake_connection = create_resources.open_snowflake_session(get_secret_value_response, args.role,
+                                                                   args.database, args.schema)
+
+    try:
+        columns = get_feature_columns(snowflake_connection, args.table, args.target_column)
+        row_widths, sampled_rows = get_row_widths(snowflake_connection, args.table, columns, args.sample_rows)
+        payload_batch_rows = recommend_max_batch_rows(row_widths, args.backend, args.endpoint_name_length,
+                                                      args.payload_limit, args.api_gateway_payload_limit,
+                                                      args.headroom)
+        recommended_max_batch_rows = min(batch_rows for _, _, batch_rows, _ in payload_batch_rows)
+        max_batch_rows = args.max_batch_rows or recommended_max_batch_rows
+
+        print("feature columns:          %d" % len(columns))
+        print("sampled rows:             %d" % sampled_rows)
+        for width_name, (max_row_width, avg_row_width) in sorted(row_widths.items()):
+            print("%-25s %.0f / %d bytes" % ("%s row width (avg / max):" % width_name, avg_row_width, max_row_width))
+        for name, limit_bytes, batch_rows, payload_bytes in payload_batch_rows:
+            print("%-25s %d rows under %.0f MB (%.1f MB at the recommended batch size)"
+                  % (name + ":", batch_rows, limit_bytes / 1024.0 / 1024.0,
+                     payload_bytes(recommended_max_batch_rows) / 1024.0 / 1024.0))
+        print("recommended batch size:   %d rows" % recommended_max_batch_rows)
+        print("calls per million rows:   %d (vs %d with the default batch size of %d rows)"
+              % (-(-1000000 // max_batch_rows),
+                 -(-1000000 // create_resources.DEFAULT_PREDICT_OUTCOME_MAX_BATCH_ROWS),
+                 create_resources.DEFAULT_PREDICT_OUTCOME_MAX_BATCH_ROWS))
+
+        if args.create_function:
+            function_name = create_model_predict_function(create_resources, snowflake_connection, args.stack_name,
+                                                          args.create_function, max_batch_rows)
+            print("created %s with max_batch_rows=%d" % (function_name, max_batch_rows))
+        if args.update_stack:
+            update_stack_max_batch_rows(args.stack_name, max_batch_rows)
+            print("updating stack %s with predictOutcomeMaxBatchRows=%d" % (args.stack_name, max_batch_rows))
+    finally:
+        create_resources.close_snowflake_connection(snowflake_connection)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Compares the size and transfer time of the predict traffic with each COMPRESSION mode of the external functions, on
+# synthetic batches of increasing width. The request bodies are rendered by the AWS_AUTOPILOT_PREDICT_OUTCOME request
+# translator, as Snowflake sends them to API Gateway, and the response bodies are the predictions returned by the
+# endpoint. The time of a body is the time to compress it, send it at the given bandwidth and decompress it.
+#
+# Usage: python3 tools/predict-compression-benchmark.py [--rows N] [--columns N,N,...] [--bandwidth-mbps MBPS]
+#            [--backend ENDPOINT|PROXY] [--engine mini_racer|node]
+import argparse
+import gzip
+import importlib.util
+import json
+import os
+import random
+import time
+import zlib
+
+TRANSLATOR_BENCHMARK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "translator-benchmark.py")
+
+# COMPRESSION mode of the external function: (compress, decompress). AUTO is sent gzipped
+COMPRESSION_MODES = [
+    ("NONE", lambda body: body, lambda body: body),
+    ("GZIP", gzip.compress, gzip.decompress),
+    ("DEFLATE", zlib.compress, zlib.decompress),
+]
+
+
+def load_translator_benchmark():
+    spec = importlib.util.spec_from_file_location("translator_benchmark", TRANSLATOR_BENCHMARK_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def render_request_bodies(translator_benchmark, backend, events, engine):
+    provisioning_benchmark = translator_benchmark.load_provisioning_benchmark()
+    create_resources = provisioning_benchmark.load_create_resources()
+    translator_bodies = translator_benchmark.get_translator_bodies(
+        provisioning_benchmark.build_statement_plan(create_resources, backend))
+    jobs = [{"translator": "AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR", "event": event} for event in events]
+    results = translator_benchmark.run_program(translator_benchmark.build_program(translator_bodies, jobs), engine)
+    return [result["output"]["body"].encode("utf-8") for result in results]
+
+
+def measure(body, compress, decompress, bandwidth_bytes_per_second, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        compressed_body = compress(body)
+    compress_seconds = (time.perf_counter() - start) / iterations
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decompress(compressed_body)
+    decompress_seconds = (time.perf_counter() - start) / iterations
+
+    transfer_seconds = len(compressed_body) / bandwidth_bytes_per_second
+    return len(compressed_body), (compress_seconds + transfer_seconds + decompress_seconds) * 1000
+
+
+def print_comparison(title, bodies_by_columns, bandwidth_bytes_per_second, iterations):
+    print(title)
+    print("%8s  %-8s %12s %7s %10s" % ("columns", "mode", "bytes", "ratio", "time (ms)"))
+    for columns, body in bodies_by_columns:
+        for mode, compress, decompress in COMPRESSION_MODES:
+            size, elapsed_ms = measure(body, compress, decompress, bandwidth_bytes_per_second, iterations)
+            print("%8d  %-8s %12d %6.1fx %10.2f" % (columns, mode, size, len(body) / float(size), elapsed_ms))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict traffic compression benchmark")
+    parser.add_argument("--rows", type=int, default=100, help="Rows per batch")
+    parser.add_argument("--columns", default="20,200,1000", help="Comma separated feature column counts")
+    parser.add_argument("--bandwidth-mbps", type=float, default=100.0,
+                        help="Bandwidth between Snowflake, API Gateway and the endpoint, in megabits per second")
+    parser.add_argument("--backend", choices=["ENDPOINT", "PROXY"], default="ENDPOINT",
+                        help="Predict backend whose request translator renders the batches")
+    parser.add_argument("--iterations", type=int, default=20, help="Compressions timed per body")
+    parser.add_argument("--engine", choices=["mini_racer", "node"], help="JavaScript engine, detected by default")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic batches")
+    args = parser.parse_args()
+
+    translator_benchmark = load_translator_benchmark()
+    engine = translator_benchmark.get_engine(args.engine)
+    generator = random.Random(args.seed)
+    column_counts = [int(columns) for columns in args.columns.split(",")]
+    bandwidth_bytes_per_second = args.bandwidth_mbps * 1000 * 1000 / 8
+
+    events = [translator_benchmark.synthetic_predict_request(args.rows, columns, generator)
+              for columns in column_counts]
+    request_bodies = render_request_bodies(translator_benchmark, args.backend, events, engine)
+    # What the endpoint returns for the batch, as JSON, with probabilities to match the widest responses
+    response_bodies = [json.dumps(translator_benchmark.synthetic_predict_response(args.rows, generator, True)["body"])
+                       .encode("utf-8") for _ in column_counts]
+
+    print("%d rows per batch, %.0f Mbit/s, %s backend" % (args.rows, args.bandwidth_mbps, args.backend))
+    print()
+    print_comparison("requests (Snowflake -> API Gateway):", list(zip(column_counts, request_bodies)),
+                     bandwidth_bytes_per_second, args.iterations)
+    print_comparison("responses (API Gateway -> Snowflake):", list(zip(column_counts, response_bodies)),
+                     bandwidth_bytes_per_second, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
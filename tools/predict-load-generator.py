@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# Load generator for the predict path, without Snowflake or SageMaker. A local HTTP server stands in for the
+# /sagemaker/predictoutcome/{endpointName} route of API Gateway and the endpoint behind it: it waits a fixed round trip
+# plus a cost per row on one of its instances, and answers a configurable fraction of the calls with a throttling
+# (429) or a server (500) error. A driver generates batches shaped like the ones Snowflake sends to an external
+# function, renders the requests with the AWS_AUTOPILOT_PREDICT_OUTCOME request translator, sends them at the given
+# concurrency, retrying the throttled calls after their Retry-After and the failed ones with exponential backoff, and
+# checks the responses with the response translator.
+#
+# Each combination of --max-batch-rows and --concurrency is run on the same rows, and reports the rows/sec, the
+# p50/p95/p99 latency of a batch (with its retries), the calls throttled and failed and the batches that failed after
+# all their retries.
+#
+# Usage: python3 tools/predict-load-generator.py [--rows N] [--columns N] [--max-batch-rows N,N,...]
+#            [--concurrency N,N,...] [--latency SECONDS] [--latency-per-row SECONDS] [--instances N]
+#            [--throttle-rate F] [--error-rate F] [--retry-after SECONDS] [--backend ENDPOINT|PROXY]
+#            [--compression NONE|GZIP|DEFLATE]
+import argparse
+import collections
+import concurrent.futures
+import gzip
+import http.server
+import importlib.util
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+
+TRANSLATOR_BENCHMARK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "translator-benchmark.py")
+
+ROUTE = "/sagemaker/predictoutcome/"
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+# Content-Encoding of the requests sent with each COMPRESSION mode of the external function
+CONTENT_ENCODINGS = {"NONE": None, "GZIP": "gzip", "DEFLATE": "deflate"}
+
+
+def load_translator_benchmark():
+    spec = importlib.util.spec_from_file_location("translator_benchmark", TRANSLATOR_BENCHMARK_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class StandInPredictRoute(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency, latency_per_row, instances, throttle_rate, error_rate, retry_after,
+                 minimum_compression_size, seed):
+        super().__init__(("127.0.0.1", 0), StandInPredictHandler)
+        self.latency = latency
+        self.latency_per_row = latency_per_row
+        # Each instance serves one call at a time
+        self.instances = threading.Semaphore(instances)
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.minimum_compression_size = minimum_compression_size
+        self.generator = random.Random(seed)
+        self.lock = threading.Lock()
+        self.statistics = collections.Counter()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.statistics[name] += value
+
+    def draw(self):
+        with self.lock:
+            return self.generator.random()
+
+
+class StandInPredictHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if not url.path.startswith(ROUTE):
+            return self.send_body(404, {"message": "Missing Authentication Token"})
+
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        # API Gateway decompresses the requests before the integration
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        elif self.headers.get("Content-Encoding") == "deflate":
+            body = zlib.decompress(body)
+        body = body.decode("utf-8")
+
+        draw = self.server.draw()
+        if draw < self.server.throttle_rate:
+            self.server.count("throttled")
+            return self.send_body(429, {"message": "Too Many Requests"}, {"Retry-After": str(self.server.retry_after)})
+        if draw < self.server.throttle_rate + self.server.error_rate:
+            self.server.count("errors")
+            return self.send_body(500, {"message": "Internal server error"})
+
+        # The PROXY backend receives the distinct rows of the batch in an envelope and returns their rowIndex
+        response_body = {}
+        if urllib.parse.parse_qs(url.query).get("format") == ["envelope"]:
+            envelope = json.loads(body)
+            body = envelope["rows"]
+            response_body["rowIndex"] = envelope["rowIndex"]
+        rows = body.split("\n")
+
+        with self.server.instances:
+            time.sleep(self.server.latency + self.server.latency_per_row * len(rows))
+        self.server.count("invocations")
+        self.server.count("rows", len(rows))
+        response_body["predictions"] = [{"predicted_label": "yes" if sum(map(ord, row)) % 2 else "no"}
+                                        for row in rows]
+        self.send_body(200, response_body)
+
+    def send_body(self, status_code, response_body, headers=None):
+        body = json.dumps(response_body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if (self.server.minimum_compression_size >= 0 and len(body) >= self.server.minimum_compression_size
+                and "gzip" in self.headers.get("Accept-Encoding", "")):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def render_requests(translator_benchmark, translator_bodies, engine, batches, backend):
+    translator_name = "AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR"
+    if backend == "PROXY" and translator_name + "@PROXY" in translator_bodies:
+        translator_name += "@PROXY"
+    jobs = [{"translator": translator_name, "event": {"body": {"data": batch}}} for batch in batches]
+    results = translator_benchmark.run_program(translator_benchmark.build_program(translator_bodies, jobs), engine)
+    for result in results:
+        if "error" in result:
+            raise SystemExit("The request translator failed: %s" % result["error"])
+    return [result["output"] for result in results]
+
+
+def check_responses(translator_benchmark, translator_bodies, engine, batches, response_bodies):
+    jobs = [{"translator": "AWS_AUTOPILOT_PREDICT_OUTCOME_RESPONSE_TRANSLATOR", "event": {"body": response_body}}
+            for response_body in response_bodies if response_body is not None]
+    results = iter(translator_benchmark.run_program(translator_benchmark.build_program(translator_bodies, jobs),
+                                                    engine))
+    for batch, response_body in zip(batches, response_bodies):
+        if response_body is None:
+            continue
+        result = next(results)
+        # Snowflake expects one result per row of the batch, with the row numbers of the batch
+        data = result.get("output", {}).get("body", {}).get("data")
+        if data is None or [row[0] for row in data] != [row[0] for row in batch]:
+            raise SystemExit("The response translator does not return the rows of the batch: %s" % json.dumps(result))
+
+
+def send_batch(base_url, request, compression, max_retries, backoff):
+    body = request["body"].encode("utf-8")
+    headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+    if CONTENT_ENCODINGS[compression]:
+        body = gzip.compress(body) if compression == "GZIP" else zlib.compress(body)
+        headers["Content-Encoding"] = CONTENT_ENCODINGS[compression]
+
+    start = time.perf_counter()
+    retries = collections.Counter()
+    for attempt in range(max_retries + 1):
+        try:
+            with urllib.request.urlopen(urllib.request.Request(base_url + ROUTE.rstrip("/") + request["urlSuffix"],
+                                                               data=body, headers=headers)) as response:
+                response_body = response.read()
+                if response.headers.get("Content-Encoding") == "gzip":
+                    response_body = gzip.decompress(response_body)
+                return time.perf_counter() - start, retries, json.loads(response_body)
+        except urllib.error.HTTPError as e:
+            if e.code not in RETRYABLE_STATUS_CODES:
+                raise
+            retries[e.code] += 1
+            # The throttled calls are retried after the Retry-After of the stack, the other ones with backoff
+            if attempt < max_retries:
+                time.sleep(float(e.headers.get("Retry-After") or backoff * 2 ** attempt))
+    return time.perf_counter() - start, retries, None
+
+
+def run(base_url, requests, concurrency, compression, max_retries, backoff):
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda request: send_batch(base_url, request, compression, max_retries, backoff),
+                                    requests))
+    return time.perf_counter() - start, results
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict path load generator")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows scored by every run")
+    parser.add_argument("--columns", type=int, default=20, help="Feature columns per row")
+    parser.add_argument("--max-batch-rows", default="100", help="Comma separated batch sizes, as predictOutcomeMaxBatchRows")
+    parser.add_argument("--concurrency", default="8", help="Comma separated numbers of batches sent concurrently")
+    parser.add_argument("--latency", type=float, default=0.02, help="Round trip of an endpoint call, in seconds")
+    parser.add_argument("--latency-per-row", type=float, default=0.0002, help="Endpoint time per row, in seconds")
+    parser.add_argument("--instances", type=int, default=2, help="Instances of the stand-in endpoint")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of the calls answered with a 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of the calls answered with a 500")
+    parser.add_argument("--retry-after", type=float, default=0.1,
+                        help="Retry-After of the throttled calls, in seconds, as throttlingRetryAfterSeconds")
+    parser.add_argument("--max-retries", type=int, default=5, help="Retries of a throttled or failed batch")
+    parser.add_argument("--backoff", type=float, default=0.05, help="First retry delay, doubled on every retry")
+    parser.add_argument("--backend", choices=["ENDPOINT", "PROXY"], default="ENDPOINT",
+                        help="Predict backend whose request translator renders the batches")
+    parser.add_argument("--endpoints", type=int, default=1,
+                        help="Endpoints the rows are spread over, more than one needs the PROXY backend")
+    parser.add_argument("--compression", choices=sorted(CONTENT_ENCODINGS), default="NONE",
+                        help="COMPRESSION of the external function")
+    parser.add_argument("--minimum-compression-size", type=int, default=1024,
+                        help="Size in bytes from which the responses are compressed, -1 to never compress them")
+    parser.add_argument("--engine", choices=["mini_racer", "node"], help="JavaScript engine, detected by default")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workload")
+    args = parser.parse_args()
+
+    translator_benchmark = load_translator_benchmark()
+    engine = translator_benchmark.get_engine(args.engine)
+    provisioning_benchmark = translator_benchmark.load_provisioning_benchmark()
+    create_resources = provisioning_benchmark.load_create_resources()
+    translator_bodies = translator_benchmark.get_translator_bodies(
+        provisioning_benchmark.build_statement_plan(create_resources))
+    translator_bodies.update(translator_benchmark.get_translator_bodies(
+        provisioning_benchmark.build_statement_plan(create_resources, "PROXY"), "@PROXY"))
+
+    generator = random.Random(args.seed)
+    endpoint_names = ["%s-%d" % (translator_benchmark.ENDPOINT_NAME, i) for i in range(args.endpoints)]
+    rows = [[endpoint_names[row % len(endpoint_names)],
+             [translator_benchmark.synthetic_feature(column, generator) for column in range(args.columns)]]
+            for row in range(args.rows)]
+
+    server = StandInPredictRoute(args.latency, args.latency_per_row, args.instances, args.throttle_rate,
+                                 args.error_rate, args.retry_after, args.minimum_compression_size, args.seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:%d" % server.server_address[1]
+
+    print("%d rows x %d columns, %s backend, %d endpoint(s) of %d instance(s), %.0f%% throttled, %.0f%% errors"
+          % (args.rows, args.columns, args.backend, args.endpoints, args.instances, args.throttle_rate * 100,
+             args.error_rate * 100))
+    print()
+    print("%10s %11s %10s %8s %8s %8s %9s %7s %7s" % ("batch rows", "concurrency", "rows/sec", "p50 ms", "p95 ms",
+                                                      "p99 ms", "throttled", "errors", "failed"))
+    try:
+        for max_batch_rows in [int(value) for value in args.max_batch_rows.split(",")]:
+            # Snowflake numbers the rows of every batch from 0
+            batches = [[[row_number] + row for row_number, row in enumerate(rows[start:start + max_batch_rows])]
+                       for start in range(0, len(rows), max_batch_rows)]
+            requests = render_requests(translator_benchmark, translator_bodies, engine, batches, args.backend)
+            for concurrency in [int(value) for value in args.concurrency.split(",")]:
+                server.statistics.clear()
+                elapsed, results = run(base_url, requests, concurrency, args.compression, args.max_retries,
+                                       args.backoff)
+                response_bodies = [response_body for _, _, response_body in results]
+                check_responses(translator_benchmark, translator_bodies, engine, batches, response_bodies)
+
+                latencies = sorted(latency for latency, _, _ in results)
+                scored_rows = sum(len(batch) for batch, response_body in zip(batches, response_bodies)
+                                  if response_body is not None)
+                print("%10d %11d %10.0f %8.1f %8.1f %8.1f %9d %7d %7d"
+                      % (max_batch_rows, concurrency, scored_rows / elapsed, percentile(latencies, 0.5) * 1000,
+                         percentile(latencies, 0.95) * 1000, percentile(latencies, 0.99) * 1000,
+                         server.statistics["throttled"], server.statistics["errors"],
+                         response_bodies.count(None)))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Runs the predict proxy of sagemaker-proxy.py against a local stand-in endpoint, whose latency is a fixed round trip
+# plus a cost per row, on a workload of dashboard refreshes: the same batches are scored again on every refresh, with
+# a fraction of their rows changed. Reports the cache hit ratio, the rows sent to the endpoint and the latency per
+# batch, with and without the cache. The stand-in endpoint changes its endpoint config half way through, to check that
+# the cached predictions are invalidated. The last run splits the batches into sub-batches sent concurrently to an
+# endpoint with several instances.
+#
+# Usage: python3 tools/predict-proxy-benchmark.py [--refreshes N] [--changed-fraction F] [--latency SECONDS]
+#            [--instances N] [--concurrency N] [--sub-batch-rows N]
+import argparse
+import importlib.util
+import io
+import json
+import os
+import random
+import threading
+import time
+import types
+
+SAGEMAKER_PROXY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "customer-stack",
+                                    "sagemaker-proxy.py")
+
+ENDPOINT_NAME = "benchmark-endpoint"
+
+
+def load_sagemaker_proxy():
+    spec = importlib.util.spec_from_file_location("sagemaker_proxy", SAGEMAKER_PROXY_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class StandInEndpoint:
+    # Plays both the sagemaker and the sagemaker-runtime clients
+    def __init__(self, latency, latency_per_row, instances):
+        self.latency = latency
+        self.latency_per_row = latency_per_row
+        # Each instance serves one call at a time
+        self.instances = threading.Semaphore(instances)
+        self.endpoint_config_name = "benchmark-config-1"
+        self.lock = threading.Lock()
+        self.invocations = 0
+        self.rows = 0
+
+    def describe_endpoint(self, EndpointName):
+        return {"EndpointName": EndpointName, "EndpointConfigName": self.endpoint_config_name}
+
+    def invoke_endpoint(self, EndpointName, ContentType, Accept, Body):
+        rows = Body.split("\n")
+        with self.instances:
+            time.sleep(self.latency + self.latency_per_row * len(rows))
+        with self.lock:
+            self.invocations += 1
+            self.rows += len(rows)
+        # The prediction depends on the row and on the model, so stale cached predictions are detected
+        predictions = [{"predicted_label": "%s:%d" % (self.endpoint_config_name, sum(map(ord, row)) % 100)}
+                       for row in rows]
+        return {"Body": io.BytesIO(json.dumps({"predictions": predictions}).encode("utf-8"))}
+
+
+def refresh_batches(batches, changed_fraction, generator):
+    return [[row if generator.random() >= changed_fraction else "%s,%d" % (row, generator.randint(0, 10 ** 9))
+             for row in batch] for batch in batches]
+
+
+def run(sagemaker_proxy, endpoint, batches, refreshes, changed_fraction, cache_ttl_seconds, concurrency,
+        sub_batch_rows, seed):
+    os.environ["PredictCacheTtlSeconds"] = str(cache_ttl_seconds)
+    os.environ["PredictConcurrency"] = str(concurrency)
+    os.environ["PredictSubBatchRows"] = str(sub_batch_rows)
+    os.environ["EndpointConfigCheckSeconds"] = "0"
+    sagemaker_proxy.prediction_cache.clear()
+    sagemaker_proxy.endpoint_versions.clear()
+    sagemaker_proxy.cache_statistics.clear()
+    sagemaker_proxy.aws_clients.update({"sagemaker": endpoint, "sagemaker-runtime": endpoint})
+    endpoint.endpoint_config_name = "benchmark-config-1"
+    endpoint.invocations = endpoint.rows = 0
+
+    generator = random.Random(seed)
+    context = types.SimpleNamespace(log_stream_name="benchmark")
+    latencies = []
+    for refresh in range(refreshes):
+        if refresh == refreshes // 2:
+            endpoint.endpoint_config_name = "benchmark-config-2"
+        for batch in refresh_batches(batches, changed_fraction, generator):
+            event = {"pathParameters": {"endpointName": ENDPOINT_NAME}, "body": "\n".join(batch)}
+            start = time.perf_counter()
+            response = sagemaker_proxy.lambda_handler(event, context)
+            latencies.append(time.perf_counter() - start)
+
+            predictions = json.loads(response["body"])["predictions"]
+            assert len(predictions) == len(batch)
+            assert all(prediction["predicted_label"].startswith(endpoint.endpoint_config_name + ":")
+                       for prediction in predictions), "stale prediction returned after an endpoint config change"
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict proxy cache benchmark")
+    parser.add_argument("--batches", type=int, default=20, help="Batches scored on every refresh")
+    parser.add_argument("--rows", type=int, default=100, help="Rows per batch")
+    parser.add_argument("--refreshes", type=int, default=10, help="Number of refreshes")
+    parser.add_argument("--changed-fraction", type=float, default=0.1, help="Fraction of rows changed per refresh")
+    parser.add_argument("--latency", type=float, default=0.02, help="Round trip of an endpoint call, in seconds")
+    parser.add_argument("--latency-per-row", type=float, default=0.0002, help="Endpoint time per row, in seconds")
+    parser.add_argument("--instances", type=int, default=4, help="Instances of the stand-in endpoint")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent sub-batches of the fan-out run")
+    parser.add_argument("--sub-batch-rows", type=int, default=25, help="Rows per sub-batch of the fan-out run")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workload")
+    args = parser.parse_args()
+
+    sagemaker_proxy = load_sagemaker_proxy()
+    endpoint = StandInEndpoint(args.latency, args.latency_per_row, args.instances)
+    generator = random.Random(args.seed)
+    batches = [["%d,%.4f,%s" % (generator.randint(0, 10000), generator.random(), generator.choice("MFI"))
+                for _ in range(args.rows)] for _ in range(args.batches)]
+
+    print("%d refreshes of %d batches x %d rows, %.0f%% of the rows changed per refresh"
+          % (args.refreshes, args.batches, args.rows, args.changed_fraction * 100))
+    runs = [("no cache", 0, 1), ("cache", 3600, 1),
+            ("no cache, fan-out x%d of %d rows" % (args.concurrency, args.sub_batch_rows), 0, args.concurrency)]
+    for label, cache_ttl_seconds, concurrency in runs:
+        latencies = run(sagemaker_proxy, endpoint, batches, args.refreshes, args.changed_fraction,
+                        cache_ttl_seconds, concurrency, args.sub_batch_rows, args.seed)
+        statistics = sagemaker_proxy.cache_statistics
+        lookups = statistics["prediction_hits"] + statistics["prediction_misses"]
+        latencies.sort()
+        print()
+        print("%s:" % label)
+        print("  hit ratio:         %.1f%%" % (100.0 * statistics["prediction_hits"] / lookups if lookups else 0))
+        print("  invalidations:     %d" % statistics["prediction_invalidations"])
+        print("  endpoint calls:    %d (%d rows)" % (endpoint.invocations, endpoint.rows))
+        print("  latency p50 / p99: %.1f / %.1f ms" % (latencies[len(latencies) // 2] * 1000,
+                                                      latencies[int(len(latencies) * 0.99)] * 1000))
+        print("  total:             %.2fs" % sum(latencies))
+
+
+if __name__ == "__main__":
+    main()
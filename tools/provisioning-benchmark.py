@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# Compares the wall-clock time of running the provisioning statement plan of create-resources.py serially and
+# pipelined, against a fake Snowflake connection that sleeps for a fixed round-trip latency on every statement.
+# With --handler the whole lambda_handler runs instead, with stubbed Secrets Manager, IAM, CloudFormation response
+# and Snowflake login that take the same latency per call, and the phase timings returned to CloudFormation by the
+# pipelined run are printed. With --targets the handler also deploys the functions into that many additional schemas,
+# and the result of every target is checked. With --request-type Update the handler runs as on a stack update, and
+# the check that it deployed the API to the stage again is added.
+#
+# Usage: python3 tools/provisioning-benchmark.py [--latency SECONDS] [--max-concurrency N] [--handler] [--targets N]
+#            [--request-type Create|Update]
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import threading
+import time
+import types
+
+CREATE_RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "customer-stack",
+                                     "create-resources.py")
+
+
+HANDLER_ENVIRONMENT = {
+    "ApiGatewayURL": "https://example.execute-api.us-east-1.amazonaws.com/main/sagemaker",
+    "ApiGatewayRoleARN": "arn:aws:iam::123456789012:role/apigateway",
+    "ApiGatewayRoleName": "apigateway",
+    "AutoMLRoleARN": "arn:aws:iam::123456789012:role/automl",
+    "AutoMLRoleName": "automl",
+    "Region": "us-east-1",
+    "S3BucketName": "benchmark-bucket",
+    "SecretArn": "arn:aws:secretsmanager:us-east-1:123456789012:secret:s",
+    "KmsKeyArn": "",
+    "VpcSecurityGroupIds": "",
+    "VpcSubnetIds": "",
+    "SnowflakeRole": "ACCOUNTADMIN",
+    "StackName": "benchmark",
+    "DatabaseName": "BENCHMARK_DB",
+    "SchemaName": "BENCHMARK_SCHEMA",
+    "SnowflakeResourceSuffix": "",
+    "ApiGatewayType": "REGIONAL",
+    "ApiGatewayId": "example",
+    "ApiGatewayStageName": "main",
+}
+
+
+def load_create_resources():
+    for name, value in HANDLER_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+
+    spec = importlib.util.spec_from_file_location("create_resources", CREATE_RESOURCES_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.sfqid = None
+        self.statement_str = None
+        # Columns read by get_existing_ddl_hashes, the show commands return no objects
+        self.description = [("comment",), ("description",)]
+
+    def execute(self, statement_str):
+        time.sleep(self.connection.latency)
+        with self.connection.lock:
+            self.connection.executed.append(statement_str)
+            self.sfqid = "fake-query-%s" % len(self.connection.executed)
+        self.statement_str = statement_str
+        return self
+
+    def fetchall(self):
+        if self.statement_str.startswith("show"):
+            return []
+        return [("STORAGE_AWS_IAM_USER_ARN", "String", "arn:aws:iam::123456789012:user/s", ""),
+                ("STORAGE_AWS_EXTERNAL_ID", "String", "external-id", ""),
+                ("API_AWS_IAM_USER_ARN", "String", "arn:aws:iam::123456789012:user/a", ""),
+                ("API_AWS_EXTERNAL_ID", "String", "external-id", "")]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FakeConnection:
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def is_closed(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class FakeAwsClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_secret_value(self, SecretId):
+        time.sleep(self.latency)
+        return {"SecretString": '{"accountid": "a", "username": "u", "password": "p"}'}
+
+    def update_assume_role_policy(self, PolicyDocument, RoleName):
+        time.sleep(self.latency)
+
+    def create_deployment(self, restApiId, stageName, description):
+        time.sleep(self.latency)
+        api_deployments.append((restApiId, stageName))
+        return {"id": "deployment-%d" % len(api_deployments)}
+
+
+class FakeResponse:
+    status_code = 200
+
+
+# Bodies of the responses sent to CloudFormation by the handler
+cloudformation_responses = []
+# Stages deployed by the handler, as (API id, stage name)
+api_deployments = []
+
+
+def stub_aws_and_snowflake(create_resources, latency):
+    create_resources.boto3 = types.SimpleNamespace(client=lambda *args, **kwargs: FakeAwsClient(latency))
+    create_resources.requests = types.SimpleNamespace(
+        put=lambda url, data: time.sleep(latency) or cloudformation_responses.append(json.loads(data)) or FakeResponse())
+
+    def connect_to_snowflake(get_secret_value_response, snowflake_role_name):
+        time.sleep(latency)
+        return FakeConnection(latency)
+    create_resources.connect_to_snowflake = connect_to_snowflake
+    create_resources.import_snowflake_connector = lambda: None
+
+
+def run_handler(create_resources, max_concurrency, request_type):
+    os.environ["DdlMaxConcurrency"] = str(max_concurrency)
+    event = {"RequestType": request_type, "ResponseURL": "https://example.com", "StackId": "stack",
+             "RequestId": "request", "LogicalResourceId": "SnowflakeResources"}
+    context = types.SimpleNamespace(log_stream_name="benchmark")
+
+    # Both runs start cold
+    create_resources.aws_clients.clear()
+    create_resources.secret_cache.clear()
+    create_resources.snowflake_connection_cache.clear()
+
+    # The embedded metric format documents written to stdout are not printed
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_resources.lambda_handler(event, context)
+    return time.perf_counter() - start
+
+
+def build_statement_plan(create_resources, predict_outcome_backend="ENDPOINT"):
+    stack_name = "benchmark"
+    api_gateway_url = "https://example.execute-api.us-east-1.amazonaws.com/main/sagemaker"
+    storage_integration_name = "AWS_AUTOPILOT_STORAGE_INTEGRATION_" + stack_name
+    api_integration_name = "AWS_AUTOPILOT_API_INTEGRATION_" + stack_name
+
+    statement_plan = []
+    create_resources.create_storage_integration(statement_plan, storage_integration_name,
+                                                "arn:aws:iam::123456789012:role/automl", "benchmark-bucket")
+    create_resources.create_api_integration(statement_plan, api_integration_name,
+                                            "arn:aws:iam::123456789012:role/apigateway", api_gateway_url, "REGIONAL")
+    create_resources.create_external_functions(statement_plan, api_integration_name,
+                                               "arn:aws:iam::123456789012:role/automl", api_gateway_url,
+                                               "benchmark-bucket", "arn:aws:secretsmanager:us-east-1:123456789012:secret:s",
+                                               storage_integration_name, "ACCOUNTADMIN", "", "", "",
+                                               predict_outcome_backend=predict_outcome_backend)
+    return statement_plan
+
+
+def run(create_resources, statement_plan, latency, max_concurrency):
+    connection = FakeConnection(latency)
+    start = time.perf_counter()
+    create_resources.execute_statement_plan(connection, statement_plan, max_concurrency)
+    elapsed = time.perf_counter() - start
+    assert len(connection.executed) == len(statement_plan)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs pipelined provisioning benchmark")
+    parser.add_argument("--latency", type=float, default=0.3, help="Simulated round trip per statement, in seconds")
+    parser.add_argument("--max-concurrency", type=int, default=None,
+                        help="Concurrency of the pipelined run (defaults to the Lambda default)")
+    parser.add_argument("--handler", action="store_true",
+                        help="Run the whole lambda_handler with stubbed AWS and Snowflake calls")
+    parser.add_argument("--targets", type=int, default=0,
+                        help="Additional schemas the handler deploys the functions into, with --handler")
+    parser.add_argument("--request-type", choices=["Create", "Update"], default="Create",
+                        help="CloudFormation request the handler runs, with --handler")
+    args = parser.parse_args()
+
+    create_resources = load_create_resources()
+    max_concurrency = args.max_concurrency or create_resources.DEFAULT_DDL_MAX_CONCURRENCY
+    statement_plan = build_statement_plan(create_resources)
+
+    if args.handler:
+        os.environ["AdditionalTargets"] = ",".join("BENCHMARK_DB.TARGET_SCHEMA_%d" % i for i in range(args.targets))
+        stub_aws_and_snowflake(create_resources, args.latency)
+        serial = run_handler(create_resources, 1, args.request_type)
+        pipelined = run_handler(create_resources, max_concurrency, args.request_type)
+    else:
+        serial = run(create_resources, statement_plan, args.latency, 1)
+        pipelined = run(create_resources, statement_plan, args.latency, max_concurrency)
+
+    print("statements:            %d" % len(statement_plan))
+    print("latency per statement: %.3fs" % args.latency)
+    print("serial:                %.2fs" % serial)
+    print("pipelined (x%d):       %.2fs" % (max_concurrency, pipelined))
+    print("speedup:               %.1fx" % (serial / pipelined))
+
+    if args.handler:
+        timing_summary = json.loads(cloudformation_responses[-1]["Data"]["TimingSummary"])
+        print()
+        print("pipelined phases (summed over concurrent tasks):")
+        for phase_name, duration_ms in timing_summary["phases_ms"].items():
+            print("  %-26s %8.1f ms" % (phase_name, duration_ms))
+        print("  %-26s %8.1f ms" % ("total (elapsed)", timing_summary["total_ms"]))
+
+        if cloudformation_responses[-1]["Status"] != "SUCCESS":
+            raise SystemExit("Handler failed: %s" % json.dumps(cloudformation_responses[-1]["Data"]))
+        expected_deployments = 2 if args.request_type == "Update" else 0
+        if api_deployments != [("example", "main")] * expected_deployments:
+            raise SystemExit("API deployed %d times instead of %d on %s" % (len(api_deployments), expected_deployments,
+                                                                            args.request_type))
+        print()
+        print("API deployments:       %d" % len(api_deployments))
+
+        if args.targets:
+            target_results = json.loads(cloudformation_responses[-1]["Data"]["TargetResults"])
+            failed_targets = [target for target, target_result in target_results.items() if target_result != "SUCCESS"]
+            print()
+            print("additional targets:    %d deployed, %d failed" % (len(target_results) - len(failed_targets),
+                                                                     len(failed_targets)))
+            if failed_targets or len(target_results) != args.targets:
+                raise SystemExit("Additional targets not deployed: %s" % json.dumps(target_results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# Runs the status refresh of status-refresh.py against a stand-in SageMaker holding AutoML jobs and endpoints, and a
+# stand-in Snowflake connection that keeps the status table in memory. Between refreshes a fraction of the jobs and
+# endpoints change status and some endpoints are deleted. The stand-in also holds the jobs and endpoints of another
+# stack, which the refresh leaves out. Reports the SageMaker calls and the rows written by every refresh, and checks the
+# table against the state of the stand-in SageMaker after each one.
+#
+# Usage: python3 tools/status-refresh-benchmark.py [--models N] [--endpoints N] [--other-stack N] [--refreshes N]
+#            [--changed-fraction F] [--latency SECONDS]
+import argparse
+import collections
+import datetime
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+from botocore.exceptions import ClientError
+
+CUSTOMER_STACK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "customer-stack")
+
+HANDLER_ENVIRONMENT = {
+    "Region": "us-east-1",
+    "SecretArn": "arn:aws:secretsmanager:us-east-1:123456789012:secret:s",
+    "SnowflakeRole": "ACCOUNTADMIN",
+    "DatabaseName": "BENCHMARK_DB",
+    "SchemaName": "BENCHMARK_SCHEMA",
+    "SnowflakeResourceSuffix": "",
+    "StackName": "benchmark",
+}
+OTHER_STACK_NAME = "other"
+
+
+JOB_STATUSES = [("InProgress", "FeatureEngineering"), ("InProgress", "ModelTuning"), ("Completed", "Completed"),
+                ("Failed", "Failed")]
+ENDPOINT_STATUSES = ["Creating", "InService", "Updating", "Failed"]
+
+
+def load_status_refresh():
+    for name, value in HANDLER_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+
+    # status-refresh.py imports create-resources.py as a module of the same package
+    sys.path.insert(0, CUSTOMER_STACK_PATH)
+    spec = importlib.util.spec_from_file_location("status_refresh", os.path.join(CUSTOMER_STACK_PATH,
+                                                                                 "status-refresh.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class StandInSageMaker:
+    def __init__(self, latency, models, endpoints, other_stack, generator):
+        self.latency = latency
+        self.generator = generator
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.clock = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+        self.jobs = collections.OrderedDict()
+        self.endpoints = collections.OrderedDict()
+        # Tags by ARN. The endpoints of odd index are untagged, as the ones deployed by AWS_AUTOPILOT_CREATE_MODEL, and
+        # are of the stack by the name of their model
+        self.tags = {}
+        for i in range(models):
+            self.add_job("model%d-job" % i, HANDLER_ENVIRONMENT["StackName"])
+        for i in range(endpoints):
+            self.add_endpoint("model%d" % i, HANDLER_ENVIRONMENT["StackName"] if i % 2 == 0 else None)
+        for i in range(other_stack):
+            self.add_job("other%d-job" % i, OTHER_STACK_NAME)
+            self.add_endpoint("other%d" % i, None)
+
+    def add_job(self, job_name, stack_name):
+        self.jobs[job_name] = self.job_summary(job_name)
+        self.tags[self.jobs[job_name]["AutoMLJobArn"]] = [
+            {"Key": "SnowflakeIntegrationStackName", "Value": stack_name}]
+
+    def add_endpoint(self, endpoint_name, stack_name):
+        self.endpoints[endpoint_name] = self.endpoint_summary(endpoint_name)
+        self.tags[self.endpoints[endpoint_name]["EndpointArn"]] = (
+            [{"Key": "SnowflakeIntegrationStackName", "Value": stack_name}] if stack_name else [])
+
+    def is_stack_resource(self, name):
+        return name.startswith("model")
+
+    def tick(self):
+        self.clock += datetime.timedelta(seconds=1)
+        return self.clock
+
+    def job_summary(self, job_name):
+        status, secondary_status = self.generator.choice(JOB_STATUSES)
+        summary = {"AutoMLJobName": job_name,
+                   "AutoMLJobArn": "arn:aws:sagemaker:us-east-1:123456789012:automl-job/" + job_name,
+                   "AutoMLJobStatus": status, "AutoMLJobSecondaryStatus": secondary_status,
+                   "CreationTime": self.clock.replace(year=2025), "LastModifiedTime": self.tick()}
+        if status == "Failed":
+            summary["FailureReason"] = "ClientError: not enough rows"
+        return summary
+
+    def endpoint_summary(self, endpoint_name):
+        return {"EndpointName": endpoint_name,
+                "EndpointArn": "arn:aws:sagemaker:us-east-1:123456789012:endpoint/" + endpoint_name,
+                "EndpointStatus": self.generator.choice(ENDPOINT_STATUSES),
+                "CreationTime": self.clock.replace(year=2025), "LastModifiedTime": self.tick()}
+
+    def change(self, changed_fraction):
+        for job_name in self.generator.sample(list(self.jobs), int(len(self.jobs) * changed_fraction)):
+            self.jobs[job_name] = self.job_summary(job_name)
+        changed_endpoints = self.generator.sample(list(self.endpoints), int(len(self.endpoints) * changed_fraction))
+        # A quarter of the changed endpoints are deleted
+        for index, endpoint_name in enumerate(changed_endpoints):
+            if index % 4 == 0:
+                del self.endpoints[endpoint_name]
+            else:
+                self.endpoints[endpoint_name] = self.endpoint_summary(endpoint_name)
+
+    def call(self, operation_name):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls[operation_name] += 1
+
+    def list_page(self, summaries, MaxResults, NextToken=None):
+        start = int(NextToken or 0)
+        page = {"Page": [dict(summary) for summary in summaries[start:start + MaxResults]]}
+        if start + MaxResults < len(summaries):
+            page["NextToken"] = str(start + MaxResults)
+        return page
+
+    def list_auto_ml_jobs(self, **parameters):
+        self.call("ListAutoMLJobs")
+        page = self.list_page(list(self.jobs.values()), **parameters)
+        page["AutoMLJobSummaries"] = page.pop("Page")
+        return page
+
+    def list_endpoints(self, **parameters):
+        self.call("ListEndpoints")
+        page = self.list_page(list(self.endpoints.values()), **parameters)
+        page["Endpoints"] = page.pop("Page")
+        return page
+
+    def list_tags(self, ResourceArn, **parameters):
+        self.call("ListTags")
+        page = self.list_page(self.tags[ResourceArn], **parameters)
+        page["Tags"] = page.pop("Page")
+        return page
+
+    def describe_auto_ml_job(self, AutoMLJobName):
+        self.call("DescribeAutoMLJob")
+        return {"AutoMLJobName": AutoMLJobName, "BestCandidate": {"FinalAutoMLJobObjectiveMetric": {
+            "MetricName": "validation:accuracy", "Value": 0.5}}, "ResponseMetadata": {}}
+
+    def describe_endpoint(self, EndpointName):
+        self.call("DescribeEndpoint")
+        if EndpointName not in self.endpoints:
+            raise ClientError({"Error": {"Code": "ValidationException",
+                                         "Message": "Could not find endpoint " + EndpointName}}, "DescribeEndpoint")
+        summary = self.endpoints[EndpointName]
+        return {"EndpointName": EndpointName, "EndpointStatus": summary["EndpointStatus"],
+                "EndpointConfigName": EndpointName + "-m5-4xl-2", "ResponseMetadata": {}}
+
+
+class StandInCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, statement_str, params=None):
+        statement = " ".join(statement_str.split()).lower()
+        if statement.startswith("select resource_type, name, state_hash"):
+            self.rows = [(resource_type, name, row["STATE_HASH"])
+                         for (resource_type, name), row in self.connection.table.items()]
+        elif statement.startswith("merge into"):
+            columns = self.connection.status_columns
+            for start in range(0, len(params), len(columns)):
+                row = dict(zip(columns, params[start:start + len(columns)]))
+                self.connection.table[(row["RESOURCE_TYPE"], row["NAME"])] = row
+                self.connection.rows_written += 1
+        return self
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class StandInConnection:
+    def __init__(self, status_columns):
+        self.status_columns = status_columns
+        self.table = {}
+        self.rows_written = 0
+
+    def cursor(self):
+        return StandInCursor(self)
+
+    def is_closed(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class StandInSecretsManager:
+    def get_secret_value(self, SecretId):
+        return {"SecretString": '{"accountid": "a", "username": "u", "password": "p"}'}
+
+
+def check_table(status_refresh, connection, sagemaker):
+    expected = {}
+    for job_name, summary in sagemaker.jobs.items():
+        if sagemaker.is_stack_resource(job_name):
+            expected[(status_refresh.MODEL_RESOURCE_TYPE, job_name[:-len("-job")])] = summary["AutoMLJobStatus"]
+    for endpoint_name, summary in sagemaker.endpoints.items():
+        if sagemaker.is_stack_resource(endpoint_name):
+            expected[(status_refresh.ENDPOINT_RESOURCE_TYPE, endpoint_name)] = summary["EndpointStatus"]
+    actual = {key: row["STATUS"] for key, row in connection.table.items() if row["STATUS"] != "Deleted"}
+    assert actual == expected, "status table does not match SageMaker"
+    for row in connection.table.values():
+        if row["STATE"] is not None:
+            json.loads(row["STATE"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Status table refresh benchmark")
+    parser.add_argument("--models", type=int, default=500, help="AutoML jobs of the stand-in SageMaker")
+    parser.add_argument("--endpoints", type=int, default=200, help="Endpoints of the stand-in SageMaker")
+    parser.add_argument("--other-stack", type=int, default=100,
+                        help="AutoML jobs and endpoints of another stack in the stand-in SageMaker")
+    parser.add_argument("--refreshes", type=int, default=5, help="Number of refreshes")
+    parser.add_argument("--changed-fraction", type=float, default=0.05,
+                        help="Fraction of the jobs and endpoints changed between refreshes")
+    parser.add_argument("--latency", type=float, default=0.005, help="Round trip of a SageMaker call, in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workload")
+    args = parser.parse_args()
+
+    status_refresh = load_status_refresh()
+    generator = random.Random(args.seed)
+    sagemaker = StandInSageMaker(args.latency, args.models, args.endpoints, args.other_stack, generator)
+    connection = StandInConnection(status_refresh.STATUS_COLUMNS)
+
+    create_resources = status_refresh.create_resources
+    create_resources.aws_clients["sagemaker"] = sagemaker
+    create_resources.aws_clients["secretsmanager"] = StandInSecretsManager()
+    create_resources.connect_to_snowflake = lambda get_secret_value_response, snowflake_role_name: connection
+
+    print("%d models, %d endpoints, %d of each of another stack, %.0f%% changed between refreshes"
+          % (args.models, args.endpoints, args.other_stack, args.changed_fraction * 100))
+    print()
+    print("refresh  sagemaker calls  rows written  elapsed   statistics")
+    for refresh in range(args.refreshes):
+        if refresh:
+            sagemaker.change(args.changed_fraction)
+        sagemaker.calls.clear()
+        rows_written = connection.rows_written
+        start = time.perf_counter()
+        statistics = status_refresh.lambda_handler({}, None)
+        elapsed = time.perf_counter() - start
+        check_table(status_refresh, connection, sagemaker)
+        print("%7d  %15d  %12d  %6.2fs   %s" % (refresh + 1, sum(sagemaker.calls.values()),
+                                               connection.rows_written - rows_written, elapsed,
+                                               json.dumps(statistics)))
+
+    print()
+    print("polling with the describe functions: %d calls per status query"
+          % len([name for name in list(sagemaker.jobs) + list(sagemaker.endpoints)
+                 if sagemaker.is_stack_resource(name)]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# Runs the request and response translators of create-resources.py outside of Snowflake. The translators are rendered
+# from the provisioning statement plan, exactly as they are created in Snowflake, and run in an embedded JavaScript
+# engine (py_mini_racer when it is installed, node otherwise). The translators that differ with the PROXY predict
+# backend are rendered as well, with an @PROXY suffix.
+#
+# Each translator with a golden case is checked against its expected output, then the batch translators of the
+# predict functions are run on synthetic batches of EVENT.body.data and their throughput is reported in rows/sec.
+#
+# Usage: python3 tools/translator-benchmark.py [--rows N] [--columns N] [--iterations N] [--engine mini_racer|node]
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import subprocess
+
+PROVISIONING_BENCHMARK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "provisioning-benchmark.py")
+
+ENDPOINT_NAME = "benchmark-endpoint"
+
+CREATE_MODEL_CONTEXT_HEADERS = {"sf-context-current-database": "BENCHMARK_DB",
+                                "sf-context-current-schema": "BENCHMARK_SCHEMA",
+                                "sf-context-current-warehouse": "BENCHMARK_WH"}
+
+
+def create_model_request_body(endpoint_config_name, instance_type, instance_count):
+    # CreateAutoMLJob payload of abalonemodel, trained on BENCHMARK_DB.BENCHMARK_SCHEMA.abalone and deployed with defaults
+    return json.dumps({
+        "AutoMLJobConfig": {"CompletionCriteria": {"MaxAutoMLJobRuntimeInSeconds": 86400}},
+        "AutoMLJobName": "abalonemodel-job",
+        "InputDataConfig": [{"TargetAttributeName": "RINGS", "AutoMLDatasetDefinition": {
+            "AutoMLSnowflakeDatasetDefinition": {
+                "Warehouse": "BENCHMARK_WH", "Database": "BENCHMARK_DB", "Schema": "BENCHMARK_SCHEMA",
+                "TableName": "abalone", "SnowflakeRole": "ACCOUNTADMIN",
+                "SecretArn": "arn:aws:secretsmanager:us-east-1:123456789012:secret:s",
+                "OutputS3Uri": "s3://benchmark-bucket/output/abalonemodel-job/datasets/",
+                "StorageIntegration": "AWS_AUTOPILOT_STORAGE_INTEGRATION_benchmark"}}}],
+        "OutputDataConfig": {"S3OutputPath": "s3://benchmark-bucket/output/"},
+        "RoleArn": "arn:aws:iam::123456789012:role/automl",
+        "Tags": [{"Key": "SnowflakeIntegrationStackName", "Value": "benchmark"}],
+        "ModelDeployConfig": {
+            "ModelDeployMode": "Endpoint",
+            "EndpointConfigDefinitions": [{"EndpointConfigName": endpoint_config_name,
+                                           "InitialInstanceCount": instance_count, "InstanceType": instance_type}],
+            "EndpointDefinitions": [{"EndpointName": "abalonemodel", "EndpointConfigName": endpoint_config_name,
+                                     "DeletionCondition": {"MaxRuntimeInSeconds": 604800}}]}},
+        separators=(",", ":"))
+
+# Translator name: [(EVENT, expected result, or {"error": message} when the translator throws)]
+# InferenceContainers of the best candidate of an Autopilot classification job: feature transform, algorithm and
+# inverse label transform
+INFERENCE_CONTAINERS = [
+    {"Image": "sklearn-automl", "ModelDataUrl": "s3://bucket/fe.tar.gz",
+     "Environment": {"AUTOML_TRANSFORM_MODE": "feature-transform"}},
+    {"Image": "xgboost", "ModelDataUrl": "s3://bucket/algo.tar.gz", "Environment": {"MAX_CONTENT_LENGTH": "20971520"}},
+    {"Image": "sklearn-automl", "ModelDataUrl": "s3://bucket/fe.tar.gz",
+     "Environment": {"AUTOML_TRANSFORM_MODE": "inverse-label-transform"}},
+]
+
+GOLDEN_CASES = {
+    "AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR": [
+        ({"body": {"data": [[0, "my endpoint", ["M", 0.455, 0.365, 7]], [1, "my endpoint", ["F", 0.53, 0.42, 9]]]}},
+         {"body": "M,0.455,0.365,7\nF,0.53,0.42,9", "urlSuffix": "/my%20endpoint"}),
+        ({"body": {"data": [[0, "east", ["M", 7]], [1, "west", ["F", 9]]]}},
+         {"error": "Error: Rows scored by different endpoints in one batch need predictOutcomeBackend=PROXY"}),
+    ],
+    "AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR@PROXY": [
+        ({"body": {"data": [[0, "my endpoint", ["M", 0.455, 7]], [1, "my endpoint", ["F", 0.53, 9]],
+                            [2, "my endpoint", ["M", 0.455, 7]]]}},
+         {"body": json.dumps({"endpoints": ["my endpoint"], "rows": "M,0.455,7\nF,0.53,9", "rowEndpoint": [0, 0],
+                              "rowIndex": [0, 1, 0]}, separators=(",", ":")),
+          "urlSuffix": "/my%20endpoint?format=envelope"}),
+        ({"body": {"data": [[0, "east", ["M", 7]], [1, "west", ["M", 7]], [2, "east", ["F", 9]],
+                            [3, "east", ["M", 7]]]}},
+         {"body": json.dumps({"endpoints": ["east", "west"], "rows": "M,7\nM,7\nF,9", "rowEndpoint": [0, 1, 0],
+                              "rowIndex": [0, 1, 2, 0]}, separators=(",", ":")),
+          "urlSuffix": "/east?format=envelope"}),
+    ],
+    "AWS_AUTOPILOT_PREDICT_OUTCOME_RESPONSE_TRANSLATOR": [
+        ({"body": {"predictions": [{"predicted_label": "10"}, {"predicted_label": "7"}]}},
+         {"body": {"data": [[0, {"predicted_label": "10"}], [1, {"predicted_label": "7"}]]}}),
+        ({"body": {"predictions": [{"predicted_label": "10"}, {"predicted_label": "7"}], "rowIndex": [0, 1, 0]}},
+         {"body": {"data": [[0, {"predicted_label": "10"}], [1, {"predicted_label": "7"}],
+                            [2, {"predicted_label": "10"}]]}}),
+    ],
+    "AWS_AUTOPILOT_PREDICT_OUTCOME_WITH_PROBABILITIES_RESPONSE_TRANSLATOR": [
+        ({"body": {"predictions": [{"predicted_label": "yes", "probability": 0.9, "probabilities": [0.1, 0.9],
+                                    "labels": ["no", "yes"]},
+                                   {"predicted_label": "no", "probability": 0.6}]}},
+         {"body": {"data": [[0, {"predicted_label": "yes", "probability": 0.9,
+                                 "probabilities": {"no": 0.1, "yes": 0.9}}],
+                            [1, {"predicted_label": "no", "probability": 0.6}]]}}),
+        # Endpoint deployed by AWS_AUTOPILOT_CREATE_MODEL, with the label only
+        ({"body": {"predictions": [{"predicted_label": "yes"}]}},
+         {"error": "Error: The endpoint returned no probabilities, deploy the model created by "
+                   "AWS_AUTOPILOT_CREATE_PROBABILITY_MODEL instead"}),
+    ],
+    "AWS_AUTOPILOT_DESCRIBE_BEST_CANDIDATE_RESPONSE_TRANSLATOR": [
+        ({"body": {"AutoMLJobStatus": "Completed", "BestCandidate": {
+            "CandidateName": "churnmodel-job-best", "InferenceContainers": INFERENCE_CONTAINERS}}},
+         {"body": {"data": [[0, {"JobStatus": "Completed", "CandidateName": "churnmodel-job-best",
+                                 "InferenceContainers": INFERENCE_CONTAINERS}]]}}),
+        ({"body": {"AutoMLJobStatus": "InProgress"}},
+         {"body": {"data": [[0, {"JobStatus": "InProgress"}]]}}),
+    ],
+    "AWS_AUTOPILOT_CREATE_INFERENCE_MODEL_REQUEST_TRANSLATOR": [
+        ({"body": {"data": [[0, "churnmodel-probabilities", INFERENCE_CONTAINERS,
+                             "predicted_label,probability,probabilities,labels"]]}},
+         {"body": {"ModelName": "churnmodel-probabilities-job-best-model", "Containers": [
+             {"Image": "sklearn-automl", "ModelDataUrl": "s3://bucket/fe.tar.gz",
+              "Environment": {"AUTOML_TRANSFORM_MODE": "feature-transform"}},
+             {"Image": "xgboost", "ModelDataUrl": "s3://bucket/algo.tar.gz",
+              "Environment": {"MAX_CONTENT_LENGTH": "20971520",
+                              "SAGEMAKER_INFERENCE_OUTPUT": "predicted_label,probability,probabilities,labels"}},
+             {"Image": "sklearn-automl", "ModelDataUrl": "s3://bucket/fe.tar.gz",
+              "Environment": {"AUTOML_TRANSFORM_MODE": "inverse-label-transform",
+                              "SAGEMAKER_INFERENCE_OUTPUT": "predicted_label,probability,probabilities,labels",
+                              "SAGEMAKER_INFERENCE_INPUT": "predicted_label,probability,probabilities,labels"}}],
+                   "ExecutionRoleArn": "arn:aws:iam::123456789012:role/automl",
+                   "Tags": [{"Key": "SnowflakeIntegrationStackName", "Value": "benchmark"}]}}),
+    ],
+    "AWS_AUTOPILOT_CREATE_MODEL_REQUEST_TRANSLATOR": [
+        ({"contextHeaders": CREATE_MODEL_CONTEXT_HEADERS, "body": {"data": [[0, "abalonemodel", "abalone", "rings"]]}},
+         {"body": create_model_request_body("abalonemodel-m5-4xl-2", "ml.m5.4xlarge", 2)}),
+        ({"contextHeaders": CREATE_MODEL_CONTEXT_HEADERS,
+          "body": {"data": [[0, "abalonemodel", "abalone", "rings", None, None, None, None, None, None,
+                             "ml.c5.large", 1]]}},
+         {"body": create_model_request_body("abalonemodel-c5-l-1", "ml.c5.large", 1)}),
+        ({"contextHeaders": CREATE_MODEL_CONTEXT_HEADERS,
+          "body": {"data": [[0, "abalonemodel", "abalone", "rings", None, None, None, None, None, None,
+                             "ml.g4dn.12xlarge", None]]}},
+         {"body": create_model_request_body("abalonemodel-g4dn-12xl-2", "ml.g4dn.12xlarge", 2)}),
+    ],
+    "AWS_AUTOPILOT_CREATE_ENDPOINT_REQUEST_TRANSLATOR": [
+        ({"body": {"data": [[0, "abalonemodel", "abalonemodel-m5-4xl-2"]]}},
+         {"body": {"EndpointName": "abalonemodel", "EndpointConfigName": "abalonemodel-m5-4xl-2",
+                   "DeletionCondition": {"MaxRuntimeInSeconds": 604800},
+                   "Tags": [{"Key": "SnowflakeIntegrationStackName", "Value": "benchmark"}]}}),
+    ],
+    "AWS_AUTOPILOT_DESCRIBE_MODEL_REQUEST_TRANSLATOR": [
+        ({"body": {"data": [[0, "abalonemodel"]]}},
+         {"body": json.dumps({"AutoMLJobName": "abalonemodel-job"}, separators=(",", ":"))}),
+    ],
+    "AWS_AUTOPILOT_DESCRIBE_MODEL_REQUEST_TRANSLATOR@PROXY": [
+        ({"body": {"data": [[0, "abalonemodel"], [1, "irismodel"], [2, "abalonemodel"], [3, None]]}},
+         {"body": json.dumps({"names": ["abalonemodel-job", "irismodel-job", None], "rowIndex": [0, 1, 0, 2]},
+                             separators=(",", ":"))}),
+    ],
+    "AWS_AUTOPILOT_DESCRIBE_MODEL_RESPONSE_TRANSLATOR@PROXY": [
+        ({"body": {"results": [
+            {"AutoMLJobStatus": "Completed", "AutoMLJobSecondaryStatus": "Completed", "BestCandidate": {
+                "FinalAutoMLJobObjectiveMetric": {"MetricName": "validation:accuracy", "Value": 0.56}}},
+            {"Error": {"Code": "ValidationException", "Message": "Job not found"}}],
+            "rowIndex": [0, 1, 0]}},
+         {"body": {"data": [
+             [0, {"JobStatus": "Completed", "JobStatusDetails": "Completed", "ObjectiveMetric": "validation:accuracy",
+                  "BestObjectiveMetric": 0.56}],
+             [1, {"Error": {"Code": "ValidationException", "Message": "Job not found"}}],
+             [2, {"JobStatus": "Completed", "JobStatusDetails": "Completed", "ObjectiveMetric": "validation:accuracy",
+                  "BestObjectiveMetric": 0.56}]]}}),
+    ],
+    "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_RESPONSE_TRANSLATOR@PROXY": [
+        ({"body": {"results": [{"EndpointStatus": "InService", "ProductionVariants": [
+            {"VariantName": "AllTrafficVariant", "CurrentInstanceCount": 2}]}], "rowIndex": [0, 0]}},
+         {"body": {"data": [[i, {"EndpointStatus": "InService", "ProductionVariants": [
+             {"VariantName": "AllTrafficVariant", "CurrentInstanceCount": 2}], "InferenceMode": "Instance"}]
+                            for i in range(2)]}}),
+    ],
+    "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_REQUEST_TRANSLATOR": [
+        ({"body": {"data": [[0, "abalonemodel"]]}},
+         {"body": json.dumps({"EndpointName": "abalonemodel"}, separators=(",", ":"))}),
+    ],
+    "AWS_AUTOPILOT_CREATE_TRANSFORM_JOB_REQUEST_TRANSLATOR": [
+        ({"body": {"data": [[0, "abalone-bt-1", "abalonemodel", "ml.m5.4xlarge", 4]]}},
+         {"body": json.dumps({
+             "TransformJobName": "abalone-bt-1", "ModelName": "abalonemodel-job-best-model",
+             "BatchStrategy": "MultiRecord",
+             "TransformInput": {"DataSource": {"S3DataSource": {
+                 "S3DataType": "S3Prefix", "S3Uri": "s3://benchmark-bucket/batch-transform/abalone-bt-1/input/"}},
+                 "ContentType": "text/csv", "CompressionType": "Gzip", "SplitType": "Line"},
+             "TransformOutput": {"S3OutputPath": "s3://benchmark-bucket/batch-transform/abalone-bt-1/output/",
+                                 "Accept": "text/csv", "AssembleWith": "Line"},
+             "TransformResources": {"InstanceType": "ml.m5.4xlarge", "InstanceCount": 4},
+             "DataProcessing": {"JoinSource": "Input"}}, separators=(",", ":"))}),
+    ],
+    "AWS_AUTOPILOT_PUT_SCALING_POLICY_REQUEST_TRANSLATOR": [
+        ({"body": {"data": [[0, "abalonemodel", "AllTrafficVariant", 750]]}},
+         {"body": json.dumps({
+             "PolicyName": "AWS_AUTOPILOT_INVOCATIONS_PER_INSTANCE", "ServiceNamespace": "sagemaker",
+             "ResourceId": "endpoint/abalonemodel/variant/AllTrafficVariant",
+             "ScalableDimension": "sagemaker:variant:DesiredInstanceCount", "PolicyType": "TargetTrackingScaling",
+             "TargetTrackingScalingPolicyConfiguration": {
+                 "TargetValue": 750,
+                 "PredefinedMetricSpecification": {"PredefinedMetricType": "SageMakerVariantInvocationsPerInstance"}}},
+             separators=(",", ":"))}),
+    ],
+    "AWS_AUTOPILOT_DESCRIBE_ENDPOINT_RESPONSE_TRANSLATOR": [
+        ({"body": {"EndpointStatus": "InService"}},
+         {"body": {"data": [[0, {"EndpointStatus": "InService"}]]}}),
+        ({"body": {"EndpointStatus": "InService", "ProductionVariants": [
+            {"VariantName": "AllTrafficVariant", "CurrentServerlessConfig": {"MemorySizeInMB": 2048, "MaxConcurrency": 5}}]}},
+         {"body": {"data": [[0, {"EndpointStatus": "InService", "ProductionVariants": [
+             {"VariantName": "AllTrafficVariant", "CurrentServerlessConfig": {"MemorySizeInMB": 2048, "MaxConcurrency": 5}}],
+             "InferenceMode": "Serverless"}]]}}),
+        ({"body": {"EndpointStatus": "InService", "ProductionVariants": [
+            {"VariantName": "AllTrafficVariant", "CurrentInstanceCount": 2}]}},
+         {"body": {"data": [[0, {"EndpointStatus": "InService", "ProductionVariants": [
+             {"VariantName": "AllTrafficVariant", "CurrentInstanceCount": 2}], "InferenceMode": "Instance"}]]}}),
+    ],
+    "AWS_AUTOPILOT_CREATE_ENDPOINT_CONFIG_REQUEST_TRANSLATOR": [
+        ({"body": {"data": [[0, "abalone-config", "abalonemodel", "ml.m5.xlarge", 2]]}},
+         {"body": {"EndpointConfigName": "abalone-config", "ProductionVariants": [
+             {"ModelName": "abalonemodel-job-best-model", "VariantName": "AllTrafficVariant",
+              "InstanceType": "ml.m5.xlarge", "InitialInstanceCount": 2}]}}),
+        ({"body": {"data": [[0, "abalone-serverless", "abalonemodel", 2048, 5]]}},
+         {"body": {"EndpointConfigName": "abalone-serverless", "ProductionVariants": [
+             {"ModelName": "abalonemodel-job-best-model", "VariantName": "AllTrafficVariant",
+              "ServerlessConfig": {"MemorySizeInMB": 2048, "MaxConcurrency": 5}}]}}),
+    ],
+}
+
+# Runs a list of jobs, each one a golden check or a timed loop, and returns the results as a JSON string
+JS_RUNNER = """
+function runJobs(jobs) {
+    let results = [];
+    for (let job of jobs) {
+        let translator = TRANSLATORS[job.translator];
+        if (job.iterations === undefined) {
+            try {
+                results.push({"output": translator(job.event)});
+            } catch (e) {
+                results.push({"error": String(e)});
+            }
+        } else {
+            translator(job.event);
+            let start = Date.now();
+            for (let i = 0; i < job.iterations; i++) {
+                translator(job.event);
+            }
+            results.push({"elapsed_ms": Date.now() - start});
+        }
+    }
+    return JSON.stringify(results);
+}
+"""
+
+
+def load_provisioning_benchmark():
+    spec = importlib.util.spec_from_file_location("provisioning_benchmark", PROVISIONING_BENCHMARK_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_translator_bodies(statement_plan, name_suffix=""):
+    # The body of a JavaScript UDF is between the $$ delimiters, EVENT is its only argument
+    translator_bodies = {}
+    for statement in statement_plan:
+        if statement["name"].endswith("_TRANSLATOR"):
+            translator_bodies[statement["name"] + name_suffix] = statement["sql"].split("$$")[1]
+    return translator_bodies
+
+
+def build_program(translator_bodies, jobs):
+    translators_str = ",\n".join(["%s: function(EVENT) {%s}" % (json.dumps(name), body)
+                                  for name, body in translator_bodies.items()])
+    # The last expression is the value returned by MiniRacer.eval
+    return "const TRANSLATORS = {\n%s\n};\n%s\nconst RESULTS = runJobs(%s);\nRESULTS;" % (translators_str, JS_RUNNER,
+                                                                                     json.dumps(jobs))
+
+
+def run_program(program, engine):
+    if engine == "mini_racer":
+        from py_mini_racer import MiniRacer
+        return json.loads(MiniRacer().eval(program))
+
+    # Read from stdin, large batches do not fit in a command line argument
+    output = subprocess.run(["node"], input=program + "\nconsole.log(RESULTS);", stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True).stdout
+    return json.loads(output)
+
+
+def get_engine(requested_engine):
+    if requested_engine:
+        return requested_engine
+    try:
+        import py_mini_racer
+        return "mini_racer"
+    except ImportError:
+        if shutil.which("node"):
+            return "node"
+    raise RuntimeError("No JavaScript engine found, install py_mini_racer or node")
+
+
+def synthetic_feature(column, generator):
+    # Mix of categorical, integer and decimal columns, as in the Autopilot sample datasets
+    if column % 3 == 0:
+        return generator.choice(["M", "F", "I", "yes", "no"])
+    if column % 3 == 1:
+        return generator.randint(0, 10000)
+    return round(generator.uniform(0, 1000), 4)
+
+
+def synthetic_predict_request(rows, columns, generator):
+    return {"body": {"data": [[row, ENDPOINT_NAME, [synthetic_feature(column, generator) for column in range(columns)]]
+                              for row in range(rows)]}}
+
+
+def synthetic_predict_response(rows, generator, with_probabilities):
+    predictions = []
+    for _ in range(rows):
+        probability = round(generator.random(), 6)
+        prediction = {"predicted_label": "yes" if probability >= 0.5 else "no"}
+        if with_probabilities:
+            prediction["probability"] = max(probability, 1 - probability)
+            prediction["probabilities"] = [1 - probability, probability]
+            prediction["labels"] = ["no", "yes"]
+        predictions.append(prediction)
+    return {"body": {"predictions": predictions}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Translator correctness and throughput harness")
+    parser.add_argument("--rows", type=int, default=100, help="Rows per synthetic batch")
+    parser.add_argument("--columns", type=int, default=20, help="Feature columns per row")
+    parser.add_argument("--iterations", type=int, default=1000, help="Batches translated per benchmark")
+    parser.add_argument("--engine", choices=["mini_racer", "node"], help="JavaScript engine, detected by default")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic batches")
+    args = parser.parse_args()
+
+    provisioning_benchmark = load_provisioning_benchmark()
+    create_resources = provisioning_benchmark.load_create_resources()
+    translator_bodies = get_translator_bodies(provisioning_benchmark.build_statement_plan(create_resources))
+    proxy_translator_bodies = get_translator_bodies(
+        provisioning_benchmark.build_statement_plan(create_resources, "PROXY"), "@PROXY")
+    for name, body in proxy_translator_bodies.items():
+        if translator_bodies[name[:-len("@PROXY")]] != body:
+            translator_bodies[name] = body
+    engine = get_engine(args.engine)
+    generator = random.Random(args.seed)
+
+    golden_jobs = []
+    for translator_name, cases in sorted(GOLDEN_CASES.items()):
+        for event, expected in cases:
+            golden_jobs.append({"translator": translator_name, "event": event, "expected": expected})
+
+    benchmark_jobs = [
+        {"translator": "AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR",
+         "event": synthetic_predict_request(args.rows, args.columns, generator)},
+        {"translator": "AWS_AUTOPILOT_PREDICT_OUTCOME_REQUEST_TRANSLATOR@PROXY",
+         "event": synthetic_predict_request(args.rows, args.columns, generator)},
+        {"translator": "AWS_AUTOPILOT_PREDICT_OUTCOME_RESPONSE_TRANSLATOR",
+         "event": synthetic_predict_response(args.rows, generator, False)},
+        {"translator": "AWS_AUTOPILOT_PREDICT_OUTCOME_WITH_PROBABILITIES_RESPONSE_TRANSLATOR",
+         "event": synthetic_predict_response(args.rows, generator, True)},
+    ]
+    for job in benchmark_jobs:
+        job["iterations"] = args.iterations
+
+    results = run_program(build_program(translator_bodies, golden_jobs + benchmark_jobs), engine)
+    golden_results, benchmark_results = results[:len(golden_jobs)], results[len(golden_jobs):]
+
+    print("engine: %s, %d translators rendered" % (engine, len(translator_bodies)))
+    print()
+    failures = 0
+    for job, result in zip(golden_jobs, golden_results):
+        if result.get("output", result) == job["expected"]:
+            print("PASS  %s" % job["translator"])
+        else:
+            failures += 1
+            print("FAIL  %s\n      expected: %s\n      actual:   %s"
+                  % (job["translator"], json.dumps(job["expected"]), json.dumps(result)))
+    untested = sorted(set(translator_bodies) - set(GOLDEN_CASES))
+    if untested:
+        print("no golden case: %s" % ", ".join(untested))
+
+    print()
+    print("throughput (%d rows x %d columns per batch, %d batches):" % (args.rows, args.columns, args.iterations))
+    for job, result in zip(benchmark_jobs, benchmark_results):
+        rows_per_second = args.rows * args.iterations / max(result["elapsed_ms"], 1) * 1000
+        print("%12.0f rows/sec  %s" % (rows_per_second, job["translator"]))
+
+    if failures:
+        raise SystemExit("%d golden case(s) failed" % failures)
+
+
+if __name__ == "__main__":
+    main()